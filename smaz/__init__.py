@@ -36,6 +36,10 @@ from lib.smaz import compress, decompress
 compressedData = compress('Hello World!')
 decompressedData = decompress(compressedData)
 
+# Or, working directly with bytes-like objects (bytes, bytearray, memoryview)
+compressedBytes = compress_bytes(b'Hello World!')
+decompressedBytes = decompress_bytes(compressedBytes)
+
 Versions
 ========
 1.0.0 - original release (dict based tree structure)
@@ -54,13 +58,18 @@ The trie based approach gets closer to one megabyte per second on the same setup
 largely due to the inner loop not always checking 7 characters per character - i.e. O(7n) vs O(n). I've tried to balance
 readability with performance, hopefully it's clear what's going on.
 
-Decompression performance is limited by the single byte approach, and reaches 4.0 megabytes per second. To squeeze
-more performance it might be worth considering a multi-byte table for decoding.
+Decompression performance of the single byte approach reaches 4.0 megabytes per second. Inputs of 128 bytes or more
+with few escapes are decoded a run at a time (see decompress_runs), expanding every code between the escapes in a
+single C level call, which is 1.1 to 1.7 times faster on English text. A 65,536 entry table of code pairs was tried,
+but it is slower than the 256 entry table because it falls out of the CPU caches.
 
 After eliminating the O(n^2) string appends, PyPy performance is very impressive.
 
 How should you use it ?
 
+The numbers below were gathered by hand, python -m smaz.bench measures every engine against bz2 and zlib on the
+bundled corpora, and can write the results as JSON.
+
 SMAZ works best on small ASCII English strings up to about 100 bytes. Beyond that length it is outperformed by entropy
 coders (bz2,zlib). Its throughput on small strings is approximately equal to bz2 and zlib, due to the high fixed cost
 per call to the codec.
@@ -201,6 +210,11 @@ __version__ = "1.0.1"
 __maintainer__ = "Max Smith"
 __email__ = None  # Sorry, I get far too much spam as it is. Track me down at http://www.notonbluray.com
 
+import math
+import sys
+from bisect import bisect_left
+from operator import itemgetter
+
 try:
     # noinspection PyShadowingBuiltins
     xrange = range  # Fix for python 3 compatibility.
@@ -208,6 +222,21 @@ except NameError:
     pass
 
 BACKTRACK_LIMIT = 254  # No point backtracking more than 255 characters
+RUN_DECODE_THRESHOLD = 128  # Shorter inputs decode faster a byte at a time, see decompress_runs
+RUN_DECODE_MAX_ESCAPES = 0.14  # Weighted escapes per byte above which decompress_runs is slower than a byte at a time
+RUN_DECODE_255_WEIGHT = 4  # A 255 escape costs decompress_runs a trip round its Python loop, about 4 times a 254
+REGEX_GAP_CACHE_LEN = 16  # Longest unmatched gap the regex engine keeps the encapsulation of
+REGEX_GAP_CACHE_SIZE = 4096  # Most gaps kept per table by the regex engine
+TRAIN_BLOCK_LEN = 65536  # Long samples are counted a block at a time by train
+TRAIN_VALIDATION_EVERY = 10  # train holds back every 10th sample, up to validation_bytes, to measure the ratio on
+TRAIN_SINGLE_CHAR_SAVING = 3  # Weight of single character entries, verbatim characters cost escapes and split runs
+ESTIMATE_COMMON_COST = 0.47  # Output bytes per character in many entries, fitted to the corpora in tests/data
+ESTIMATE_OTHER_COST = 0.85  # Output bytes per character in a single character entry, likewise
+ADAPTIVE_REGEX_LEN = 16  # Shortest string adaptive_compress sends to the regex engine, shorter is faster on the trie
+ADAPTIVE_BACKTRACK_RATIO = 0.75  # Estimated ratio from which backtracking pays off (mixed text, 2-7% smaller)
+ADAPTIVE_ZLIB_LEN = 64  # Shortest string adaptive_compress considers zlib for
+ADAPTIVE_ZLIB_BIAS = 1.1  # zlib is chosen unless SMAZ looks this much smaller, as it's far faster
+ADAPTIVE_ZLIB_LEVEL = 6
 
 
 def make_trie(decode_table):
@@ -315,13 +344,138 @@ DECODE = [" ", "the", "e", "t", "a", "of", "o", "and", "i", "n", "s", "e ", "r",
           " we", "ly", "ee", " n", "id", " cl", "ac", "il", "</", "rt", " wi", "div",
           "e, ", " it", "whi", " ma", "ge", "x", "e c", "men", ".com"]
 
-# Can be regenerated with the below line
-SMAZ_TREE = make_trie(DECODE)
 
+def _smaz_tree():
+    """ The trie for DECODE. It's built on first use rather than at import, as most of the cost of importing smaz is
+        building it, and a process that only decompresses never needs it.
+    """
+    global SMAZ_TREE
+    try:
+        return SMAZ_TREE
+    except NameError:
+        SMAZ_TREE = make_trie(DECODE)
+        return SMAZ_TREE
+
+
+def __getattr__(name):
+    """ Build SMAZ_TREE, or make CacheInfo, when it's first read from the module (Python 3.7+) """
+    if name == 'SMAZ_TREE':
+        return _smaz_tree()
+    elif name == 'CacheInfo':
+        return _cache_info()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+if sys.version_info < (3, 7):
+    SMAZ_TREE = make_trie(DECODE)  # No module __getattr__, so it has to be built now
+
+
+def make_state_machine(compression_tree):
+    """ Compile a trie made by make_trie into a flat state machine, two arrays of 128 slots per trie node indexed by
+        state + ord(ch), where state is the node number * 128. transitions holds the next state, 0 (the root) when
+        there's none, terminals the code for the sequence ending at that character, -1 when there's none.
+
+        Walking the machine is two lookups per character, where the trie is a list lookup, a tuple unpack and an `or`
+        fallback for the missing children. For the default table the arrays are 58KB, on top of the 254KB trie they're
+        compiled from, and compress is about 1.1 times faster on the corpora in tests/data. compress, compress_classic
+        and compress_many compile and cache the machine for the tree they're passed, so there's no need to call this
+        yourself. List copies of the arrays would be about 10% faster again, as reading a state back out of an array
+        boxes a new int, but would take 228KB rather than 58KB.
 
-def _check_ascii(sstr):
-    """ Return True iff the passed string contains only ascii chars """
-    return all(ord(ch) < 128 for ch in sstr)
+    :type compression_tree: list
+
+    :rtype: tuple
+    :return: (transitions, terminals), or None if the trie has non-ASCII characters
+    """
+    from array import array
+    nodes = [compression_tree]
+    states = {id(compression_tree): 0}
+    edges = []
+    for node in nodes:  # Breadth first, nodes grows as we go
+        state = states[id(node)]
+        for ch, slot in enumerate(node):
+            if slot:
+                if ch >= 128:
+                    return None
+                enc_byte, children = slot
+                if children:
+                    states[id(children)] = len(nodes) * 128
+                    nodes.append(children)
+                edges.append((state + ch, states[id(children)] if children else 0,
+                              -1 if enc_byte is None else ord(enc_byte)))
+    typecode = 'h' if len(nodes) * 128 < 32768 else 'l'
+    transitions = array(typecode, [0]) * (len(nodes) * 128)
+    terminals = array('h', [-1]) * (len(nodes) * 128)
+    for slot, next_state, code in edges:
+        transitions[slot] = next_state
+        terminals[slot] = code
+    return transitions, terminals
+
+
+_STATE_MACHINES = {}  # id(compression_tree): (compression_tree, state machine), the trie is kept to pin the id
+_STATE_MACHINES_SIZE = 16
+
+
+def _state_machine(compression_tree):
+    """ The cached state machine for compression_tree, compiled on first use """
+    cached = _STATE_MACHINES.get(id(compression_tree))
+    if cached is None or cached[0] is not compression_tree:
+        if len(_STATE_MACHINES) >= _STATE_MACHINES_SIZE:
+            _STATE_MACHINES.clear()
+        state_machine = make_state_machine(compression_tree)
+        cached = _STATE_MACHINES[id(compression_tree)] = (compression_tree, state_machine)
+    return cached[1]
+
+
+_CODE_CHARS = [chr(i) for i in xrange(256)]
+
+if str is bytes:  # Python 2, a str is already bytes
+    _latin1_codes = bytearray
+    _latin1_bytes = _latin1_str = str
+else:
+    def _latin1_codes(sstr):
+        """ The codes of a str of latin-1 characters, as a bytearray """
+        return bytearray(sstr, 'latin-1')
+
+    def _latin1_bytes(sstr):
+        return sstr.encode('latin-1')
+
+    def _latin1_str(input_bytes):
+        return input_bytes.decode('latin-1')
+
+try:
+    _check_ascii = str.isascii  # Python 3.7+, a single C level pass
+except AttributeError:
+    def _check_ascii(sstr):
+        """ Return True iff the passed string contains only ascii chars """
+        return all(ord(ch) < 128 for ch in sstr)
+_is_ascii = _check_ascii
+
+
+if str is bytes:  # Python 2
+    def _to_utf8(input_str):
+        """ The UTF-8 encoding of input_str, as a str that compress carries verbatim """
+        return input_str if isinstance(input_str, str) else input_str.encode('utf-8')
+
+    def _decode_utf8(output):
+        return output.decode('utf-8')
+else:
+    def _to_utf8(input_str):
+        """ The UTF-8 encoding of input_str, as a str of latin-1 characters that compress carries verbatim """
+        return input_str.encode('utf-8').decode('latin-1')
+
+    def _decode_utf8(output):
+        return output.encode('latin-1').decode('utf-8')
+
+
+def _from_utf8(output, raise_on_error):
+    """ Undo _to_utf8 on decompressed output """
+    try:
+        return _decode_utf8(output)
+    except UnicodeError as e:
+        if raise_on_error:
+            raise ValueError('Invalid input to decompress - bad UTF-8 payload: %s' % e)
+        return None
 
 
 def _encapsulate(input_str):
@@ -379,7 +533,7 @@ def compress_no_backtracking(input_str):
 
 
 def compress(input_str, check_ascii=True, raise_on_error=True, compression_tree=None, backtracking=True,
-             pathological_case_detection=True, backtrack_limit=BACKTRACK_LIMIT):
+             pathological_case_detection=True, backtrack_limit=BACKTRACK_LIMIT, level=None, stats=None, utf8=False):
     """ Compress the passed string using the SMAZ algorithm. Returns the encoded string. Performance is a O(N), but the
         constant will vary depending on the relationship between the compression tree and input_str, in particular the
         average depth explored/average characters per encoded symbol.
@@ -397,6 +551,14 @@ def compress(input_str, check_ascii=True, raise_on_error=True, compression_tree=
     :param backtrack_limit: How many characters to look backwards for backtracking, defaults to 255 - setting it higher
                             may achieve slightly higher compression ratios (0.1% on big strings) at the expense of much
                             worse performance, particularly on random data. You probably want this left as default
+    :param level: Pick the parse, overriding backtracking, from fastest to smallest output:
+                  0 - greedy longest match, the classic SMAZ algorithm (same as backtracking=False)
+                  1 - greedy with backtracking over costly mode switches (same as backtracking=True, the default)
+                  2 - lazy matching, each match is chosen by looking one match ahead
+                  3 - optimal, a shortest path parse giving the smallest possible output for the table
+    :param stats: A SmazStats to count what the compressor did, slower, off by default
+    :param utf8: Accept any text, non-ASCII is UTF-8 encoded and carried in verbatim escapes (default False). Pass
+                 the same to decompress
 
     :type input_str: str
     :type check_ascii: bool
@@ -404,6 +566,9 @@ def compress(input_str, check_ascii=True, raise_on_error=True, compression_tree=
     :type compression_tree: dict
     :type backtracking: bool
     :type pathological_case_detection: bool
+    :type level: int
+    :type stats: SmazStats
+    :type utf8: bool
 
     :rtype: str
     :return: The compressed input_str
@@ -411,30 +576,74 @@ def compress(input_str, check_ascii=True, raise_on_error=True, compression_tree=
     if not input_str:
         return input_str
     else:
-        if check_ascii and not _check_ascii(input_str):
-            if raise_on_error:
-                raise ValueError('SMAZ can only process ASCII text.')
-            else:
-                return None
-
-        # Invariants:
-        terminal_tree_node = (None, None)
-        compression_tree = compression_tree or SMAZ_TREE
-        input_str_len = len(input_str)
-
-        # Invariant: All of these arrays assume len(array) = number of bytes in array
-        output = []          # Single bytes. Committed, non-back-track-able output
-        unmatched = []       # Single bytes. Current pool for encapsulating (i.e. 255/254 + unmatched)
-        backtrack_buff = []  # Single bytes. Encoded between last_backtrack_pos and pos (excl enc_buf and unmatched)
-        enc_buf = []         # Single bytes. Encoded output for the current run of compression codes
-
-        # Ugly but fast
-        output_extend = output.extend
-
-        last_backtrack_pos = pos = 0
-        while pos < input_str_len:
+        is_ascii = None  # Unknown until checked, an O(n) scan before Python 3.7
+        if check_ascii or utf8:
+            is_ascii = _check_ascii(input_str)
+            if not is_ascii:
+                if utf8:
+                    input_str = _to_utf8(input_str)
+                elif raise_on_error:
+                    raise ValueError('SMAZ can only process ASCII text.')
+                else:
+                    return None
+
+        if stats is not None:
+            return _compress_stats(input_str, compression_tree or _smaz_tree(), backtracking,
+                                   pathological_case_detection, backtrack_limit, level, stats)
+        if level is None:
+            return _compress(input_str, compression_tree or _smaz_tree(), backtracking, pathological_case_detection,
+                             backtrack_limit, is_ascii=is_ascii)
+        compress_str, backtracking = _compress_level(level)
+        return compress_str(input_str, compression_tree or _smaz_tree(), backtracking, pathological_case_detection,
+                            backtrack_limit, is_ascii=is_ascii)
+
+
+def _compress(input_str, compression_tree, backtracking, pathological_case_detection, backtrack_limit, lazy=False,
+              is_ascii=None):
+    """ The compress loop, without the argument handling. input_str must be a non-empty str. lazy picks the matches
+        with _lazy_match rather than always taking the longest. is_ascii is whether input_str is ASCII, if the caller
+        has already checked, None to check here.
+    """
+    # Invariants:
+    terminal_tree_node = (None, None)
+    input_str_len = len(input_str)
+
+    # Invariant: All of these arrays assume len(array) = number of bytes in array
+    output = []          # Single bytes. Committed, non-back-track-able output
+    unmatched = []       # Single bytes. Current pool for encapsulating (i.e. 255/254 + unmatched)
+    backtrack_buff = []  # Single bytes. Encoded between last_backtrack_pos and pos (excl enc_buf and unmatched)
+    enc_buf = []         # Single bytes. Encoded output for the current run of compression codes
+
+    # Ugly but fast
+    output_extend = output.extend
+
+    # The state machine needs ASCII, str.isascii is O(1) for str on CPython
+    if is_ascii is None:
+        is_ascii = _is_ascii(input_str)
+    state_machine = _state_machine(compression_tree) if is_ascii else None
+    if state_machine:
+        transitions, terminals = state_machine
+        input_codes = bytearray(input_str, 'ascii')  # ints on Python 2 as well as 3
+        code_chars = _CODE_CHARS
+
+    last_backtrack_pos = pos = 0
+    while pos < input_str_len:
+        enc_byte = None
+        if state_machine:
+            state = 0
+            j = pos
+            while j < input_str_len:  # Walk the state machine for the longest matching sequence
+                slot = state + input_codes[j]
+                code = terminals[slot]
+                state = transitions[slot]
+                j += 1
+                if code >= 0:
+                    enc_byte = code_chars[code]  # Remember this match, and search for a longer one
+                    enc_len = j - pos
+                if not state:
+                    break  # No more matching characters
+        else:
             tree_ptr = compression_tree
-            enc_byte = None
             j = 0
             while j < input_str_len - pos:  # Search the tree for the longest matching sequence
                 byte_val, tree_ptr = tree_ptr[ord(input_str[pos + j])] or terminal_tree_node
@@ -445,79 +654,444 @@ def compress(input_str, check_ascii=True, raise_on_error=True, compression_tree=
                 if not tree_ptr:
                     break  # No more matching characters in the tree
 
-            if enc_byte is None:
-                unmatched.append(input_str[pos])
-                pos += 1  # We didn't match any stems, add the character the unmatched list
+        if enc_byte is None:
+            unmatched.append(input_str[pos])
+            pos += 1  # We didn't match any stems, add the character the unmatched list
+
+            # Backtracking - sometimes it makes sense to go back and not use a length one symbol between two runs of
+            # raw text, since the cost of the context switch is 2 bytes. The following code looks backwards and
+            # tries to judge if the mode switches left us better or worse off. If worse off, re-encode the text as
+            # a raw text run.
+            if len(enc_buf) > 0 or input_str_len == pos:
+                # Mode switch ! or end of string
+                merge_len = _worst_size(pos - last_backtrack_pos)
+                unmerge_len = len(backtrack_buff) + len(enc_buf) + _worst_size(len(unmatched))
+                if merge_len > unmerge_len + 2 or pos - last_backtrack_pos > backtrack_limit or not backtracking:
+                    # Unmerge: gained at least 3 bytes through encoding, reset the backtrack marker to here
+                    output_extend(backtrack_buff)
+                    output_extend(enc_buf)
+                    backtrack_buff = []
+                    last_backtrack_pos = pos - 1
+                elif merge_len < unmerge_len:
+                    # Merge: Mode switch doesn't make sense, don't move backtrack marker
+                    backtrack_buff = []
+                    unmatched = list(input_str[last_backtrack_pos:pos])
+                else:
+                    # Gains are two bytes or less - don't move the backtrack marker till we have a clear gain
+                    backtrack_buff.extend(enc_buf)
+                    if input_str_len == pos:
+                        backtrack_buff.extend(_encapsulate_list(unmatched))
+                        unmatched = []
+                enc_buf = []
+        else:
+            if lazy and enc_len > 1:
+                enc_len, enc_byte = _lazy_match(compression_tree, input_str, pos)
+            # noinspection PyUnboundLocalVariable
+            pos += enc_len  # We did match in the tree, advance along, by the number of bytes matched
+            enc_buf.append(enc_byte)
+            if unmatched:  # Entering an encoding run
+                    backtrack_buff.extend(_encapsulate_list(unmatched))
+                    unmatched = []
 
-                # Backtracking - sometimes it makes sense to go back and not use a length one symbol between two runs of
-                # raw text, since the cost of the context switch is 2 bytes. The following code looks backwards and
-                # tries to judge if the mode switches left us better or worse off. If worse off, re-encode the text as
-                # a raw text run.
-                if len(enc_buf) > 0 or input_str_len == pos:
-                    # Mode switch ! or end of string
-                    merge_len = _worst_size(pos - last_backtrack_pos)
-                    unmerge_len = len(backtrack_buff) + len(enc_buf) + _worst_size(len(unmatched))
-                    if merge_len > unmerge_len + 2 or pos - last_backtrack_pos > backtrack_limit or not backtracking:
-                        # Unmerge: gained at least 3 bytes through encoding, reset the backtrack marker to here
-                        output_extend(backtrack_buff)
-                        output_extend(enc_buf)
-                        backtrack_buff = []
-                        last_backtrack_pos = pos - 1
-                    elif merge_len < unmerge_len:
-                        # Merge: Mode switch doesn't make sense, don't move backtrack marker
-                        backtrack_buff = []
-                        unmatched = list(input_str[last_backtrack_pos:pos])
-                    else:
-                        # Gains are two bytes or less - don't move the backtrack marker till we have a clear gain
-                        backtrack_buff.extend(enc_buf)
-                        if input_str_len == pos:
-                            backtrack_buff.extend(_encapsulate_list(unmatched))
-                            unmatched = []
-                    enc_buf = []
+    output_extend(backtrack_buff)
+    output_extend(_encapsulate_list(unmatched))
+    output_extend(enc_buf)
+
+    # This may look a bit clunky, but it is worth 20% in cPython and O(n^2) -> O(n) in PyPy
+    output = "".join(output)
+
+    # Pathological case detection - Did we grow more than we would by encapsulating the string ?
+    # There are some cases where backtracking doesn't work correctly, examples:
+    # Y OF
+    if pathological_case_detection:
+        worst = _worst_size(input_str_len)
+        if len(output) > worst:
+            return _encapsulate(input_str)
+    return output
+
+
+class SmazStats(object):
+    """ Counters for finding out why the ratio or throughput has shifted, pass one to compress or compress_classic as
+        stats and they add to it. Without stats the normal, uninstrumented, code runs.
+
+        code_hits: how many times each code was output, indexed by code (see top_entries)
+        verbatim_bytes, verbatim_runs: characters output verbatim and the 254/255 escapes they took
+        merges, unmerges, defers: backtracking decisions at mode switches, see compress. Merge re-encodes the text
+                                  since the last decision verbatim, unmerge keeps the codes, defer waits for a clear
+                                  gain
+        pathological: outputs replaced by encapsulating the whole string
+        searches, search_depth: longest match searches, one per symbol, and characters examined by them
+
+        Backtracking and search counts are kept for levels 0 to 2, the level 3 parse only counts its output.
+
+        stats = SmazStats()
+        for message in messages:
+            compress(message, stats=stats)
+        print(stats.as_dict(), stats.top_entries(10))
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Zero all of the counters """
+        self.calls = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.code_hits = [0] * 254
+        self.verbatim_bytes = 0
+        self.verbatim_runs = 0
+        self.merges = 0
+        self.unmerges = 0
+        self.defers = 0
+        self.pathological = 0
+        self.searches = 0
+        self.search_depth = 0
+
+    @property
+    def ratio(self):
+        """ Output bytes / input bytes, None before any input """
+        return float(self.output_bytes) / self.input_bytes if self.input_bytes else None
+
+    @property
+    def mean_search_depth(self):
+        """ Characters examined per longest match search, None before any search """
+        return float(self.search_depth) / self.searches if self.searches else None
+
+    def top_entries(self, n=10, decode_table=None):
+        """ The n most output table entries, most first, as (entry, hits)
+
+        :param decode_table The table the codes are from, by default the SMAZ table
+        """
+        decode_table = decode_table or DECODE
+        hits = sorted(((count, code) for code, count in enumerate(self.code_hits) if count), reverse=True)[:n]
+        return [(decode_table[code], count) for count, code in hits]
+
+    def as_dict(self):
+        """ The counters, and ratio and mean_search_depth, as a dict """
+        counters = dict(vars(self))
+        counters.update(ratio=self.ratio, mean_search_depth=self.mean_search_depth)
+        return counters
+
+    def _count_output(self, input_str, output):
+        """ Count a call, and the codes and verbatim runs in its output """
+        self.calls += 1
+        self.input_bytes += len(input_str)
+        self.output_bytes += len(output)
+        code_hits = self.code_hits
+        output_len = len(output)
+        pos = 0
+        while pos < output_len:
+            code = ord(output[pos])
+            if code < 254:
+                code_hits[code] += 1
+                pos += 1
             else:
-                # noinspection PyUnboundLocalVariable
-                pos += enc_len  # We did match in the tree, advance along, by the number of bytes matched
-                enc_buf.append(enc_byte)
-                if unmatched:  # Entering an encoding run
+                verbatim_len = 1 if code == 254 else ord(output[pos + 1]) + 1
+                pos += verbatim_len + (1 if code == 254 else 2)
+                self.verbatim_bytes += verbatim_len
+                self.verbatim_runs += 1
+
+
+def _compress_stats(input_str, compression_tree, backtracking, pathological_case_detection, backtrack_limit, level,
+                    stats):
+    """ The instrumented version of _compress, for compress and compress_classic with stats. Kept apart so the
+        normal path pays nothing for it, and always walks the trie. The output is identical.
+    """
+    lazy = False
+    if level is not None:
+        compress_str, backtracking = _compress_level(level)
+        if compress_str is _compress_optimal:
+            output = compress_str(input_str, compression_tree, backtracking, pathological_case_detection,
+                                  backtrack_limit)
+            stats._count_output(input_str, output)
+            return output
+        lazy = compress_str is _compress_lazy
+        backtracking = backtracking or lazy
+
+    terminal_tree_node = (None, None)
+    input_str_len = len(input_str)
+    output = []
+    unmatched = []
+    backtrack_buff = []
+    enc_buf = []
+    output_extend = output.extend
+    searches = search_depth = merges = unmerges = defers = 0
+
+    last_backtrack_pos = pos = 0
+    while pos < input_str_len:
+        enc_byte = None
+        tree_ptr = compression_tree
+        j = 0
+        while j < input_str_len - pos:
+            byte_val, tree_ptr = tree_ptr[ord(input_str[pos + j])] or terminal_tree_node
+            j += 1
+            if byte_val is not None:
+                enc_byte = byte_val
+                enc_len = j
+            if not tree_ptr:
+                break
+        searches += 1
+        search_depth += j
+
+        if enc_byte is None:
+            unmatched.append(input_str[pos])
+            pos += 1
+            if len(enc_buf) > 0 or input_str_len == pos:
+                merge_len = _worst_size(pos - last_backtrack_pos)
+                unmerge_len = len(backtrack_buff) + len(enc_buf) + _worst_size(len(unmatched))
+                if merge_len > unmerge_len + 2 or pos - last_backtrack_pos > backtrack_limit or not backtracking:
+                    unmerges += 1
+                    output_extend(backtrack_buff)
+                    output_extend(enc_buf)
+                    backtrack_buff = []
+                    last_backtrack_pos = pos - 1
+                elif merge_len < unmerge_len:
+                    merges += 1
+                    backtrack_buff = []
+                    unmatched = list(input_str[last_backtrack_pos:pos])
+                else:
+                    defers += 1
+                    backtrack_buff.extend(enc_buf)
+                    if input_str_len == pos:
                         backtrack_buff.extend(_encapsulate_list(unmatched))
                         unmatched = []
+                enc_buf = []
+        else:
+            if lazy and enc_len > 1:
+                enc_len, enc_byte = _lazy_match(compression_tree, input_str, pos)
+            # noinspection PyUnboundLocalVariable
+            pos += enc_len
+            enc_buf.append(enc_byte)
+            if unmatched:
+                backtrack_buff.extend(_encapsulate_list(unmatched))
+                unmatched = []
+
+    output_extend(backtrack_buff)
+    output_extend(_encapsulate_list(unmatched))
+    output_extend(enc_buf)
+    output = "".join(output)
+    if pathological_case_detection and len(output) > _worst_size(input_str_len):
+        stats.pathological += 1
+        output = _encapsulate(input_str)
+
+    stats.searches += searches
+    stats.search_depth += search_depth
+    stats.merges += merges
+    stats.unmerges += unmerges
+    stats.defers += defers
+    stats._count_output(input_str, output)
+    return output
+
+
+def _matches(compression_tree, input_str, pos):
+    """ (length, code) of every entry in the tree matching input_str at pos, shortest first """
+    matches = []
+    tree_ptr = compression_tree
+    for j in xrange(pos, len(input_str)):
+        node = tree_ptr[ord(input_str[j])]
+        if not node:
+            break
+        enc_byte, tree_ptr = node
+        if enc_byte is not None:
+            matches.append((j - pos + 1, enc_byte))
+        if not tree_ptr:
+            break
+    return matches
+
+
+def _lazy_match(compression_tree, input_str, pos):
+    """ Level 2 match selection. Where shorter entries also match at pos, take the one that reaches furthest together
+        with the longest match after it, ties going to the longer. For example "sits" is "si" "t" "s" greedily, but
+        "s" "its" lazily.
+
+    :rtype: tuple
+    :return: (length, code)
+    """
+    matches = _matches(compression_tree, input_str, pos)
+    best = matches[-1]
+    if len(matches) > 1:
+        best_reach = 0
+        for match in reversed(matches):
+            next_matches = _matches(compression_tree, input_str, pos + match[0])
+            reach = match[0] + (next_matches[-1][0] if next_matches else 0)
+            if reach > best_reach:
+                best_reach, best = reach, match
+    return best
+
+
+def _compress_lazy(input_str, compression_tree, backtracking, pathological_case_detection, backtrack_limit,
+                   is_ascii=None):
+    """ Level 2, backtracking with lazy matching, see _lazy_match """
+    return _compress(input_str, compression_tree, True, pathological_case_detection, backtrack_limit, True, is_ascii)
+
+
+def _compress_optimal(input_str, compression_tree, backtracking, pathological_case_detection, backtrack_limit,
+                      is_ascii=None):
+    """ Level 3. The output is a sequence of codes (1 byte each) and verbatim chunks (2 bytes for 1 character, the
+        length + 2 for 2 to 255), so the smallest output is the shortest path from the start to the end of the string,
+        where cost[i] is the smallest output for input_str[:i]. Codes are relaxed forwards along the trie, at most 7
+        per position. A chunk ending at i costs cost[j] - j + i + 2 for a start j in i - 255 .. i - 2, so the best
+        start is a sliding window minimum of cost[j] - j, kept in a deque, which makes the whole parse O(n).
+        input_str must be a non-empty str, the output never needs pathological case detection. is_ascii is unused, it
+        walks the trie, and only there to match _compress.
+    """
+    input_str_len = len(input_str)
+    cost = [0] + [3 * input_str_len] * input_str_len
+    steps = [None] * (input_str_len + 1)  # (previous position, code or None for a verbatim chunk)
+    from collections import deque
+    window = deque()  # Chunk starts, in order, with increasing cost[j] - j
+
+    for pos in xrange(input_str_len + 1):
+        if pos >= 2:
+            start = pos - 2
+            key = cost[start] - start
+            while window and cost[window[-1]] - window[-1] >= key:
+                window.pop()
+            window.append(start)
+            while window[0] < pos - 255:
+                window.popleft()
+            chunk_cost = cost[window[0]] - window[0] + pos + 2
+            if chunk_cost < cost[pos]:
+                cost[pos] = chunk_cost
+                steps[pos] = (window[0], None)
+        if pos >= 1 and cost[pos - 1] + 2 < cost[pos]:
+            cost[pos] = cost[pos - 1] + 2
+            steps[pos] = (pos - 1, None)
+        if pos < input_str_len:
+            next_cost = cost[pos] + 1
+            for length, enc_byte in _matches(compression_tree, input_str, pos):
+                if next_cost < cost[pos + length]:
+                    cost[pos + length] = next_cost
+                    steps[pos + length] = (pos, enc_byte)
+
+    output = []
+    pos = input_str_len
+    while pos:
+        start, enc_byte = steps[pos]
+        output.append(_encapsulate(input_str[start:pos]) if enc_byte is None else enc_byte)
+        pos = start
+    output.reverse()
+    return "".join(output)
+
+
+def _compress_level(level):
+    """ The compress loop and backtracking setting for a compression level """
+    if level == 0 or level == 1:
+        return _compress, level == 1
+    elif level == 2:
+        return _compress_lazy, False
+    elif level == 3:
+        return _compress_optimal, False
+    raise ValueError('Compression level must be from 0 to 3: %r' % (level,))
+
+
+def _regex_pattern(tree_node):
+    """ The regex alternation for a node of a make_tree tree. Each child's subtree is a group, optional when the child
+        is itself an entry, and as ? is greedy the longest entry is always tried first.
+    """
+    import re
+    alternatives = []
+    for ch, (enc_byte, children) in sorted(tree_node.items()):
+        if children:
+            alternatives.append('%s(?:%s)%s' % (re.escape(ch), _regex_pattern(children),
+                                                '' if enc_byte is None else '?'))
+        else:
+            alternatives.append(re.escape(ch))
+    return '|'.join(alternatives)
 
-        output_extend(backtrack_buff)
-        output_extend(_encapsulate_list(unmatched))
-        output_extend(enc_buf)
 
-        # This may look a bit clunky, but it is worth 20% in cPython and O(n^2) -> O(n) in PyPy
-        output = "".join(output)
+class _RegexCodes(dict):
+    """ What each token from the regex engine's split encodes to: the code for a matched entry, or the encapsulated
+        text for an unmatched gap. Gaps are encapsulated on a miss, and short ones are kept, up to a limit, as the same
+        few recur. Nothing is ever removed, so it's safe to share between threads.
+    """
+    __slots__ = ()
 
-        # Pathological case detection - Did we grow more than we would by encapsulating the string ?
-        # There are some cases where backtracking doesn't work correctly, examples:
-        # Y OF
-        if pathological_case_detection:
-            worst = _worst_size(input_str_len)
-            if len(output) > worst:
-                return _encapsulate(input_str)
+    def __missing__(self, gap):
+        output = _encapsulate(gap)
+        if len(gap) <= REGEX_GAP_CACHE_LEN and len(self) < REGEX_GAP_CACHE_SIZE:
+            self[gap] = output
         return output
 
 
-def compress_classic(input_str, pathological_case_detection=True):
+def make_regex(decode_table):
+    """ Compile the passed table into a regex for the regex engine of compress_classic. The entries are nested as a
+        trie (e.g. t(?:he?|o)?) so the longest entry at each position is matched, just as the classic compressor does.
+        re.split then tokenizes the input at C speed, with the unmatched text falling out as the gaps between matches,
+        and every token is encoded with one C level dict lookup.
+
+    :type decode_table: list
+
+    :rtype: tuple
+    :return: (compiled regex, token codes), for compress_classic's compression_regex
+    """
+    import re
+    codes = _RegexCodes((sstr, chr(enc_byte)) for enc_byte, sstr in enumerate(decode_table))
+    codes[''] = ''  # No gap between two matches
+    return re.compile('(%s)' % _regex_pattern(make_tree(decode_table)), re.DOTALL), codes
+
+
+def _smaz_regex():
+    """ make_regex(DECODE), compiled on first use """
+    global _SMAZ_REGEX
+    try:
+        return _SMAZ_REGEX
+    except NameError:
+        _SMAZ_REGEX = make_regex(DECODE)
+        return _SMAZ_REGEX
+
+
+def _compress_regex(input_str, compression_regex):
+    """ The regex engine of compress_classic, input_str must be a non-empty str """
+    regex, codes = compression_regex
+    # Alternately the unmatched gaps, often empty, and the matched entries. A gap can never be an entry, as it would
+    # have matched
+    return "".join(map(codes.__getitem__, regex.split(input_str)))
+
+
+def compress_classic(input_str, pathological_case_detection=True, engine='trie', compression_regex=None, stats=None):
     """ A trie version of the original SMAZ compressor, should give identical output to C version.
         Faster on typical material, but can be tripped up by pathological cases.
         :type input_str: str
         :type pathological_case_detection: bool
+        :type engine: str
+        :type compression_regex: tuple
+        :type stats: SmazStats
 
         :param input_str The string to be compressed
         :param pathological_case_detection Look for growth beyond the worst case of encapsulation and encapsulate
                default is True, you probably want this enabled.
+        :param engine 'trie' (default) walks the trie a character at a time, 'regex' tokenizes with a regex (see
+               make_regex), 1.2 to 1.7 times faster. The output is identical.
+        :param compression_regex The regex engine's table, from make_regex, default is the SMAZ table
+        :param stats A SmazStats to count what the compressor did, slower, off by default. Counted with the trie,
+               or for a custom compression_regex only the output is counted
 
         :rtype: str
         :return: The compressed input_str
         """
+    if engine not in ('trie', 'regex'):
+        raise ValueError('Unknown compression engine: %s' % engine)
     if not input_str:
         return input_str
+    elif stats is not None and not compression_regex:
+        return _compress_stats(input_str, _smaz_tree(), False, pathological_case_detection, BACKTRACK_LIMIT, None,
+                               stats)
+    elif engine == 'regex' or compression_regex:
+        output = _compress_regex(input_str, compression_regex or _smaz_regex())
+        if pathological_case_detection and len(output) > _worst_size(len(input_str)):
+            output = _encapsulate(input_str)
+            if stats is not None:
+                stats.pathological += 1
+        if stats is not None:
+            stats._count_output(input_str, output)
+        return output
     else:
         # Invariants:
         terminal_tree_node = (None, None)
         input_str_len = len(input_str)
+        smaz_tree = _smaz_tree()
 
         # Invariant: All of these arrays assume len(array) = number of bytes in array
         output = []     # Single bytes. Committed, non-back-track-able output
@@ -527,19 +1101,39 @@ def compress_classic(input_str, pathological_case_detection=True):
         output_extend = output.extend
         output_append = output.append
 
+        state_machine = _state_machine(smaz_tree) if _is_ascii(input_str) else None
+        if state_machine:
+            transitions, terminals = state_machine
+            input_codes = bytearray(input_str, 'ascii')  # ints on Python 2 as well as 3
+            code_chars = _CODE_CHARS
+
         pos = 0
         while pos < input_str_len:
-            tree_ptr = SMAZ_TREE
             enc_byte = None
-            j = 0
-            while j < input_str_len - pos:  # Search the tree for the longest matching sequence
-                byte_val, tree_ptr = tree_ptr[ord(input_str[pos + j])] or terminal_tree_node
-                j += 1
-                if byte_val is not None:
-                    enc_byte = byte_val  # Remember this match, and search for a longer one
-                    enc_len = j
-                if not tree_ptr:
-                    break  # No more matching characters in the tree
+            if state_machine:
+                state = 0
+                j = pos
+                while j < input_str_len:  # Walk the state machine for the longest matching sequence
+                    slot = state + input_codes[j]
+                    code = terminals[slot]
+                    state = transitions[slot]
+                    j += 1
+                    if code >= 0:
+                        enc_byte = code_chars[code]  # Remember this match, and search for a longer one
+                        enc_len = j - pos
+                    if not state:
+                        break  # No more matching characters
+            else:
+                tree_ptr = smaz_tree
+                j = 0
+                while j < input_str_len - pos:  # Search the tree for the longest matching sequence
+                    byte_val, tree_ptr = tree_ptr[ord(input_str[pos + j])] or terminal_tree_node
+                    j += 1
+                    if byte_val is not None:
+                        enc_byte = byte_val  # Remember this match, and search for a longer one
+                        enc_len = j
+                    if not tree_ptr:
+                        break  # No more matching characters in the tree
 
             if enc_byte is None:
                 unmatched.append(input_str[pos])
@@ -560,50 +1154,321 @@ def compress_classic(input_str, pathological_case_detection=True):
             return "".join(output)
 
 
-def decompress(input_str, raise_on_error=True, check_ascii=False, decompress_table=None):
+_ESTIMATE_CLASSES = {}  # id(decompress_table): (decompress_table, translation), the table is kept to pin the id
+
+
+def _estimate_classes(decompress_table):
+    """ The cached bytes.translate table for estimate_size, mapping every byte to its class: c for the common
+        characters, those in at least 1/16th of the entries, a for the rest of the characters with an entry of their
+        own, and x for everything that can only be sent verbatim.
+    """
+    cached = _ESTIMATE_CLASSES.get(id(decompress_table))
+    if cached is None or cached[0] is not decompress_table:
+        if len(_ESTIMATE_CLASSES) >= _STATE_MACHINES_SIZE:
+            _ESTIMATE_CLASSES.clear()
+        from collections import Counter
+        counts = Counter(ch for sstr in decompress_table for ch in set(sstr))
+        common = max(1, len(decompress_table) // 16)
+        classes = bytearray(b'x' * 256)
+        for sstr in decompress_table:
+            if len(sstr) == 1 and ord(sstr) < 256:
+                classes[ord(sstr)] = ord('c') if counts[sstr] >= common else ord('a')
+        cached = _ESTIMATE_CLASSES[id(decompress_table)] = (decompress_table, bytes(classes))
+    return cached[1]
+
+
+def estimate_size(input_str, decompress_table=None):
+    """ Estimate the length of compress(input_str), without compressing it. Every character is classified with one
+        C level bytes.translate, and the classes and verbatim runs counted with bytes.count, so it costs about as much
+        as a couple of copies of the input, 5 to 30 times faster than compress, and the most on the random tokens,
+        numbers and base64 that don't compress. Characters without an entry of their own are costed exactly as
+        verbatim runs, the rest at the average fitted to the test corpora. Typically within 10% of the true size.
+
+    :type input_str: str
+    :type decompress_table: list
+
+    :param input_str The str (or bytes) to be estimated, non-ASCII characters are costed as their UTF-8 bytes
+    :param decompress_table The table it would be compressed with, default is the SMAZ table
+
+    :rtype: int
+    :return: The estimated length of the compressed input_str
+    """
+    if not input_str:
+        return 0
+    if not isinstance(input_str, bytes):
+        input_str = input_str.encode('utf-8')
+    classes = input_str.translate(_estimate_classes(decompress_table or DECODE))
+    verbatim = classes.count(b'x')
+    common = classes.count(b'c')
+    other = len(classes) - common - verbatim
+    if verbatim:
+        # Every verbatim run costs 2 bytes of escapes, except single characters, which cost 1 (254 + character)
+        runs = classes.count(b'ax') + classes.count(b'cx') + classes.startswith(b'x')
+        long_runs = classes.count(b'axx') + classes.count(b'cxx') + classes.startswith(b'xx')
+        verbatim += runs + long_runs + 2 * (verbatim // 256)
+    return int(ESTIMATE_COMMON_COST * common + ESTIMATE_OTHER_COST * other + verbatim + 0.5)
+
+
+def is_worth_compressing(input_str, threshold=0.9, decompress_table=None):
+    """ Is input_str likely to compress to at most threshold times its length? A cheap check, see estimate_size, for
+        skipping SMAZ on inputs it won't pay off on.
+
+    :type input_str: str
+    :type threshold: float
+    :type decompress_table: list
+
+    :param input_str The str to be checked
+    :param threshold The largest worthwhile ratio of compressed to original length (default 0.9)
+    :param decompress_table The table it would be compressed with, default is the SMAZ table
+
+    :rtype: bool
+    """
+    return bool(input_str) and estimate_size(input_str, decompress_table) <= threshold * len(input_str)
+
+
+# adaptive_compress codecs, the first byte of its output
+ADAPTIVE_RAW = 0  # UTF-8
+ADAPTIVE_SMAZ_CLASSIC = 1  # compress_classic
+ADAPTIVE_SMAZ = 2  # compress, with backtracking
+ADAPTIVE_ZLIB = 3  # Raw deflate of the UTF-8, no zlib header or checksum
+
+
+def _estimate_deflate_size(length):
+    """ The typical raw deflate size of length bytes of text, fitted to the corpora in tests/data. Deflate's ratio
+        improves with the log of the length, as it finds more to refer back to, down to about 0.35 for prose.
+    """
+    return length * max(0.35, 1.59 - 0.159 * math.log(length))
+
+
+def _adaptive_codec(input_str, length):
+    """ The codec adaptive_compress uses for input_str, which is length bytes as UTF-8 """
+    smaz_size = estimate_size(input_str)
+    if length >= ADAPTIVE_ZLIB_LEN and _estimate_deflate_size(length) <= smaz_size * ADAPTIVE_ZLIB_BIAS:
+        return ADAPTIVE_ZLIB
+    elif smaz_size >= length:
+        return ADAPTIVE_RAW
+    elif smaz_size >= ADAPTIVE_BACKTRACK_RATIO * length:
+        return ADAPTIVE_SMAZ
+    else:
+        return ADAPTIVE_SMAZ_CLASSIC
+
+
+def adaptive_compress(input_str):
+    """ Compress input_str with whichever of SMAZ, zlib or nothing at all suits it best, without trying them out.
+        The choice is made from the length and estimate_size: SMAZ on short text, backtracking only where the text is
+        mixed enough for it to pay off, zlib once the input is long enough for it to win (it's also 50 times faster),
+        and the raw text for numbers, hashes and the like. Should the choice turn out bigger than the raw text,
+        the raw text is used. The codec is recorded in the first byte, so adaptive_decompress needs no options.
+
+    :type input_str: str
+
+    :param input_str The str to be compressed, any text, see compress's utf8
+
+    :rtype: bytes
+    :return: The codec byte (ADAPTIVE_RAW, ADAPTIVE_SMAZ_CLASSIC, ADAPTIVE_SMAZ or ADAPTIVE_ZLIB) and the payload
+    """
+    raw = input_str.encode('utf-8')
+    codec = _adaptive_codec(input_str, len(raw)) if raw else ADAPTIVE_RAW
+    if codec == ADAPTIVE_ZLIB:
+        import zlib
+        compressor = zlib.compressobj(ADAPTIVE_ZLIB_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        payload = compressor.compress(raw) + compressor.flush()
+    elif codec == ADAPTIVE_SMAZ:
+        payload = _latin1_bytes(compress(input_str, utf8=True))
+    elif codec == ADAPTIVE_SMAZ_CLASSIC:
+        if len(input_str) < ADAPTIVE_REGEX_LEN or len(raw) != len(input_str):
+            payload = compress(input_str, level=0, utf8=True)
+        else:
+            payload = compress_classic(input_str, engine='regex')
+        payload = _latin1_bytes(payload)
+    if codec == ADAPTIVE_RAW or len(payload) >= len(raw):
+        return bytes(bytearray((ADAPTIVE_RAW,))) + raw
+    return bytes(bytearray((codec,))) + payload
+
+
+def adaptive_decompress(input_bytes):
+    """ Decompress the output of adaptive_compress
+
+    :type input_bytes: bytes
+
+    :param input_bytes The bytes-like output of adaptive_compress
+
+    :rtype: str
+    :return: The original str
+    """
+    view = memoryview(input_bytes)
+    if not len(view):
+        raise ValueError('Empty adaptive stream, expected a codec byte')
+    codec = bytearray(view[:1])[0]
+    payload = view[1:].tobytes()
+    if codec == ADAPTIVE_RAW:
+        return payload.decode('utf-8')
+    elif codec in (ADAPTIVE_SMAZ, ADAPTIVE_SMAZ_CLASSIC):
+        return decompress(_latin1_str(payload), utf8=True)
+    elif codec == ADAPTIVE_ZLIB:
+        import zlib
+        try:
+            return zlib.decompress(payload, -zlib.MAX_WBITS).decode('utf-8')
+        except zlib.error as e:
+            raise ValueError('Corrupt adaptive stream: %s' % e)
+    raise ValueError('Unknown adaptive codec: %d' % codec)
+
+
+def _make_run_table(decompress_table):
+    """ Build the lookup used by decompress_runs: the decode table plus a trailing separator entry, whose code is the
+        first code the table does not define. Returns None if the separator character occurs in a table entry, in
+        which case the run engine can't be used for the table.
+    """
+    separator = chr(len(decompress_table))
+    if any(separator in sstr for sstr in decompress_table):
+        return None
+    return list(decompress_table) + [separator]
+
+
+def _escape_split():
+    """ Splits a str on the 254/255 escapes and the byte after each, for decompress_runs. Compiled on first use, as
+        importing re alone takes longer than the rest of importing smaz.
+    """
+    global _ESCAPE_SPLIT
+    try:
+        return _ESCAPE_SPLIT
+    except NameError:
+        import re
+        _ESCAPE_SPLIT = re.compile('([\xfe\xff])(.)', re.DOTALL).split
+        return _ESCAPE_SPLIT
+
+
+def _escape_search():
+    """ Finds the next 254/255 escape, for SmazDecompressor, compiled on first use """
+    global _ESCAPE_SEARCH
+    try:
+        return _ESCAPE_SEARCH
+    except NameError:
+        import re
+        _ESCAPE_SEARCH = re.compile('[\xfe\xff]').search
+        return _ESCAPE_SEARCH
+
+
+_DECODE_RUN_TABLE = _make_run_table(DECODE)
+
+
+def decompress_runs(input_str, raise_on_error=True, check_ascii=False, decompress_table=None):
+    """ Run level decoder, gives identical results to decompress. Rather than decoding a byte at a time, the input is
+        split on the 254/255 escapes with a regex, all of the runs of plain codes are joined and expanded in a single
+        operator.itemgetter call, and the verbatim text is spliced back in. Only the 255 escapes are touched by the
+        Python loop. Roughly 1.1 to 1.7 times faster than the byte at a time loop on large inputs of English text, not
+        the 3 times once hoped for: the itemgetter expansion alone takes about a third of the time of the loop, and a
+        65,536 entry table of code pairs is no faster. The fixed cost makes it slower on strings shorter than ~100
+        bytes, and on input with many escapes (source code, tables, compress_classic output) it can be 15-25% slower,
+        see _runs_pay_off. Malformed input is handed to the byte at a time loop so errors are reported identically.
+
+        :type input_str: str
+        :type raise_on_error: bool
+        :type check_ascii: bool
+        :type decompress_table: list
+
+        :param raise_on_error Throw an exception on any kind of decode error, if false, return None on error
+        :param check_ascii Check that all output is ASCII. Will raise or return None depending on raise_on_error
+        :param decompress_table Alternative 253 entry decode table, by default uses SMAZ
+
+        :rtype: str
+        :return: The decompressed input_str
+    """
+    if not input_str:
+        return input_str
+    run_table = _make_run_table(decompress_table) if decompress_table else _DECODE_RUN_TABLE
+    if run_table is None:
+        return decompress(input_str, raise_on_error, check_ascii, decompress_table, run_decoding=False)
+
+    expanded = _decompress_runs(input_str, run_table)
+    if expanded is None:  # Malformed input, let the byte at a time loop report it
+        return decompress(input_str, raise_on_error, check_ascii, decompress_table, run_decoding=False)
+    if check_ascii and not _check_ascii(expanded):
+        if raise_on_error:
+            raise ValueError('Invalid input to decompress - non-ascii byte payload')
+        else:
+            return None
+    return expanded
+
+
+def _runs_pay_off(input_str):
+    """ True if input_str is long enough, with few enough escapes, for decompress_runs to beat the byte at a time loop.
+        The two counts are C level scans, a few microseconds a kilobyte.
+    """
+    input_len = len(input_str)
+    return input_len >= RUN_DECODE_THRESHOLD and input_str.count('\xfe') + \
+        RUN_DECODE_255_WEIGHT * input_str.count('\xff') <= input_len * RUN_DECODE_MAX_ESCAPES
+
+
+def _decompress_runs(input_str, run_table):
+    """ The run level decode, without the argument handling. Returns None if the input is malformed """
+    # parts is [run, escape, escape byte, run, escape, escape byte, ..., run]
+    parts = _escape_split()(input_str)
+    runs = parts[0::3]
+    verbatim = parts[2::3]
+    if verbatim:
+        # A 255 escape byte is the length of the verbatim string, which the regex leaves at the start of the next run
+        escapes = "".join(parts[1::3])
+        i = escapes.find(chr(255))
+        while i >= 0:
+            end_pos = ord(verbatim[i]) + 1
+            run = runs[i + 1]
+            if len(run) < end_pos:  # Buffer overflow, or an escape inside the verbatim string
+                return None
+            verbatim[i] = run[:end_pos]
+            runs[i + 1] = run[end_pos:]
+            i = escapes.find(chr(255), i + 1)
+
+    separator = run_table[-1]
+    codes = _latin1_codes(separator.join(runs))
+    try:
+        if len(codes) > 1:
+            expanded = "".join(itemgetter(*codes)(run_table))
+        else:
+            expanded = run_table[codes[0]] if codes else ''
+    except IndexError:  # A code beyond the end of the table
+        return None
+
+    if verbatim:
+        expanded_runs = expanded.split(separator)
+        if len(expanded_runs) != len(runs):  # The separator code was in the input
+            return None
+        output = [None] * (len(runs) + len(verbatim))
+        output[0::2] = expanded_runs
+        output[1::2] = verbatim
+        expanded = "".join(output)
+    elif separator in expanded:
+        return None
+    return expanded
+
+
+def decompress(input_str, raise_on_error=True, check_ascii=False, decompress_table=None, run_decoding=True,
+               utf8=False):
     """ Returns decoded text from the input_str using the SMAZ algorithm by default
         :type input_str: str
         :type raise_on_error: bool
         :type check_ascii: bool
         :type decompress_table: list
+        :type run_decoding: bool
+        :type utf8: bool
 
         :param raise_on_error Throw an exception on any kind of decode error, if false, return None on error
         :param check_ascii Check that all output is ASCII. Will raise or return None depending on raise_on_error
         :param decompress_table Alternative 253 entry decode table, by default uses SMAZ
+        :param run_decoding Hand inputs of RUN_DECODE_THRESHOLD bytes or more with few escapes (see
+                            RUN_DECODE_MAX_ESCAPES) to decompress_runs (default True)
+        :param utf8 Decode non-ASCII output as UTF-8, for the output of compress(..., utf8=True) (default False)
 
         :rtype: str
         :return: The decompressed input_str
     """
     if not input_str:
         return input_str
+    elif run_decoding and _runs_pay_off(input_str):
+        output = decompress_runs(input_str, raise_on_error, check_ascii, decompress_table)
     else:
-        decompress_table = decompress_table or DECODE
-        input_str_len = len(input_str)
-        output = []
-        output_append = output.append
-        pos = 0
         try:
-            while pos < input_str_len:
-                ch = ord(input_str[pos])
-                pos += 1
-                if ch < 254:
-                    # Code table entry
-                    output_append(decompress_table[ch])
-                else:
-                    next_byte = input_str[pos]
-                    pos += 1
-                    if 254 == ch:
-                        # Verbatim byte
-                        output_append(next_byte)
-                    else:  # 255 == ch:
-                        # Verbatim string
-                        end_pos = pos + ord(next_byte) + 1
-                        if end_pos > input_str_len:
-                            raise ValueError('Invalid input to decompress - buffer overflow')
-                        output_append(input_str[pos:end_pos])
-                        pos = end_pos
-            # This may look a bit clunky, but it is worth 20% in cPython and O(n^2)->O(n) in PyPy
-            output = "".join(output)
+            output = _decompress(input_str, decompress_table or DECODE)
             if check_ascii and not _check_ascii(output):
                 raise ValueError('Invalid input to decompress - non-ascii byte payload')
         except (IndexError, ValueError) as e:
@@ -611,4 +1476,908 @@ def decompress(input_str, raise_on_error=True, check_ascii=False, decompress_tab
                 raise ValueError(str(e))
             else:
                 return None
+    if utf8 and output and not _is_ascii(output):
+        return _from_utf8(output, raise_on_error)
+    return output
+
+
+def _decompress(input_str, decompress_table):
+    """ The byte at a time decompress loop, without the argument handling. Raises IndexError or ValueError on bad
+        input.
+    """
+    input_str_len = len(input_str)
+    output = []
+    output_append = output.append
+    pos = 0
+    while pos < input_str_len:
+        ch = ord(input_str[pos])
+        pos += 1
+        if ch < 254:
+            # Code table entry
+            output_append(decompress_table[ch])
+        else:
+            next_byte = input_str[pos]
+            pos += 1
+            if 254 == ch:
+                # Verbatim byte
+                output_append(next_byte)
+            else:  # 255 == ch:
+                # Verbatim string
+                end_pos = pos + ord(next_byte) + 1
+                if end_pos > input_str_len:
+                    raise ValueError('Invalid input to decompress - buffer overflow')
+                output_append(input_str[pos:end_pos])
+                pos = end_pos
+    # This may look a bit clunky, but it is worth 20% in cPython and O(n^2)->O(n) in PyPy
+    return "".join(output)
+
+
+def compress_many(input_strs, check_ascii=True, raise_on_error=True, compression_tree=None, backtracking=True,
+                  pathological_case_detection=True, backtrack_limit=BACKTRACK_LIMIT, lazy=False, level=None,
+                  utf8=False):
+    """ Compress every string in an iterable with the same options as compress. The tree and options are resolved
+        once for the whole batch, and the ascii check is a single C level call per string, which matters when the
+        strings are only a few bytes long and the per call overhead of compress dominates.
+
+    :param input_strs An iterable of ASCII strs to be compressed
+    :param check_ascii Check each str is ASCII before we encode it (default True)
+    :param raise_on_error Throw a value type exception on non-ASCII input, otherwise None is produced for that string
+    :param compression_tree: See compress
+    :param backtracking: See compress
+    :param pathological_case_detection: See compress
+    :param backtrack_limit: See compress
+    :param lazy: Return a generator rather than a list (default False)
+    :param level: See compress
+    :param utf8: See compress
+
+    :type input_strs: collections.Iterable
+    :type lazy: bool
+    :type level: int
+    :type utf8: bool
+
+    :rtype: list | generator
+    :return: The compressed strs, in input order
+    """
+    compress_str = _compress
+    if level is not None:
+        compress_str, backtracking = _compress_level(level)
+    results = _compress_many(input_strs, check_ascii, raise_on_error, compression_tree or _smaz_tree(), backtracking,
+                             pathological_case_detection, backtrack_limit, compress_str, utf8)
+    return results if lazy else list(results)
+
+
+def _compress_many(input_strs, check_ascii, raise_on_error, compression_tree, backtracking,
+                   pathological_case_detection, backtrack_limit, _compress_str=_compress, utf8=False):
+    """ Generator behind compress_many """
+    check = check_ascii or utf8
+    is_ascii = _is_ascii
+    for input_str in input_strs:
+        if not input_str:
+            yield input_str
+        elif not check:
+            yield _compress_str(input_str, compression_tree, backtracking, pathological_case_detection,
+                                backtrack_limit)
+        elif is_ascii(input_str):
+            yield _compress_str(input_str, compression_tree, backtracking, pathological_case_detection,
+                                backtrack_limit, is_ascii=True)
+        elif utf8:
+            yield _compress_str(_to_utf8(input_str), compression_tree, backtracking, pathological_case_detection,
+                                backtrack_limit, is_ascii=False)
+        elif raise_on_error:
+            raise ValueError('SMAZ can only process ASCII text.')
+        else:
+            yield None
+
+
+def decompress_many(input_strs, raise_on_error=True, check_ascii=False, decompress_table=None, run_decoding=True,
+                    lazy=False, utf8=False):
+    """ Decompress every string in an iterable with the same options as decompress, resolving the decode tables once
+        for the whole batch.
+
+        :type input_strs: collections.Iterable
+        :type raise_on_error: bool
+        :type check_ascii: bool
+        :type decompress_table: list
+        :type run_decoding: bool
+        :type lazy: bool
+        :type utf8: bool
+
+        :param raise_on_error Throw an exception on any kind of decode error, if false, produce None for that string
+        :param check_ascii Check that all output is ASCII. Will raise or produce None depending on raise_on_error
+        :param decompress_table Alternative 253 entry decode table, by default uses SMAZ
+        :param run_decoding See decompress
+        :param lazy Return a generator rather than a list (default False)
+        :param utf8 See decompress
+
+        :rtype: list | generator
+        :return: The decompressed strs, in input order
+    """
+    if not run_decoding:
+        run_table = None
+    elif decompress_table:
+        run_table = _make_run_table(decompress_table)
+    else:
+        run_table = _DECODE_RUN_TABLE
+    results = _decompress_many(input_strs, raise_on_error, check_ascii, decompress_table or DECODE, run_table, utf8)
+    return results if lazy else list(results)
+
+
+def _decompress_many(input_strs, raise_on_error, check_ascii, decompress_table, run_table, utf8=False):
+    """ Generator behind decompress_many, run_table is None to always decode a byte at a time """
+    _decompress_str = _decompress
+    _decompress_runs_str = _decompress_runs
+    is_ascii = _is_ascii
+    runs_pay_off = _runs_pay_off
+    for input_str in input_strs:
+        if not input_str:
+            yield input_str
+            continue
+        try:
+            output = None
+            if run_table is not None and runs_pay_off(input_str):
+                output = _decompress_runs_str(input_str, run_table)
+            if output is None:
+                output = _decompress_str(input_str, decompress_table)
+            if check_ascii and not is_ascii(output):
+                raise ValueError('Invalid input to decompress - non-ascii byte payload')
+            if utf8 and not is_ascii(output):
+                output = _decode_utf8(output)
+        except (IndexError, ValueError) as e:
+            if raise_on_error:
+                raise ValueError(str(e))
+            output = None
+        yield output
+
+
+class SmazCompressor(object):
+    """ An incremental compressor in the style of zlib.compressobj. Feed it the input a chunk at a time with compress,
+        which returns whatever output can no longer be revised, then call flush for the rest. The state of the compress
+        loop (unmatched text, backtracking buffers and the partial trie match) is carried across chunk boundaries, so
+        the concatenated output is identical to compress(input, pathological_case_detection=False), and also applies
+        pathological case detection if nothing has been returned before flush.
+
+        Memory is bounded by backtrack_limit rather than the size of the input, output is held back only while the
+        backtracking may still revise it, or while a match might continue into the next chunk.
+
+        compressor = SmazCompressor()
+        compressed = "".join(compressor.compress(chunk) for chunk in chunks) + compressor.flush()
+
+        :param check_ascii Check each chunk is ASCII before we encode it (default True), raises ValueError if not
+        :param compression_tree: See compress
+        :param backtracking: See compress
+        :param pathological_case_detection: See compress, only applies if flush is the first call to return output
+        :param backtrack_limit: See compress
+    """
+
+    def __init__(self, check_ascii=True, compression_tree=None, backtracking=True, pathological_case_detection=True,
+                 backtrack_limit=BACKTRACK_LIMIT):
+        self.check_ascii = check_ascii
+        self.compression_tree = compression_tree or _smaz_tree()
+        self.backtracking = backtracking
+        self.pathological_case_detection = pathological_case_detection
+        self.backtrack_limit = backtrack_limit
+
+        self._buffer = ''           # Input from self._buffer_pos onwards, still needed for matching or backtracking
+        self._buffer_pos = 0        # Position of self._buffer[0] in the whole input
+        self._pos = 0               # Position in the whole input we have encoded up to
+        self._last_backtrack_pos = 0
+        self._unmatched = []
+        self._backtrack_buff = []
+        self._enc_buf = []
+        self._returned_output = False
+        self._flushed = False
+
+    def compress(self, input_str):
+        """ Add input_str to the input, returning any compressed output that is ready.
+
+        :type input_str: str
+        :rtype: str
+        """
+        if self._flushed:
+            raise ValueError('compress called after flush')
+        if self.check_ascii and input_str and not _is_ascii(input_str):
+            raise ValueError('SMAZ can only process ASCII text.')
+        self._buffer += input_str
+        output = self._compress(False)
+        self._returned_output = self._returned_output or bool(output)
+        return output
+
+    def flush(self):
+        """ Compress whatever input remains, and return the rest of the output. The compressor can't be used after
+            this.
+
+        :rtype: str
+        """
+        if self._flushed:
+            raise ValueError('flush called twice')
+        output = self._compress(True)
+        self._flushed = True
+        if self.pathological_case_detection and not self._returned_output and not self._buffer_pos and \
+                len(output) > _worst_size(len(self._buffer)):
+            output = _encapsulate(self._buffer)  # Nothing returned yet, and we still hold the whole input
+        self._buffer = ''
+        return output
+
+    def _compress(self, final):
+        """ Run the compress loop over the buffered input, see compress for a description of the algorithm. Unless
+            final, stop at a match that could continue into the next chunk, and commit any output the backtracking can
+            no longer revise.
+        """
+        terminal_tree_node = (None, None)
+        compression_tree = self.compression_tree
+        backtracking = self.backtracking
+        backtrack_limit = self.backtrack_limit
+        input_str = self._buffer
+        input_str_len = len(input_str)
+        buffer_pos = self._buffer_pos
+        # Positions relative to the buffer
+        pos = self._pos - buffer_pos
+        last_backtrack_pos = self._last_backtrack_pos - buffer_pos
+
+        output = []
+        unmatched = self._unmatched
+        backtrack_buff = self._backtrack_buff
+        enc_buf = self._enc_buf
+        output_extend = output.extend
+
+        while pos < input_str_len:
+            tree_ptr = compression_tree
+            enc_byte = None
+            j = 0
+            while j < input_str_len - pos:  # Search the tree for the longest matching sequence
+                byte_val, tree_ptr = tree_ptr[ord(input_str[pos + j])] or terminal_tree_node
+                j += 1
+                if byte_val is not None:
+                    enc_byte = byte_val  # Remember this match, and search for a longer one
+                    enc_len = j
+                if not tree_ptr:
+                    break  # No more matching characters in the tree
+            if not final and (tree_ptr or enc_byte is None and pos + 1 == input_str_len):
+                break  # The match might continue into the next chunk, or this is the end of string check
+
+            if enc_byte is None:
+                unmatched.append(input_str[pos])
+                pos += 1  # We didn't match any stems, add the character the unmatched list
+
+                at_end = final and input_str_len == pos
+                if enc_buf or at_end:
+                    # Mode switch ! or end of string
+                    merge_len = _worst_size(pos - last_backtrack_pos)
+                    unmerge_len = len(backtrack_buff) + len(enc_buf) + _worst_size(len(unmatched))
+                    if merge_len > unmerge_len + 2 or pos - last_backtrack_pos > backtrack_limit or not backtracking:
+                        # Unmerge: gained at least 3 bytes through encoding, reset the backtrack marker to here
+                        output_extend(backtrack_buff)
+                        output_extend(enc_buf)
+                        backtrack_buff = []
+                        last_backtrack_pos = pos - 1
+                    elif merge_len < unmerge_len:
+                        # Merge: Mode switch doesn't make sense, don't move backtrack marker
+                        backtrack_buff = []
+                        unmatched = list(input_str[last_backtrack_pos:pos])
+                    else:
+                        # Gains are two bytes or less - don't move the backtrack marker till we have a clear gain
+                        backtrack_buff.extend(enc_buf)
+                        if at_end:
+                            backtrack_buff.extend(_encapsulate_list(unmatched))
+                            unmatched = []
+                    enc_buf = []
+            else:
+                # noinspection PyUnboundLocalVariable
+                pos += enc_len  # We did match in the tree, advance along, by the number of bytes matched
+                enc_buf.append(enc_byte)
+                if unmatched:  # Entering an encoding run
+                    backtrack_buff.extend(_encapsulate_list(unmatched))
+                    unmatched = []
+
+        if final:
+            output_extend(backtrack_buff)
+            output_extend(_encapsulate_list(unmatched))
+            output_extend(enc_buf)
+            backtrack_buff, unmatched, enc_buf = [], [], []
+            keep_from = 0 if not buffer_pos else pos
+        elif pos - last_backtrack_pos > backtrack_limit or not backtracking:
+            # The next mode switch is sure to unmerge, so everything buffered so far is final. Keep the last encoded
+            # byte, the mode switch needs to see we are in an encoding run. Whole 255 chunks of unmatched text are
+            # final too.
+            output_extend(backtrack_buff)
+            backtrack_buff = []
+            if enc_buf:
+                output_extend(enc_buf[:-1])
+                del enc_buf[:-1]
+            elif len(unmatched) >= 255:
+                committed = len(unmatched) - len(unmatched) % 255
+                output_extend(_encapsulate_list(unmatched[:committed]))
+                del unmatched[:committed]
+            keep_from = pos  # Merges can't reach back before here any more
+        else:
+            keep_from = last_backtrack_pos
+
+        if keep_from:
+            self._buffer = input_str[keep_from:]
+            self._buffer_pos = buffer_pos + keep_from
+        self._pos = buffer_pos + pos
+        self._last_backtrack_pos = buffer_pos + last_backtrack_pos
+        self._unmatched = unmatched
+        self._backtrack_buff = backtrack_buff
+        self._enc_buf = enc_buf
+        return "".join(output)
+
+
+def train(samples, max_entries=253, max_len=7, max_candidates=1000000, validation_bytes=1 << 20, report=None):
+    """ Build a decode table tuned to the passed samples, for use with make_trie and decompress_table. For example
+        URLs, log lines or JSON keys, where the built in table (tuned to English prose) leaves a lot on the table.
+
+        The samples are streamed through once, counting every substring of up to max_len characters. When more than
+        max_candidates distinct substrings have been seen the least common are dropped, which keeps memory bounded on
+        samples of any size, at the cost of the counts being approximate. Entries are then picked greedily by the
+        bytes they are expected to save, and each pick discounts the substrings it contains, as the trie will now
+        encode them as part of the longer entry.
+
+        Every TRAIN_VALIDATION_EVERY'th sample, up to validation_bytes of them, is held back from the counting and
+        compressed with the trained table and the default table to estimate the ratio on data the table wasn't
+        trained on. If a dict is passed as report it is filled in with the results. Pass validation_bytes=0 to train
+        on every sample, there is then no ratio to report.
+
+        tree = make_trie(table)
+        compressed = compress(url, compression_tree=tree)
+        url = decompress(compressed, decompress_table=table)
+
+        :type samples: collections.Iterable
+        :type max_entries: int
+        :type max_len: int
+        :type max_candidates: int
+        :type validation_bytes: int
+        :type report: dict
+
+        :param samples An iterable of ASCII strs, e.g. the lines of a file
+        :param max_entries Entries in the table, at most 254 (default 253)
+        :param max_len Length of the longest entry (default 7)
+        :param max_candidates Distinct substrings to count before pruning the least common (default 1,000,000)
+        :param validation_bytes Most of samples to hold back for estimating the ratio (default 1MB)
+        :param report Filled in with samples, bytes, validation_samples, candidates, ratio and default_ratio, the
+                      ratios being compressed size / original size on the held back samples, None if there are none.
+
+        :rtype: list
+        :return: The decode table
+    """
+    if not 0 < max_entries <= 254:
+        raise ValueError('max_entries must be from 1 to 254: %d' % max_entries)
+    from collections import Counter
+    counts = Counter()
+    counts_update = counts.update
+    validation = []
+    validation_len = total_len = n_samples = 0
+    block_len = TRAIN_BLOCK_LEN
+    for sample in samples:
+        n_samples += 1
+        sample_len = len(sample)
+        total_len += sample_len
+        if not n_samples % TRAIN_VALIDATION_EVERY and validation_len < validation_bytes and _is_ascii(sample):
+            validation.append(sample)
+            validation_len += sample_len
+            continue
+        # Count the substrings starting in each block, the slicing and counting all happen at C level
+        for block_pos in xrange(0, sample_len, block_len):
+            block = sample[block_pos:block_pos + block_len + max_len - 1]
+            block_getitem = block.__getitem__
+            starts = min(block_len, len(block))
+            for length in xrange(1, max_len + 1):
+                n_starts = min(starts, len(block) - length + 1)
+                if n_starts <= 0:
+                    break
+                counts_update(map(block_getitem, map(slice, xrange(n_starts), xrange(length, n_starts + length))))
+            if len(counts) > max_candidates:
+                counts = Counter(dict(counts.most_common(max_candidates // 2)))
+                counts_update = counts.update
+
+    # Greedy selection by estimated saving, each occurrence of an entry saves its length less the one byte code. A
+    # single character saves the escape overhead of encoding it verbatim, weighted by TRAIN_SINGLE_CHAR_SAVING
+    def saving(sstr):
+        return counts[sstr] * (len(sstr) - 1 or TRAIN_SINGLE_CHAR_SAVING)
+
+    import heapq
+    heap = [(-saving(sstr), sstr) for sstr, count in counts.items() if count > 1 and _is_ascii(sstr)]
+    heapq.heapify(heap)
+    table = []
+    while heap and len(table) < max_entries:
+        neg_saving, sstr = heapq.heappop(heap)
+        current = saving(sstr)
+        if current <= 0:
+            continue
+        if current < -neg_saving:
+            heapq.heappush(heap, (-current, sstr))  # Stale, it has been discounted since it was pushed
+            continue
+        table.append(sstr)
+        count = counts[sstr]
+        for length in xrange(1, len(sstr)):
+            for start in xrange(0, len(sstr) - length + 1):
+                counts[sstr[start:start + length]] -= count
+    table.sort(key=lambda entry: (len(entry), entry))
+
+    if report is not None:
+        tree = make_trie(table) if table else None
+        compressed_len = sum(len(_compress(sample, tree, True, True, BACKTRACK_LIMIT)) for sample in validation
+                             if sample and tree)
+        default_len = sum(len(_compress(sample, _smaz_tree(), True, True, BACKTRACK_LIMIT)) for sample in validation
+                          if sample)
+        report.update(samples=n_samples, bytes=total_len, validation_samples=len(validation), candidates=len(counts),
+                      ratio=float(compressed_len) / validation_len if validation_len and tree else None,
+                      default_ratio=float(default_len) / validation_len if validation_len else None)
+    return table
+
+
+class SmazDecompressor(object):
+    """ An incremental decompressor in the style of zlib.decompressobj. Feed it the compressed input a chunk at a time
+        with decompress, chunks can be cut anywhere, including in the middle of a 254/255 escape or its verbatim
+        string. Only the partial escape and the count of verbatim characters still to come are kept between calls,
+        so a stream of any size is decoded in constant memory.
+
+        If max_length is passed to decompress no more than max_length characters are returned, and the input that
+        wasn't processed is left in unconsumed_tail, to be passed back in to the next call. As SMAZ has no end of
+        stream marker eof is only set by flush, which raises ValueError if the stream stopped part way through an
+        escape.
+
+        decompressor = SmazDecompressor()
+        text = "".join(decompressor.decompress(chunk) for chunk in chunks) + decompressor.flush()
+
+        :param check_ascii Check that all output is ASCII, raising ValueError if not
+        :param decompress_table Alternative 253 entry decode table, by default uses SMAZ
+    """
+
+    def __init__(self, check_ascii=False, decompress_table=None):
+        self.check_ascii = check_ascii
+        self.decompress_table = decompress_table or DECODE
+        self.unconsumed_tail = ''
+        self.eof = False
+
+        self._escape = None     # 254 or 255 if the last chunk ended straight after an escape
+        self._verbatim_len = 0  # Characters of a 255 verbatim string still to come
+        self._pending = ''      # Output held back by max_length, part of the expansion of the last code
+
+    def decompress(self, input_str, max_length=0):
+        """ Decompress input_str, returning at most max_length characters if max_length isn't 0.
+
+        :type input_str: str
+        :type max_length: int
+        :rtype: str
+        """
+        if self.eof:
+            raise ValueError('decompress called after flush')
+        if max_length < 0:
+            raise ValueError('max_length must be non-negative')
+        output, consumed = self._decompress(input_str, max_length)
+        self.unconsumed_tail = input_str[consumed:]
+        return output
+
+    def flush(self):
+        """ Return all of the remaining output, including the decompressed unconsumed_tail. The decompressor can't be
+            used after this.
+
+        :rtype: str
+        """
+        if self.eof:
+            raise ValueError('flush called twice')
+        output, _ = self._decompress(self.unconsumed_tail, 0)
+        self.unconsumed_tail = ''
+        if self._escape is not None or self._verbatim_len:
+            raise ValueError('Invalid input to decompress - buffer overflow')
+        self.eof = True
+        return output
+
+    def _decompress(self, input_str, max_length):
+        """ Decompress as much of input_str as max_length allows, returns the output and how much input was consumed
+        """
+        decompress_table = self.decompress_table
+        escape_search = _escape_search()
+        input_str_len = len(input_str)
+        output = []
+        output_append = output.append
+        output_len = 0
+        pos = 0
+
+        if self._pending:
+            take = min(len(self._pending), max_length) if max_length else len(self._pending)
+            output_append(self._pending[:take])
+            self._pending = self._pending[take:]
+            output_len = take
+
+        try:
+            while pos < input_str_len and not (max_length and output_len >= max_length):
+                if self._verbatim_len:
+                    # Part way through a verbatim string
+                    take = min(self._verbatim_len, input_str_len - pos)
+                    if max_length:
+                        take = min(take, max_length - output_len)
+                    output_append(input_str[pos:pos + take])
+                    pos += take
+                    output_len += take
+                    self._verbatim_len -= take
+                elif 254 == self._escape:
+                    # Verbatim byte
+                    output_append(input_str[pos])
+                    pos += 1
+                    output_len += 1
+                    self._escape = None
+                elif 255 == self._escape:
+                    # Verbatim string
+                    self._verbatim_len = ord(input_str[pos]) + 1
+                    pos += 1
+                    self._escape = None
+                else:
+                    match = escape_search(input_str, pos)
+                    end_pos = match.start() if match else input_str_len
+                    if end_pos == pos:
+                        self._escape = ord(input_str[pos])
+                        pos += 1
+                        continue
+                    # Expand the run of code table entries up to the next escape in one go
+                    codes = _latin1_codes(input_str[pos:end_pos])
+                    if len(codes) > 1:
+                        expansions = itemgetter(*codes)(decompress_table)
+                    else:
+                        expansions = (decompress_table[codes[0]],)
+                    text = "".join(expansions)
+                    if max_length and output_len + len(text) > max_length:
+                        # Stop after the code that takes us to max_length, and hold back the rest of its expansion
+                        wanted = max_length - output_len
+                        ends = []
+                        end = 0
+                        for expansion in expansions:
+                            end += len(expansion)
+                            ends.append(end)
+                        used = bisect_left(ends, wanted) + 1
+                        text = "".join(expansions[:used])
+                        self._pending = text[wanted:]
+                        text = text[:wanted]
+                        end_pos = pos + used
+                    output_append(text)
+                    output_len += len(text)
+                    pos = end_pos
+        except (IndexError, UnicodeEncodeError) as e:
+            raise ValueError('Invalid input to decompress - %s' % e)
+
+        output = "".join(output)
+        if self.check_ascii and not _is_ascii(output):
+            raise ValueError('Invalid input to decompress - non-ascii byte payload')
+        return output, pos
+
+
+def _cache_info():
+    """ The CacheInfo namedtuple, made on first use so that importing smaz doesn't import collections """
+    global CacheInfo
+    try:
+        return CacheInfo
+    except NameError:
+        from collections import namedtuple
+        CacheInfo = namedtuple('CacheInfo', 'hits misses evictions maxsize currsize')
+        return CacheInfo
+
+
+if sys.version_info < (3, 7):
+    _cache_info()  # No module __getattr__, so it has to be made now
+
+
+class SmazCache(object):
+    """ A bounded LRU cache in front of compress and decompress, for traffic where a small set of strings (status
+        messages, URLs, field values) makes up most of the calls. cache.compress and cache.decompress are drop-in
+        replacements taking the same keyword options, each side has its own LRU of up to maxsize entries. Only strings
+        of up to max_item_len characters are admitted, so memory stays bounded at about
+        2 * maxsize * max_item_len characters, longer strings are passed straight through.
+
+        The options are part of the key, tables and trees by identity, so each is held by the cache while an entry
+        keyed on it is, which stops the identity being reused. Errors (None results with raise_on_error=False) aren't
+        cached.
+
+        cache = SmazCache(maxsize=4096)
+        compressed = cache.compress(status_message)
+        print(cache.compress_info())
+
+        :param maxsize Entries kept on each side (default 1024)
+        :param max_item_len Longest str admitted to the cache (default 256)
+    """
+
+    def __init__(self, maxsize=1024, max_item_len=256):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1: %d' % maxsize)
+        self.maxsize = maxsize
+        self.max_item_len = max_item_len
+        import threading
+        from collections import OrderedDict
+        self._lock = threading.Lock()
+        self._pinned = {}  # id(tree or table): [tree or table, entries keyed on it], for options keyed by identity
+        self._compress_side = [OrderedDict(), 0, 0, 0]  # entries, hits, misses, evictions
+        self._decompress_side = [OrderedDict(), 0, 0, 0]
+
+    def compress(self, input_str, **options):
+        """ compress(input_str, **options), from the cache if it's there """
+        return self._cached(self._compress_side, compress, input_str, options)
+
+    def decompress(self, input_str, **options):
+        """ decompress(input_str, **options), from the cache if it's there """
+        return self._cached(self._decompress_side, decompress, input_str, options)
+
+    def compress_info(self):
+        """ :rtype: CacheInfo """
+        return self._info(self._compress_side)
+
+    def decompress_info(self):
+        """ :rtype: CacheInfo """
+        return self._info(self._decompress_side)
+
+    def clear(self):
+        """ Empty both sides and reset the counters """
+        from collections import OrderedDict
+        with self._lock:
+            self._pinned.clear()
+            self._compress_side[:] = [OrderedDict(), 0, 0, 0]
+            self._decompress_side[:] = [OrderedDict(), 0, 0, 0]
+
+    def _info(self, side):
+        entries, hits, misses, evictions = side
+        return _cache_info()(hits, misses, evictions, self.maxsize, len(entries))
+
+    def _cached(self, side, function, input_str, options):
+        if not input_str or len(input_str) > self.max_item_len:
+            return function(input_str, **options)
+        key = (input_str,) + self._options_key(options) if options else input_str
+        entries = side[0]
+        with self._lock:
+            output = entries.pop(key, None)
+            if output is not None:
+                entries[key] = output  # Most recently used, move_to_end isn't on Python 2
+                side[1] += 1
+                return output
+            side[2] += 1
+        output = function(input_str, **options)  # Outside the lock, compressing is the slow part
+        if output is None:
+            return output
+        with self._lock:
+            if key not in entries:
+                if len(entries) >= self.maxsize:
+                    self._unpin(entries.popitem(last=False)[0])
+                    side[3] += 1
+                if options:
+                    self._pin(options, key)
+            entries[key] = output
         return output
+
+    @staticmethod
+    def _options_key(options):
+        """ The options as a key, and the names of the trees and tables in it keyed by identity """
+        key, pinned = [], []
+        for name, value in sorted(options.items()):
+            if isinstance(value, list):  # A tree or table, by identity
+                pinned.append(name)
+                value = id(value)
+            key.append((name, value))
+        return tuple(key), tuple(pinned)
+
+    def _pin(self, options, key):
+        """ Hold the trees and tables of a new entry, call with the lock held """
+        pinned = self._pinned
+        for name in key[2]:
+            value = options[name]
+            pin = pinned.get(id(value))
+            if pin is None:
+                pinned[id(value)] = [value, 1]
+            else:
+                pin[1] += 1
+
+    def _unpin(self, key):
+        """ Release the trees and tables of an evicted entry, call with the lock held """
+        if isinstance(key, tuple):
+            pinned = self._pinned
+            for name, value in key[1]:
+                if name in key[2]:
+                    pin = pinned[value]
+                    pin[1] -= 1
+                    if not pin[1]:
+                        del pinned[value]
+
+
+_DECODE_BYTES = [sstr.encode('latin-1') for sstr in DECODE]
+
+
+if str is bytes:  # Python 2, memoryview items are 1 character strs and it has no cast
+    def _byte_view(input_bytes):
+        """ Return a bytearray copy of any object supporting the buffer protocol """
+        return bytearray(memoryview(input_bytes).tobytes())
+else:
+    def _byte_view(input_bytes):
+        """ Return a flat unsigned byte memoryview over any object supporting the buffer protocol """
+        view = memoryview(input_bytes)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        return view
+
+
+def _byte_table(decompress_table):
+    """ Return the decode table as a list of bytes objects, the SMAZ table is converted once at import time """
+    if not decompress_table:
+        return _DECODE_BYTES
+    return [sstr if isinstance(sstr, bytes) else sstr.encode('latin-1') for sstr in decompress_table]
+
+
+if hasattr(bytes, 'isascii'):  # Python 3.7+
+    def _check_ascii_bytes(view):
+        """ Return True iff the passed byte view contains only ascii bytes, a single C level pass """
+        if not isinstance(view, (bytes, bytearray)):
+            obj = view.obj
+            view = obj if isinstance(obj, (bytes, bytearray)) and len(obj) == len(view) else view.tobytes()
+        return view.isascii()
+else:
+    def _check_ascii_bytes(view):
+        """ Return True iff the passed byte view contains only ascii bytes """
+        return not view or max(bytearray(view)) < 128  # A memoryview iterates as 1 character strs on Python 2
+
+
+def _encapsulate_bytes(output, view):
+    """ As _encapsulate_list, but appends the 255/254 chunks of the byte view to the output bytearray without copying
+        the payload into intermediate objects.
+    """
+    output_append = output.append
+    for i in xrange(0, len(view), 255):
+        chunk = view[i:i+255]
+        if 1 == len(chunk):
+            output_append(254)
+        else:
+            output_append(255)
+            output_append(len(chunk) - 1)
+        output += chunk
+    return output
+
+
+def compress_bytes(input_bytes, check_ascii=True, raise_on_error=True, compression_tree=None, backtracking=True,
+                   pathological_case_detection=True, backtrack_limit=BACKTRACK_LIMIT):
+    """ As compress, but takes any object supporting the buffer protocol (bytes, bytearray, memoryview, mmap ...) and
+        returns real bytes, so there is no need to round trip through latin-1 str objects. Output is built in a
+        bytearray, and verbatim runs are sliced out of the input through a memoryview.
+
+    :param input_bytes The ASCII bytes to be compressed
+    :param check_ascii Check the input_bytes are ASCII before we encode them (default True)
+    :param raise_on_error Throw a value type exception (default True)
+    :param compression_tree: A trie as built by make_trie, by default uses built in SMAZ trie.
+    :param backtracking: See compress
+    :param pathological_case_detection: See compress
+    :param backtrack_limit: See compress
+
+    :type input_bytes: bytes | bytearray | memoryview
+    :type check_ascii: bool
+    :type raise_on_error: bool
+    :type compression_tree: list
+    :type backtracking: bool
+    :type pathological_case_detection: bool
+
+    :rtype: bytes
+    :return: The compressed input_bytes
+    """
+    if input_bytes is None:
+        return None
+    data = _byte_view(input_bytes)
+    if not data:
+        return b''
+    if check_ascii and not _check_ascii_bytes(data):
+        if raise_on_error:
+            raise ValueError('SMAZ can only process ASCII text.')
+        else:
+            return None
+
+    # Invariants:
+    terminal_tree_node = (None, None)
+    compression_tree = compression_tree or _smaz_tree()
+    input_len = len(data)
+
+    # Unmatched bytes are always the contiguous run data[unmatched_pos:pos], so we only track where they start
+    output = bytearray()          # Committed, non-back-track-able output
+    backtrack_buff = bytearray()  # Encoded between last_backtrack_pos and pos (excl enc_buf and unmatched)
+    enc_buf = bytearray()         # Encoded output for the current run of compression codes
+
+    last_backtrack_pos = unmatched_pos = pos = 0
+    while pos < input_len:
+        tree_ptr = compression_tree
+        enc_byte = None
+        j = 0
+        while j < input_len - pos:  # Search the tree for the longest matching sequence
+            byte_val, tree_ptr = tree_ptr[data[pos + j]] or terminal_tree_node
+            j += 1
+            if byte_val is not None:
+                enc_byte = byte_val  # Remember this match, and search for a longer one
+                enc_len = j
+            if not tree_ptr:
+                break  # No more matching characters in the tree
+
+        if enc_byte is None:
+            pos += 1  # We didn't match any stems, the byte joins the unmatched run
+
+            # Backtracking - see compress for the rationale
+            if enc_buf or input_len == pos:
+                # Mode switch ! or end of string
+                merge_len = _worst_size(pos - last_backtrack_pos)
+                unmerge_len = len(backtrack_buff) + len(enc_buf) + _worst_size(pos - unmatched_pos)
+                if merge_len > unmerge_len + 2 or pos - last_backtrack_pos > backtrack_limit or not backtracking:
+                    # Unmerge: gained at least 3 bytes through encoding, reset the backtrack marker to here
+                    output += backtrack_buff
+                    output += enc_buf
+                    backtrack_buff = bytearray()
+                    last_backtrack_pos = pos - 1
+                elif merge_len < unmerge_len:
+                    # Merge: Mode switch doesn't make sense, don't move backtrack marker
+                    backtrack_buff = bytearray()
+                    unmatched_pos = last_backtrack_pos
+                else:
+                    # Gains are two bytes or less - don't move the backtrack marker till we have a clear gain
+                    backtrack_buff += enc_buf
+                    if input_len == pos:
+                        _encapsulate_bytes(backtrack_buff, data[unmatched_pos:pos])
+                        unmatched_pos = pos
+                enc_buf = bytearray()
+        else:
+            # noinspection PyUnboundLocalVariable
+            if unmatched_pos < pos:  # Entering an encoding run
+                _encapsulate_bytes(backtrack_buff, data[unmatched_pos:pos])
+            pos += enc_len  # We did match in the tree, advance along, by the number of bytes matched
+            unmatched_pos = pos
+            enc_buf.append(ord(enc_byte))
+
+    output += backtrack_buff
+    _encapsulate_bytes(output, data[unmatched_pos:pos])
+    output += enc_buf
+
+    # Pathological case detection - Did we grow more than we would by encapsulating the string ?
+    if pathological_case_detection and len(output) > _worst_size(input_len):
+        return bytes(_encapsulate_bytes(bytearray(), data))
+    return bytes(output)
+
+
+def decompress_bytes(input_bytes, raise_on_error=True, check_ascii=False, decompress_table=None):
+    """ As decompress, but takes any object supporting the buffer protocol and returns real bytes. Verbatim runs are
+        copied straight from a memoryview of the input into the output bytearray.
+        :type input_bytes: bytes | bytearray | memoryview
+        :type raise_on_error: bool
+        :type check_ascii: bool
+        :type decompress_table: list
+
+        :param raise_on_error Throw an exception on any kind of decode error, if false, return None on error
+        :param check_ascii Check that all output is ASCII. Will raise or return None depending on raise_on_error
+        :param decompress_table Alternative 253 entry decode table (str or bytes entries), by default uses SMAZ
+
+        :rtype: bytes
+        :return: The decompressed input_bytes
+    """
+    if input_bytes is None:
+        return None
+    data = _byte_view(input_bytes)
+    if not data:
+        return b''
+    decompress_table = _byte_table(decompress_table)
+    input_len = len(data)
+    output = bytearray()
+    output_append = output.append
+    pos = 0
+    try:
+        while pos < input_len:
+            ch = data[pos]
+            pos += 1
+            if ch < 254:
+                # Code table entry
+                output += decompress_table[ch]
+            elif 254 == ch:
+                # Verbatim byte
+                output_append(data[pos])
+                pos += 1
+            else:  # 255 == ch:
+                # Verbatim string
+                end_pos = pos + data[pos] + 2
+                pos += 1
+                if end_pos > input_len:
+                    raise ValueError('Invalid input to decompress - buffer overflow')
+                output += data[pos:end_pos]
+                pos = end_pos
+        if check_ascii and not _check_ascii_bytes(output):
+            raise ValueError('Invalid input to decompress - non-ascii byte payload')
+    except (IndexError, ValueError) as e:
+        if raise_on_error:
+            raise ValueError(str(e))
+        else:
+            return None
+    return bytes(output)
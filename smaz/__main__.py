@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Command line interface for PySmaz.
+
+Compresses or decompresses files (or stdin) to a file (or stdout). By default the whole input is treated as one
+SMAZ stream. In record mode (-r) every line is compressed on its own and written as a length prefixed record, which is
+the format you want for line oriented data like the NUS SMS corpus, as records can be read back, split and processed
+independently. Records are the text between newlines, so a file ending with a newline ends with an empty record, and
+one without round trips without gaining one.
+
+Input is read as bytes and any byte that isn't ASCII is carried verbatim, so UTF-8 or latin-1 text round trips
+exactly, it just compresses less well. The output file is written under a temporary name and only renamed into place
+once everything has been written, so a failure never leaves a truncated output behind.
+
+Record format
+-------------
+
+    RECORD_MAGIC (4 bytes) RECORD_VERSION (1 byte)
+    then for every record: length of the compressed record as an unsigned LEB128 varint, the compressed record
+
+Usage
+-----
+
+python -m smaz input.txt -o input.smaz
+python -m smaz -d input.smaz -o input.txt
+python -m smaz -r -j 8 sms.txt -o sms.smazr
+cat sms.smazr | python -m smaz -d -r > sms.txt
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from smaz import SmazCompressor, SmazDecompressor, compress_many, decompress_many
+from smaz.parallel import compress_parallel, decompress_parallel
+
+__author__ = "Max Smith"
+
+BUFFER_SIZE = 1 << 20   # Bytes per read and write
+RECORD_MAGIC = b'SMZR'
+RECORD_VERSION = 1
+
+_SMALL_VARINTS = [bytes(bytearray([i])) for i in range(128)]
+
+
+def encode_varint(value):
+    """ Encode a non-negative int as an unsigned LEB128 varint
+
+    :type value: int
+    :rtype: bytes
+    """
+    if value < 128:
+        return _SMALL_VARINTS[value]
+    output = bytearray()
+    while value >= 128:
+        output.append(value & 127 | 128)
+        value >>= 7
+    output.append(value)
+    return bytes(output)
+
+
+def write_records(output_stream, records):
+    """ Write a list of compressed records (bytes) to output_stream, with their length prefixes """
+    varint = encode_varint
+    output_stream.write(b''.join(varint(len(record)) + record for record in records))
+
+
+def iter_records(input_stream, check_header=True):
+    """ Read a record file, yielding a list of the compressed records (bytes) in each block read from input_stream.
+
+    :param input_stream A binary file object positioned at the start of a record file
+    :param check_header Read and check the record file header first (default True)
+
+    :rtype: generator
+    """
+    if check_header:
+        header = input_stream.read(len(RECORD_MAGIC) + 1)
+        if header[:len(RECORD_MAGIC)] != RECORD_MAGIC:
+            raise ValueError('Not a SMAZ record file')
+        if bytearray(header[len(RECORD_MAGIC):])[0] != RECORD_VERSION:
+            raise ValueError('Unsupported SMAZ record file version: %d' % bytearray(header[len(RECORD_MAGIC):])[0])
+
+    buff = b''
+    while True:
+        block = input_stream.read(BUFFER_SIZE)
+        if not block:
+            break
+        buff += block
+        buff_len = len(buff)
+        records = []
+        pos = 0
+        while pos < buff_len:
+            length = shift = 0
+            end_pos = pos
+            while end_pos < buff_len:  # The varint
+                byte = buff[end_pos]
+                end_pos += 1
+                length |= (byte & 127) << shift
+                if byte < 128:
+                    break
+                shift += 7
+            else:
+                break  # The varint continues in the next block
+            if end_pos + length > buff_len:
+                break  # The record continues in the next block
+            records.append(buff[end_pos:end_pos + length])
+            pos = end_pos + length
+        buff = buff[pos:]
+        yield records
+    if buff:
+        raise ValueError('Truncated SMAZ record file')
+
+
+def iter_lines(input_stream):
+    """ Read a text file, yielding a list of the lines (without the newline) in each block read from input_stream. As
+        with str.split, the lines are the text between newlines, so a file ending with a newline ends with an empty
+        line, and an empty file has none.
+
+    :rtype: generator
+    """
+    tail = None
+    while True:
+        block = input_stream.read(BUFFER_SIZE)
+        if not block:
+            break
+        lines = (tail + block if tail else block).split(b'\n')
+        tail = lines.pop()
+        yield lines
+    if tail is not None:
+        yield [tail]
+
+
+def compress_stream(input_stream, output_stream, backtracking=True):
+    """ Compress input_stream to output_stream as a single SMAZ stream """
+    compressor = SmazCompressor(check_ascii=False, backtracking=backtracking)
+    while True:
+        block = input_stream.read(BUFFER_SIZE)
+        if not block:
+            break
+        output_stream.write(compressor.compress(block.decode('latin-1')).encode('latin-1'))
+    output_stream.write(compressor.flush().encode('latin-1'))
+
+
+def decompress_stream(input_stream, output_stream):
+    """ Decompress a single SMAZ stream from input_stream to output_stream """
+    decompressor = SmazDecompressor()
+    while True:
+        block = input_stream.read(BUFFER_SIZE)
+        if not block:
+            break
+        output_stream.write(decompressor.decompress(block.decode('latin-1')).encode('latin-1'))
+    output_stream.write(decompressor.flush().encode('latin-1'))
+
+
+def compress_records(input_stream, output_stream, backtracking=True, executor=None):
+    """ Compress each line of input_stream as a record, the record file header is written by main """
+    for lines in iter_lines(input_stream):
+        lines = [line.decode('latin-1') for line in lines]
+        if executor is None:
+            compressed = compress_many(lines, check_ascii=False, backtracking=backtracking)
+        else:
+            compressed = compress_parallel(lines, executor=executor, check_ascii=False, backtracking=backtracking)
+        write_records(output_stream, [record.encode('latin-1') for record in compressed])
+
+
+def decompress_records(input_stream, output_stream, executor=None):
+    """ Decompress the records of input_stream to output_stream, with a newline between each """
+    separator = ''
+    for records in iter_records(input_stream):
+        records = [record.decode('latin-1') for record in records]
+        if executor is None:
+            lines = decompress_many(records)
+        else:
+            lines = decompress_parallel(records, executor=executor)
+        if lines:
+            output_stream.write((separator + '\n'.join(lines)).encode('latin-1'))
+            separator = '\n'
+
+
+class _Concatenated(object):
+    """ The input files (- for stdin) read one after the other as a single binary stream, each opened when it's
+        reached
+    """
+
+    def __init__(self, input_names):
+        self._input_names = list(input_names)
+        self._stream = None
+
+    def read(self, size):
+        while True:
+            if self._stream is None:
+                if not self._input_names:
+                    return b''
+                input_name = self._input_names.pop(0)
+                self._stream = sys.stdin.buffer if input_name == '-' else open(input_name, 'rb', BUFFER_SIZE)
+            block = self._stream.read(size)
+            if block:
+                return block
+            self.close()
+
+    def close(self):
+        if self._stream is not None and self._stream is not sys.stdin.buffer:
+            self._stream.close()
+        self._stream = None
+
+
+def _set_default_mode(filename):
+    """ mkstemp creates files readable only by their owner, give the output the mode open() would have """
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(filename, 0o666 & ~umask)
+
+
+def main(argv=None):
+    """ Entry point for python -m smaz, returns the exit code """
+    parser = argparse.ArgumentParser(prog='python -m smaz', description='SMAZ short string compression.')
+    parser.add_argument('inputs', nargs='*', default=['-'], metavar='INPUT',
+                        help='files to read, concatenated, - for stdin (default)')
+    parser.add_argument('-o', '--output', default='-', help='file to write, - for stdout (default)')
+    parser.add_argument('-d', '--decompress', action='store_true', help='decompress rather than compress')
+    parser.add_argument('-r', '--records', action='store_true',
+                        help='compress each line as a length prefixed record, or decompress a record file')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='worker processes for record mode, 0 for one per CPU (default 1)')
+    parser.add_argument('--no-backtracking', dest='backtracking', action='store_false',
+                        help='faster compression, slightly worse ratio')
+    args = parser.parse_args(argv)
+
+    if args.jobs != 1 and not args.records:
+        parser.error('--jobs needs record mode (-r)')
+
+    executor = None
+    output_stream = temp_name = None
+    succeeded = False
+    try:
+        if args.jobs != 1:
+            executor = ProcessPoolExecutor(max_workers=args.jobs or os.cpu_count())
+        if args.output == '-':
+            output_stream = sys.stdout.buffer
+        else:
+            fd, temp_name = tempfile.mkstemp(prefix='.smaz-', dir=os.path.dirname(os.path.abspath(args.output)))
+            output_stream = os.fdopen(fd, 'wb', BUFFER_SIZE)
+
+        if args.decompress:  # Each file is a complete stream or record file
+            inputs = [_Concatenated([input_name]) for input_name in args.inputs]
+        else:
+            inputs = [_Concatenated(args.inputs)]
+        if args.records and not args.decompress:
+            output_stream.write(RECORD_MAGIC + bytes(bytearray([RECORD_VERSION])))
+        for input_stream in inputs:
+            try:
+                if args.records and args.decompress:
+                    decompress_records(input_stream, output_stream, executor)
+                elif args.records:
+                    compress_records(input_stream, output_stream, args.backtracking, executor)
+                elif args.decompress:
+                    decompress_stream(input_stream, output_stream)
+                else:
+                    compress_stream(input_stream, output_stream, args.backtracking)
+            finally:
+                input_stream.close()
+        succeeded = True
+    except (IOError, ValueError) as e:
+        sys.stderr.write('smaz: %s\n' % e)
+        return 1
+    finally:
+        if output_stream is not None:
+            if output_stream is sys.stdout.buffer:
+                output_stream.flush()
+            else:
+                output_stream.close()
+        if temp_name is not None:
+            if succeeded:
+                _set_default_mode(temp_name)
+                os.replace(temp_name, args.output)
+            else:
+                os.remove(temp_name)
+        if executor is not None:
+            executor.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+asyncio helpers for PySmaz.
+
+SMAZ is pure Python, so compressing a large string holds the event loop for as long as it takes, tens of milliseconds
+for a few tens of kilobytes. These helpers run anything longer than ASYNC_INLINE_LEN on an executor, by default the
+loop's thread pool, and anything shorter inline where the hand off would cost more than the work. A thread doesn't
+make the work any faster, it still needs the GIL, but the loop gets it back every few milliseconds (see
+sys.setswitchinterval) and stays responsive. Pass a ProcessPoolExecutor to compress_async and compress_many_async to
+use more cores.
+
+SmazStreamWriter and SmazStreamReader wrap an asyncio StreamWriter and StreamReader with a SmazCompressor and
+SmazDecompressor, so a connection carries one SMAZ stream. The writer awaits drain() after every write, so a slow
+reader holds the writer back rather than letting the output pile up in memory. Their executor must be a thread pool,
+as the compressor state lives in this process.
+
+Usage
+-----
+
+from smaz.aio import compress_async, compress_many_async, SmazStreamReader, SmazStreamWriter
+compressed = await compress_async(text)
+compressed = await compress_many_async(lines, concurrency=2)
+
+writer = SmazStreamWriter(stream_writer)
+await writer.write(text)
+await writer.close()
+text = await SmazStreamReader(stream_reader).read()
+"""
+
+import asyncio
+from functools import partial
+
+from smaz import SmazCompressor, SmazDecompressor, compress, compress_many, decompress, decompress_many
+
+__author__ = "Max Smith"
+
+ASYNC_INLINE_LEN = 2048  # Longest input handled on the event loop, about a millisecond of compress
+ASYNC_CHUNK_SIZE = 1024  # Strings per executor job in compress_many_async and decompress_many_async
+ASYNC_CONCURRENCY = 4    # Executor jobs in flight at once in compress_many_async and decompress_many_async
+STREAM_READ_SIZE = 65536  # Compressed bytes read from the StreamReader at a time
+
+
+async def _call(executor, inline, func, *args, **kwargs):
+    """ func(*args, **kwargs), inline or on the executor """
+    if inline:
+        return func(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+async def compress_async(input_str, executor=None, inline_len=ASYNC_INLINE_LEN, **compress_options):
+    """ compress, on the executor if input_str is longer than inline_len
+
+    :param input_str The str to be compressed
+    :param executor A concurrent.futures.Executor, default is the event loop's
+    :param inline_len Longest str compressed on the event loop
+    :param compress_options Keyword options for compress
+
+    :rtype: str
+    :return: The compressed input_str
+    """
+    return await _call(executor, len(input_str) <= inline_len, compress, input_str, **compress_options)
+
+
+async def decompress_async(input_str, executor=None, inline_len=ASYNC_INLINE_LEN, **decompress_options):
+    """ decompress, on the executor if input_str is longer than inline_len, see compress_async
+
+    :rtype: str
+    :return: The decompressed input_str
+    """
+    return await _call(executor, len(input_str) <= inline_len, decompress, input_str, **decompress_options)
+
+
+async def compress_many_async(input_strs, executor=None, concurrency=ASYNC_CONCURRENCY, chunk_size=ASYNC_CHUNK_SIZE,
+                              inline_len=ASYNC_INLINE_LEN, **compress_options):
+    """ compress_many, in chunks on the executor, with at most concurrency chunks in flight so a big batch doesn't
+        queue up ahead of everything else using the executor. Batches of at most inline_len characters in total are
+        compressed on the event loop.
+
+    :param input_strs An iterable of strs to be compressed
+    :param executor A concurrent.futures.Executor, default is the event loop's
+    :param concurrency Most chunks in flight at once
+    :param chunk_size Strings per chunk
+    :param inline_len Most characters in total compressed on the event loop
+    :param compress_options Keyword options for compress_many
+
+    :rtype: list
+    :return: The compressed strs, in input order
+    """
+    return await _run_many(compress_many, input_strs, executor, concurrency, chunk_size, inline_len,
+                           compress_options)
+
+
+async def decompress_many_async(input_strs, executor=None, concurrency=ASYNC_CONCURRENCY, chunk_size=ASYNC_CHUNK_SIZE,
+                                inline_len=ASYNC_INLINE_LEN, **decompress_options):
+    """ decompress_many, in chunks on the executor, see compress_many_async
+
+    :rtype: list
+    :return: The decompressed strs, in input order
+    """
+    return await _run_many(decompress_many, input_strs, executor, concurrency, chunk_size, inline_len,
+                           decompress_options)
+
+
+async def _run_many(func, input_strs, executor, concurrency, chunk_size, inline_len, options):
+    """ Map func over input_strs a chunk at a time on the executor, at most concurrency chunks at once """
+    if concurrency < 1 or chunk_size < 1:
+        raise ValueError('concurrency and chunk_size must be at least 1')
+    input_strs = input_strs if isinstance(input_strs, list) else list(input_strs)
+    if sum(len(input_str) for input_str in input_strs if input_str) <= inline_len:
+        return func(input_strs, **options)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def run_chunk(chunk):
+        async with semaphore:
+            return await loop.run_in_executor(executor, partial(func, chunk, **options))
+
+    results = await asyncio.gather(*[run_chunk(input_strs[i:i + chunk_size])
+                                     for i in range(0, len(input_strs), chunk_size)])
+    return [output for chunk in results for output in chunk]
+
+
+class SmazStreamWriter(object):
+    """ Compress text onto an asyncio StreamWriter, as one SMAZ stream. Each write awaits the writer's drain(), and
+        writes longer than inline_len are compressed on the executor. Close it, or use it as an async context manager,
+        to flush the end of the stream.
+
+        :param writer The asyncio.StreamWriter
+        :param executor A thread pool, default is the event loop's
+        :param inline_len Longest write compressed on the event loop
+        :param close_writer Close the StreamWriter on close (default True)
+        :param compress_options Keyword options for SmazCompressor
+    """
+
+    def __init__(self, writer, executor=None, inline_len=ASYNC_INLINE_LEN, close_writer=True, **compress_options):
+        self.writer = writer
+        self.executor = executor
+        self.inline_len = inline_len
+        self.close_writer = close_writer
+        self._compressor = SmazCompressor(**compress_options)
+        self._lock = asyncio.Lock()  # Writes from concurrent tasks share the compressor, one at a time
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def write(self, input_str):
+        """ Compress and write input_str, waiting for the writer to drain """
+        async with self._lock:
+            output = await _call(self.executor, len(input_str) <= self.inline_len, self._compressor.compress,
+                                 input_str)
+            await self._write(output)
+
+    async def close(self):
+        """ Write the end of the stream, and close the StreamWriter unless close_writer is False """
+        async with self._lock:
+            if self._compressor is None:
+                return
+            compressor, self._compressor = self._compressor, None
+            await self._write(compressor.flush())
+            if self.close_writer:
+                self.writer.close()
+                await self.writer.wait_closed()
+
+    async def _write(self, output):
+        if output:
+            self.writer.write(output.encode('latin-1'))
+        await self.writer.drain()
+
+
+class SmazStreamReader(object):
+    """ Decompress a SMAZ stream from an asyncio StreamReader. Compressed input is read STREAM_READ_SIZE bytes at a
+        time, and blocks longer than inline_len are decompressed on the executor. Iterate over it with async for to
+        get the text a block at a time.
+
+        :param reader The asyncio.StreamReader
+        :param executor A thread pool, default is the event loop's
+        :param inline_len Longest block decompressed on the event loop
+        :param read_size Compressed bytes read at a time
+        :param decompress_options Keyword options for SmazDecompressor
+    """
+
+    def __init__(self, reader, executor=None, inline_len=ASYNC_INLINE_LEN, read_size=STREAM_READ_SIZE,
+                 **decompress_options):
+        self.reader = reader
+        self.executor = executor
+        self.inline_len = inline_len
+        self.read_size = read_size
+        self._decompressor = SmazDecompressor(**decompress_options)
+        self._text = ''
+        self._lock = asyncio.Lock()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        text = await self.read(self.read_size)
+        if not text:
+            raise StopAsyncIteration
+        return text
+
+    def at_eof(self):
+        """ True once the stream has ended and all of the text has been read """
+        return self._decompressor.eof and not self._text
+
+    async def read(self, n=-1):
+        """ Read up to n characters of text, or all of it to the end of the stream if n is -1. Waits for at least one
+            character, returning '' only at the end of the stream.
+
+        :rtype: str
+        """
+        async with self._lock:
+            if n < 0:
+                pieces = [self._text]
+                while not self._decompressor.eof:
+                    pieces.append(await self._read_block())
+                self._text = ''
+                return "".join(pieces)
+            while not self._text and not self._decompressor.eof:
+                self._text = await self._read_block()
+            text, self._text = self._text[:n], self._text[n:]
+            return text
+
+    async def _read_block(self):
+        """ Read and decompress the next block of input """
+        data = await self.reader.read(self.read_size)
+        if not data:
+            return self._decompressor.flush()  # Raises ValueError if the stream stopped part way through an escape
+        return await _call(self.executor, len(data) <= self.inline_len, self._decompressor.decompress,
+                           data.decode('latin-1'))
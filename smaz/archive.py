@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Random access archives of SMAZ compressed records.
+
+SMAZ is built for large numbers of small, separate strings (URLs, text messages ...). An archive stores each string
+compressed on its own in a single data blob, followed by an index of where each record starts. The reader maps the
+file with mmap, so opening an archive of any size is instant and a record is fetched, and decompressed, by index
+without reading anything else.
+
+File format (little endian)
+---------------------------
+
+    ARCHIVE_MAGIC (4 bytes) ARCHIVE_VERSION (1 byte) padding (3 bytes)
+    record count (8 bytes) index position in the file (8 bytes)
+    data blob: the compressed records, back to back
+    padding to a multiple of 8 bytes
+    index: record count + 1 unsigned 64 bit offsets into the data blob, record i is data[index[i]:index[i + 1]]
+
+Usage
+-----
+
+from smaz.archive import SmazArchiveWriter, SmazArchiveReader
+with SmazArchiveWriter('urls.smaza') as writer:
+    writer.extend(urls)
+with SmazArchiveReader('urls.smaza') as reader:
+    print(len(reader), reader[123456], reader[10:20])
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+from smaz import compress, compress_many, decompress, decompress_many
+
+__author__ = "Max Smith"
+
+ARCHIVE_MAGIC = b'SMZA'
+ARCHIVE_VERSION = 1
+
+_HEADER = struct.Struct('<4sB3xQQ')
+
+
+class SmazArchiveWriter(object):
+    """ Write strings to a new archive, compressing each one on its own. The index is written when the writer is
+        closed, use it as a context manager.
+
+        :param filename Path of the archive to create
+        :param compress_options Keyword options for compress, e.g. backtracking=False
+    """
+
+    def __init__(self, filename, **compress_options):
+        self.compress_options = compress_options
+        self._file = open(filename, 'wb')
+        self._file.write(_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, 0))
+        self._offsets = array('Q', [0])
+        self._data_len = 0
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def append(self, input_str):
+        """ Compress and add a single string. With raise_on_error=False a string that can't be compressed is skipped.
+
+        :rtype: bool
+        :return: True if the string was added
+        """
+        compressed = compress(input_str, **self.compress_options)
+        if compressed is None:
+            return False
+        self._write([compressed])
+        return True
+
+    def extend(self, input_strs):
+        """ Compress and add an iterable of strings, compressing them as a batch. With raise_on_error=False strings
+            that can't be compressed are skipped, so the records after them move up.
+
+        :rtype: list
+        :return: The indices in input_strs of any strings that were skipped
+        """
+        records = compress_many(input_strs, **self.compress_options)
+        failed = [i for i, record in enumerate(records) if record is None]
+        self._write([record for record in records if record is not None] if failed else records)
+        return failed
+
+    def append_compressed(self, compressed):
+        """ Add a record that has already been compressed (a str, as returned by compress) """
+        self._write([compressed])
+
+    def _write(self, records):
+        offsets = self._offsets
+        data_len = self._data_len
+        for record in records:
+            data_len += len(record)
+            offsets.append(data_len)
+        self._data_len = data_len
+        self._file.write("".join(records).encode('latin-1'))
+
+    def close(self):
+        """ Write the index and header, and close the file """
+        if self._file is None:
+            return
+        index_pos = _HEADER.size + self._data_len
+        padding = -index_pos % 8
+        offsets = self._offsets
+        if sys.byteorder != 'little':
+            offsets = array('Q', offsets)
+            offsets.byteswap()
+        self._file.write(b'\0' * padding)
+        self._file.write(offsets.tobytes())
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, len(self), index_pos + padding))
+        self._file.close()
+        self._file = None
+
+
+class SmazArchiveReader(object):
+    """ Read only, random access to the records in an archive, through mmap. reader[i] decompresses just record i,
+        slices decompress just the records in the slice, and iteration decompresses a record at a time.
+
+        :param filename Path of the archive to open
+        :param decompress_options Keyword options for decompress, e.g. check_ascii=True
+    """
+
+    def __init__(self, filename, **decompress_options):
+        self.decompress_options = decompress_options
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mmap) < _HEADER.size:
+                raise ValueError('Not a SMAZ archive')
+            magic, version, count, index_pos = _HEADER.unpack_from(self._mmap)
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError('Not a SMAZ archive')
+            if version != ARCHIVE_VERSION:
+                raise ValueError('Unsupported SMAZ archive version: %d' % version)
+            if not index_pos or index_pos + 8 * (count + 1) > len(self._mmap):
+                raise ValueError('Truncated SMAZ archive, was the writer closed ?')
+            self._count = count
+            self._data_pos = _HEADER.size
+            index = memoryview(self._mmap)[index_pos:index_pos + 8 * (count + 1)]
+            if sys.byteorder == 'little':
+                self._index = index.cast('Q')  # Straight out of the mapped file, nothing is read until it's used
+            else:
+                self._index = array('Q', index.tobytes())
+                self._index.byteswap()
+                index.release()
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return decompress_many((self.compressed(i) for i in range(*item.indices(self._count))),
+                                   **self.decompress_options)
+        return decompress(self.compressed(item), **self.decompress_options)
+
+    def __iter__(self):
+        options = self.decompress_options
+        for i in range(self._count):
+            yield decompress(self.compressed(i), **options)
+
+    def compressed(self, i):
+        """ Return record i still compressed, as a str """
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('archive index out of range')
+        data_pos = self._data_pos
+        return self._mmap[data_pos + self._index[i]:data_pos + self._index[i + 1]].decode('latin-1')
+
+    def close(self):
+        """ Release the index and unmap the file """
+        if self._mmap is None:
+            return
+        if isinstance(self._index, memoryview):
+            self._index.release()
+        self._mmap.close()
+        self._mmap = None
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Reproducible benchmarks for PySmaz.
+
+Measures compress and decompress throughput, compression ratio and per call latency percentiles for every engine and
+option combination, with zlib and bz2 alongside, on the corpora in tests/data. Strings are cut from each corpus into
+size buckets (1-8, 9-64, 65-512 bytes) with a seeded random generator, so runs are comparable between releases, and
+the 5 MB bucket compresses all of the corpora joined together in one call. The results can be written as JSON to
+track regressions.
+
+Usage
+-----
+
+python -m smaz.bench                                   # Everything, a summary table on stdout
+python -m smaz.bench --json bench.json                 # And the full results as JSON
+python -m smaz.bench -b 1-8 -b 9-64 -e smaz -e zlib -c alice29.txt --budget 0.1
+"""
+
+import argparse
+import bz2
+import json
+import os
+import platform
+import random
+import sys
+import time
+import zlib
+
+import smaz
+from smaz import compress, compress_classic, compress_bytes, decompress, decompress_bytes
+
+__author__ = "Max Smith"
+
+BUCKETS = [('1-8', 1, 8), ('9-64', 9, 64), ('65-512', 65, 512), ('5MB', 5 << 20, 5 << 20)]
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'data')
+DEFAULT_BUDGET = 0.25   # Seconds of calls per measurement, at least one pass is always made
+DEFAULT_SAMPLES = 1000  # Strings per corpus and bucket
+DEFAULT_SEED = 1
+ALL_CORPORA = 'all'     # The name of the joined corpora, used for the 5MB bucket
+
+# name, compress (None to only measure decompress, of compress's output), decompress, works on bytes
+ENGINES = [
+    ('smaz', compress, decompress, False),
+    ('smaz-bytewise', None, lambda s: decompress(s, run_decoding=False), False),
+    ('smaz-level0', lambda s: compress(s, level=0), decompress, False),
+    ('smaz-level2', lambda s: compress(s, level=2), decompress, False),
+    ('smaz-level3', lambda s: compress(s, level=3), decompress, False),
+    ('smaz-classic', compress_classic, decompress, False),
+    ('smaz-classic-regex', lambda s: compress_classic(s, engine='regex'), decompress, False),
+    ('smaz-bytes', compress_bytes, decompress_bytes, True),
+    ('zlib', zlib.compress, zlib.decompress, True),
+    ('bz2', bz2.compress, bz2.decompress, True),
+]
+
+
+def load_corpora(data_dir, names=None):
+    """ Read the corpora in data_dir as ASCII str (other characters dropped), returns a list of (name, text) """
+    corpora = []
+    for name in sorted(os.listdir(data_dir)):
+        if names and name not in names:
+            continue
+        with open(os.path.join(data_dir, name), 'rb') as f:
+            corpora.append((name, f.read().decode('ascii', 'ignore')))
+    return corpora
+
+
+def make_samples(text, min_len, max_len, count, rng):
+    """ count strings cut from text with lengths from min_len to max_len, text is repeated for the 5MB bucket """
+    if max_len > len(text):
+        text *= max_len // len(text) + 1
+    samples = []
+    for _ in range(count):
+        length = rng.randint(min_len, max_len)
+        start = rng.randint(0, len(text) - length)
+        samples.append(text[start:start + length])
+    return samples
+
+
+def percentile(sorted_values, pct):
+    """ Nearest rank percentile of an already sorted list """
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))]
+
+
+def measure(function, inputs, budget):
+    """ Call function on inputs, in passes, until budget seconds have gone by, timing each call
+
+    :rtype: dict
+    :return: calls, input and output bytes, seconds, throughput in MB/s and latency percentiles in microseconds
+    """
+    timer = time.perf_counter
+    latencies = []
+    input_len = output_len = 0
+    deadline = timer() + budget
+    while True:
+        for input_str in inputs:
+            tick = timer()
+            output = function(input_str)
+            tock = timer()
+            latencies.append(tock - tick)
+            input_len += len(input_str)
+            output_len += len(output)
+        if tock > deadline:
+            break
+    seconds = sum(latencies)
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'input_bytes': input_len,
+        'output_bytes': output_len,
+        'seconds': seconds,
+        'mb_per_sec': input_len / seconds / (1 << 20) if seconds else None,
+        'latency_us': dict(('p%d' % pct, percentile(latencies, pct) * 1e6) for pct in (50, 90, 99, 100)),
+    }
+
+
+def run(data_dir=DEFAULT_DATA_DIR, buckets=None, engines=None, corpora=None, budget=DEFAULT_BUDGET,
+        samples=DEFAULT_SAMPLES, seed=DEFAULT_SEED, progress=None):
+    """ Run the benchmarks, returns the results as a dict ready for json.dump
+
+    :param data_dir Directory of corpora (default tests/data)
+    :param buckets Names of the size buckets to run (default all of BUCKETS)
+    :param engines Names of the engines to run (default all of ENGINES)
+    :param corpora File names of the corpora to use (default all)
+    :param budget Seconds per measurement
+    :param samples Strings per corpus and bucket
+    :param seed Seed for cutting the samples
+    :param progress Called with each result as it's measured
+    """
+    texts = load_corpora(data_dir, corpora)
+    if not texts:
+        raise ValueError('No corpora found in %s' % data_dir)
+    results = []
+    for bucket, min_len, max_len in BUCKETS:
+        if buckets and bucket not in buckets:
+            continue
+        if min_len == max_len:  # One big string, from all of the corpora
+            bucket_texts = [(ALL_CORPORA, "".join(text for _, text in texts))]
+            count = 1
+        else:
+            bucket_texts = texts
+            count = samples
+        for corpus, text in bucket_texts:
+            rng = random.Random('%s:%s:%s' % (seed, corpus, bucket))
+            strs = make_samples(text, min_len, max_len, count, rng)
+            for name, compress_function, decompress_function, use_bytes in ENGINES:
+                if engines and name not in engines:
+                    continue
+                inputs = [sstr.encode('ascii') for sstr in strs] if use_bytes else strs
+                compressed = [(compress_function or compress)(input_str) for input_str in inputs]
+                for operation, function, operation_inputs in (('compress', compress_function, inputs),
+                                                              ('decompress', decompress_function, compressed)):
+                    if function is None:
+                        continue
+                    result = measure(function, operation_inputs, budget)
+                    result.update(operation=operation, engine=name, corpus=corpus, bucket=bucket,
+                                  ratio=float(sum(len(x) for x in compressed)) / sum(len(x) for x in inputs))
+                    results.append(result)
+                    if progress:
+                        progress(result)
+    return {
+        'smaz_version': smaz.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'seed': seed,
+        'budget': budget,
+        'samples': samples,
+        'results': results,
+    }
+
+
+def format_result(result):
+    """ One line summary of a result """
+    return '%-10s %-18s %-20s %-7s %8.2f MB/s  ratio %.3f  p50 %9.1fus  p99 %9.1fus' % (
+        result['operation'], result['engine'], result['corpus'], result['bucket'], result['mb_per_sec'] or 0,
+        result['ratio'], result['latency_us']['p50'], result['latency_us']['p99'])
+
+
+def main(argv=None):
+    """ Entry point for python -m smaz.bench, returns the exit code """
+    parser = argparse.ArgumentParser(prog='python -m smaz.bench', description='PySmaz benchmarks.')
+    parser.add_argument('--data', default=DEFAULT_DATA_DIR, help='directory of corpora (default tests/data)')
+    parser.add_argument('--json', help='write the results to this file as JSON, - for stdout')
+    parser.add_argument('-b', '--bucket', action='append', choices=[bucket for bucket, _, _ in BUCKETS],
+                        help='size bucket to run, repeatable (default all)')
+    parser.add_argument('-e', '--engine', action='append', choices=[engine[0] for engine in ENGINES],
+                        help='engine to run, repeatable (default all)')
+    parser.add_argument('-c', '--corpus', action='append', help='corpus file name, repeatable (default all)')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='seconds per measurement (default %s)' % DEFAULT_BUDGET)
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES,
+                        help='strings per corpus and bucket (default %d)' % DEFAULT_SAMPLES)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='seed for cutting the samples')
+    args = parser.parse_args(argv)
+
+    summary = sys.stderr if args.json == '-' else sys.stdout
+    try:
+        results = run(args.data, args.bucket, args.engine, args.corpus, args.budget, args.samples, args.seed,
+                      progress=lambda result: summary.write(format_result(result) + '\n'))
+    except (IOError, OSError, ValueError) as e:
+        sys.stderr.write('smaz.bench: %s\n' % e)
+        return 1
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+A Python codec for PySmaz, registered as 'smaz' when this module is imported.
+
+Text is compressed to bytes on encode and decompressed on decode, so code that streams text through open() or
+codecs.iterencode gets SMAZ compression without holding the whole file. The incremental decoder is built on
+SmazDecompressor and carries a 254/255 escape cut off at the end of one chunk into the next. The incremental encoder
+is built on SmazCompressor.
+
+io.TextIOWrapper, which open() returns, never calls encode with final=True, so anything an encoder held back would be
+lost when the file is closed. By default (sync=True) the encoder ends the SMAZ output at the end of every encode call,
+which costs about 0.1% when writing a line at a time. With sync=False the compressor state, the unmatched text and
+backtracking buffers, carries across encode(..., final=False) calls and the output is identical to compress on the
+whole input, but the end of it is only returned by encode(..., final=True), as codecs.iterencode does.
+
+SMAZ only encodes ASCII, encode applies the errors handler ('strict', 'replace', 'ignore' ...) to anything else.
+Corrupt input always raises UnicodeDecodeError on decode.
+
+Usage
+-----
+
+import smaz.codec
+with open('notes.smaz', 'w', encoding='smaz') as f:
+    f.write(text)
+with open('notes.smaz', encoding='smaz') as f:
+    for line in f:
+        ...
+compressed = b"".join(codecs.iterencode(lines, 'smaz', sync=False))
+"""
+
+import codecs
+
+from smaz import SmazCompressor, SmazDecompressor, _is_ascii, compress, decompress
+
+__author__ = "Max Smith"
+
+CODEC_NAME = 'smaz'
+
+
+def _ascii(input_str, errors):
+    """ input_str with the errors handler applied to any non-ASCII characters """
+    if _is_ascii(input_str):  # str.isascii is Python 3.7+
+        return input_str
+    try:
+        return input_str.encode('ascii', errors).decode('ascii')
+    except UnicodeEncodeError as e:
+        raise UnicodeEncodeError(CODEC_NAME, input_str, e.start, e.end, 'SMAZ can only process ASCII text')
+
+
+def _decode_error(input_bytes, e):
+    return UnicodeDecodeError(CODEC_NAME, bytes(input_bytes), 0, len(input_bytes), str(e))
+
+
+class Codec(codecs.Codec):
+    """ Stateless encode and decode, each call is a complete SMAZ string """
+
+    def encode(self, input, errors='strict'):
+        return (compress(_ascii(input, errors), check_ascii=False) or '').encode('latin-1'), len(input)
+
+    def decode(self, input, errors='strict'):
+        try:
+            return decompress(str(input, 'latin-1')), len(input)
+        except ValueError as e:
+            raise _decode_error(input, e)
+
+
+class IncrementalEncoder(codecs.IncrementalEncoder):
+    """ Compress text a chunk at a time, see the module docstring for sync.
+
+        :param errors Errors handler for non-ASCII characters
+        :param sync End the SMAZ output at the end of every encode call (default True)
+        :param compress_options Keyword options for SmazCompressor
+    """
+
+    def __init__(self, errors='strict', sync=True, **compress_options):
+        codecs.IncrementalEncoder.__init__(self, errors)
+        self.sync = sync
+        self.compress_options = dict(compress_options, check_ascii=False)
+        self._compressor = SmazCompressor(**self.compress_options)
+
+    def encode(self, input, final=False):
+        compressor = self._compressor
+        output = compressor.compress(_ascii(input, self.errors))
+        if final or self.sync:
+            output += compressor.flush()
+            self._compressor = SmazCompressor(**self.compress_options)
+        return output.encode('latin-1')
+
+    def reset(self):
+        self._compressor = SmazCompressor(**self.compress_options)
+
+
+class IncrementalDecoder(codecs.IncrementalDecoder):
+    """ Decompress SMAZ bytes a chunk at a time, chunks can be cut anywhere
+
+        :param errors Ignored, corrupt input always raises UnicodeDecodeError
+        :param decompress_table Alternative 253 entry decode table, by default uses SMAZ
+    """
+
+    def __init__(self, errors='strict', decompress_table=None):
+        codecs.IncrementalDecoder.__init__(self, errors)
+        self.decompress_table = decompress_table
+        self._decompressor = SmazDecompressor(decompress_table=decompress_table)
+
+    def decode(self, input, final=False):
+        try:
+            output = self._decompressor.decompress(str(input, 'latin-1'))
+            if final:
+                output += self._decompressor.flush()
+        except ValueError as e:
+            raise _decode_error(input, e)
+        if final:
+            self.reset()
+        return output
+
+    def reset(self):
+        self._decompressor = SmazDecompressor(decompress_table=self.decompress_table)
+
+    def getstate(self):
+        """ A pending escape byte is returned as undecoded input, the count of verbatim characters still to come as
+            the flag, which lets TextIOWrapper.tell and seek work on a SMAZ file.
+        """
+        decompressor = self._decompressor
+        return {254: b'\xfe', 255: b'\xff'}.get(decompressor._escape, b''), decompressor._verbatim_len
+
+    def setstate(self, state):
+        pending, verbatim_len = state
+        self.reset()
+        self._decompressor._verbatim_len = verbatim_len
+        self._decompressor.decompress(str(pending, 'latin-1'))
+
+
+class StreamWriter(Codec, codecs.StreamWriter):
+    """ Each write is compressed as a complete SMAZ string, so the stream can be closed at any point """
+
+
+class StreamReader(codecs.StreamReader):
+    """ Decompress a stream of SMAZ bytes, an escape cut off at the end of one read is carried into the next """
+
+    def __init__(self, stream, errors='strict'):
+        codecs.StreamReader.__init__(self, stream, errors)
+        self._decoder = IncrementalDecoder(errors)
+
+    def decode(self, input, errors='strict'):
+        return self._decoder.decode(input), len(input)
+
+    def reset(self):
+        codecs.StreamReader.reset(self)
+        self._decoder.reset()
+
+
+def getregentry():
+    """ The codecs.CodecInfo for SMAZ """
+    return codecs.CodecInfo(
+        name=CODEC_NAME,
+        encode=Codec().encode,
+        decode=Codec().decode,
+        incrementalencoder=IncrementalEncoder,
+        incrementaldecoder=IncrementalDecoder,
+        streamwriter=StreamWriter,
+        streamreader=StreamReader,
+    )
+
+
+def search_function(encoding):
+    """ codecs search function, finds the codec as 'smaz' """
+    if encoding.replace('-', '_') == CODEC_NAME:
+        return getregentry()
+    return None
+
+
+codecs.register(search_function)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Columnar storage and decompression for PySmaz.
+
+A column is Arrow style: every compressed value back to back in one data buffer, plus offsets, where value i is
+data[offsets[i]:offsets[i + 1]]. decompress_column decodes the whole column at once with NumPy, if it's installed,
+rather than calling decompress once per row. The escapes are found with a mask and walked in a Python loop, which is
+only as long as the number of escapes, then every byte's expansion is gathered from a flat copy of the decode table
+in a handful of array operations. Without NumPy the rows go through decompress_many.
+
+SmazStringArray keeps a column in memory. Millions of compressed values as separate str objects cost around 50
+bytes of object overhead each, often more than the value itself, where a column costs 4 bytes (8 past 4GB) of offset.
+
+Usage
+-----
+
+from smaz.column import decompress_column, SmazStringArray
+data, offsets = decompress_column(compressed_data, compressed_offsets)
+row = data[offsets[i]:offsets[i + 1]]
+
+urls = SmazStringArray(lines)
+print(len(urls), urls[123456], urls.nbytes)
+"""
+
+import pickle
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional, decompress_column falls back to decompress_many
+    numpy = None
+
+from smaz import _byte_table, _byte_view, compress_many, decompress, decompress_many
+
+__author__ = "Max Smith"
+
+STRING_ARRAY_MAGIC = b'SMZS'
+STRING_ARRAY_VERSION = 1
+STRING_ARRAY_UTF8 = 1     # Header flag, the values were compressed with utf8=True
+
+_HEADER = struct.Struct('<4sBcBxQQ')
+
+
+def decompress_column(data, offsets, decompress_table=None, use_numpy=None):
+    """ Decompress a column of SMAZ values
+
+    :type data: bytes | bytearray | memoryview
+    :type offsets: collections.Sequence
+    :type decompress_table: list
+    :type use_numpy: bool
+
+    :param data The compressed values, back to back, as from compress_bytes
+    :param offsets len(values) + 1 increasing positions in data, value i is data[offsets[i]:offsets[i + 1]], e.g. a
+           list, array or numpy.ndarray. Data before offsets[0] and after offsets[-1] is ignored
+    :param decompress_table Alternative decode table, by default uses SMAZ
+    :param use_numpy True to require NumPy, False for the pure Python path, None (default) to use NumPy if installed
+
+    :rtype: tuple
+    :return: (data, offsets), the decompressed values as bytes and their offsets as an array('q'), starting at 0.
+             numpy.frombuffer(offsets, numpy.int64) views them without a copy
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ImportError('decompress_column(use_numpy=True) needs NumPy')
+    data = _byte_view(data)
+    if use_numpy:
+        return _decompress_column_numpy(data, offsets, _byte_table(decompress_table))
+    return _decompress_column_python(data, offsets, decompress_table)
+
+
+def _check_offsets(offsets, data_len, increasing):
+    """ Raise ValueError unless offsets are at least one position, increasing (as given) and within data """
+    if not len(offsets):
+        raise ValueError('offsets must hold at least one position')
+    if offsets[0] < 0 or offsets[-1] > data_len or not increasing:
+        raise ValueError('offsets must be increasing positions in data')
+
+
+def _decompress_column_python(data, offsets, decompress_table):
+    """ decompress_column, a row at a time with decompress_many """
+    offsets = array('q', offsets)
+    _check_offsets(offsets, len(data), all(a <= b for a, b in zip(offsets, offsets[1:])))
+    text = data.tobytes().decode('latin-1')
+    rows = decompress_many((text[start:end] for start, end in zip(offsets, offsets[1:])),
+                           decompress_table=decompress_table, lazy=True)
+    output = []
+    output_offsets = array('q', [0])
+    length = 0
+    for row in rows:
+        output.append(row)
+        length += len(row)
+        output_offsets.append(length)
+    return "".join(output).encode('latin-1'), output_offsets
+
+
+def _decompress_column_numpy(data, offsets, table):
+    """ decompress_column, all the rows at once with NumPy """
+    np = numpy
+    offsets = np.asarray(offsets, dtype=np.int64)
+    _check_offsets(offsets, len(data), offsets.ndim == 1 and not (np.diff(offsets) < 0).any())
+    base = int(offsets[0])
+    codes = np.frombuffer(data, dtype=np.uint8)[base:int(offsets[-1])]
+    bounds = offsets - base
+    codes_len = len(codes)
+
+    # Every input byte is a table code, a verbatim byte or part of an escape, and its output is looked up by kind: a
+    # table entry for the codes, rows 0-253, itself for verbatim bytes, rows 256-511, or nothing, row 512
+    rows = codes.astype(np.int16)
+    escapes = np.flatnonzero(codes >= 254)
+    if len(escapes):
+        is_run = codes[escapes] == 255
+        run_lens = codes[np.minimum(escapes + 1, codes_len - 1)].astype(np.int64) + 1
+        verbatim_starts = escapes + 1 + is_run
+        verbatim_ends = verbatim_starts + np.where(is_run, run_lens, 1)
+        value_ends = bounds[np.searchsorted(bounds, escapes, 'right')]
+
+        # A 254/255 byte is only an escape if it isn't itself verbatim, which depends on the escapes before it. Any
+        # not inside the reach of an earlier one are escapes, the rest are walked in a Python loop, one cluster of
+        # overlapping reaches at a time. Values are independent, so reaches are cut at the end of their value
+        reaches = np.maximum.accumulate(np.minimum(verbatim_ends, value_ends))
+        covered = np.zeros(len(escapes), dtype=bool)
+        covered[1:] = reaches[:-1] > escapes[1:]
+        is_escape = ~covered
+        clustered = covered.copy()
+        clustered[:-1] |= covered[1:]
+        if clustered.any():
+            indexes = np.flatnonzero(clustered).tolist()
+            flags = []
+            verbatim_pos = 0  # The end of the last verbatim run
+            for pos, end in zip(escapes[indexes].tolist(), verbatim_ends[indexes].tolist()):
+                flags.append(pos >= verbatim_pos)
+                if pos >= verbatim_pos:
+                    verbatim_pos = end
+            is_escape[indexes] = flags
+
+        escapes = escapes[is_escape]
+        is_run = is_run[is_escape]
+        verbatim_starts = verbatim_starts[is_escape]
+        verbatim_ends = verbatim_ends[is_escape]
+        if (verbatim_ends > value_ends[is_escape]).any():
+            raise ValueError('Invalid input to decompress - buffer overflow')
+        # Mark the runs with +1 at the start and -1 after the end, the running total is then 1 inside them. Runs
+        # never touch, each needs its own escape, so the indexes are unique
+        marks = np.zeros(codes_len + 1, dtype=np.int8)
+        marks[verbatim_starts] += 1
+        marks[verbatim_ends] -= 1
+        rows[np.cumsum(marks[:-1], dtype=np.int8) > 0] += 256
+        rows[escapes] = 512
+        rows[escapes[is_run] + 1] = 512
+
+    if ((rows >= len(table)) & (rows < 256)).any():
+        raise ValueError('Invalid input to decompress - code beyond the end of the table')
+
+    # Every row padded out to the longest entry, with a mask of the bytes actually in it
+    width = max([1] + [len(entry) for entry in table])
+    lookup = np.zeros((513, width), dtype=np.uint8)
+    lookup_lens = np.zeros(513, dtype=np.int64)
+    for code, entry in enumerate(table):
+        lookup[code, :len(entry)] = bytearray(entry)
+        lookup_lens[code] = len(entry)
+    lookup[256:512, 0] = np.arange(256)
+    lookup_lens[256:512] = 1
+    lookup_mask = np.arange(width) < lookup_lens[:, None]
+
+    output = np.compress(np.take(lookup_mask, rows, axis=0).ravel(), np.take(lookup, rows, axis=0).ravel())
+    output_offsets = array('q')
+    output_offsets.frombytes(np.concatenate(([0], np.cumsum(lookup_lens[rows])))[bounds].tobytes())
+    return output.tobytes(), output_offsets
+
+
+class SmazStringArray(object):
+    """ A list-like column of strings, each compressed on its own into one bytearray, with their boundaries in an
+        array('I'), which becomes an array('Q') once the data passes 4GB. a[i] decompresses just value i, slices
+        decompress just the values in the slice, and compressed(i) is a zero copy memoryview of value i, still
+        compressed. Release such views before adding more values, as a bytearray can't grow while it's exported.
+
+        Pickling with protocol 5 hands the data and offsets over as out-of-band buffers (see pickle.PickleBuffer),
+        and tobytes/frombytes give a flat serialization. Either way the loaded data isn't copied until more values are
+        added.
+
+        :param input_strs An iterable of strs to be compressed
+        :param decompress_table The decode table for compress_options' compression_tree, by default uses SMAZ
+        :param compress_options Keyword options for compress, e.g. backtracking=False or utf8=True. A value that can't
+               be compressed always raises ValueError, whatever raise_on_error is, as the array has no nulls
+    """
+
+    def __init__(self, input_strs=(), decompress_table=None, **compress_options):
+        self.decompress_table = decompress_table
+        self.compress_options = compress_options
+        self._data = bytearray()
+        self._offsets = array('I', [0])
+        self.extend(input_strs)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, item):
+        options = self._decompress_options()
+        if isinstance(item, slice):
+            data = self._data
+            offsets = self._offsets
+            return decompress_many((str(data[offsets[i]:offsets[i + 1]], 'latin-1')
+                                    for i in range(*item.indices(len(self)))), **options)
+        return decompress(str(self.compressed(item), 'latin-1'), **options)
+
+    def __iter__(self):
+        data = self._data
+        offsets = self._offsets
+        return decompress_many((str(data[offsets[i]:offsets[i + 1]], 'latin-1') for i in range(len(self))),
+                               lazy=True, **self._decompress_options())
+
+    def __reduce_ex__(self, protocol):
+        options = (self.decompress_table, self.compress_options)
+        if protocol >= 5:
+            return _rebuild_string_array, (pickle.PickleBuffer(self._data), pickle.PickleBuffer(self._offsets),
+                                           self._offsets.typecode, sys.byteorder, options)
+        return _rebuild_string_array, (bytes(self._data), bytes(memoryview(self._offsets).cast('B')),
+                                       self._offsets.typecode, sys.byteorder, options)
+
+    @property
+    def nbytes(self):
+        """ The memory used by the data and offsets, in bytes """
+        return len(self._data) + len(self._offsets) * self._offsets.itemsize
+
+    def append(self, input_str):
+        """ Compress and add a single string, raises ValueError if it can't be compressed """
+        self.extend([input_str])
+
+    def extend(self, input_strs):
+        """ Compress and add an iterable of strings, compressing them as a batch. Raises ValueError, adding none of
+            them, if any can't be compressed, as there is no null value to store in its place.
+        """
+        values = compress_many(input_strs, **self.compress_options)
+        if None in values:
+            raise ValueError('SmazStringArray value %d could not be compressed' % values.index(None))
+        self._write(values)
+
+    def append_compressed(self, compressed):
+        """ Add a value that has already been compressed (a str, as returned by compress) """
+        self._write([compressed])
+
+    def compressed(self, i):
+        """ Return value i still compressed, as a memoryview of the data """
+        length = len(self)
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError('SmazStringArray index out of range')
+        return memoryview(self._data)[self._offsets[i]:self._offsets[i + 1]]
+
+    def tobytes(self):
+        """ Serialize the values, for frombytes
+
+        :rtype: bytes
+        """
+        offsets = self._offsets
+        if sys.byteorder != 'little':
+            offsets = array(offsets.typecode, offsets)
+            offsets.byteswap()
+        flags = STRING_ARRAY_UTF8 if self.compress_options.get('utf8') else 0
+        header = _HEADER.pack(STRING_ARRAY_MAGIC, STRING_ARRAY_VERSION, offsets.typecode.encode('ascii'), flags,
+                              len(self), len(self._data))
+        return header + offsets.tobytes() + bytes(self._data)
+
+    @classmethod
+    def frombytes(cls, data, decompress_table=None, **compress_options):
+        """ Load the output of tobytes. The values are read straight out of data, without a copy, until more are
+            added. utf8 is restored from the header, as the values can't be read back without it.
+
+        :type data: bytes | bytearray | memoryview
+        :param decompress_table See SmazStringArray
+        :param compress_options See SmazStringArray
+
+        :rtype: SmazStringArray
+        """
+        data = _byte_view(data)
+        if len(data) < _HEADER.size:
+            raise ValueError('Not a SMAZ string array')
+        magic, version, typecode, flags, count, data_len = _HEADER.unpack_from(data)
+        if magic != STRING_ARRAY_MAGIC:
+            raise ValueError('Not a SMAZ string array')
+        if version != STRING_ARRAY_VERSION:
+            raise ValueError('Unsupported SMAZ string array version: %d' % version)
+        typecode = typecode.decode('ascii')
+        if typecode not in ('I', 'Q'):
+            raise ValueError('Corrupt SMAZ string array, bad offsets type')
+        offsets_end = _HEADER.size + (count + 1) * array(typecode).itemsize
+        if offsets_end + data_len != len(data):
+            raise ValueError('Corrupt SMAZ string array, bad length')
+        if flags & ~STRING_ARRAY_UTF8:
+            raise ValueError('Corrupt SMAZ string array, unknown flags: %d' % flags)
+        if flags & STRING_ARRAY_UTF8:
+            compress_options = dict(compress_options, utf8=True)
+        return _rebuild_string_array(data[offsets_end:], data[_HEADER.size:offsets_end], typecode, 'little',
+                                     (decompress_table, compress_options))
+
+    def _decompress_options(self):
+        """ The keyword options for decompress that match compress_options """
+        return dict(decompress_table=self.decompress_table, utf8=self.compress_options.get('utf8', False))
+
+    def _write(self, values):
+        data = self._data
+        if not isinstance(data, bytearray):  # Loaded without a copy, copy it now
+            data = self._data = bytearray(data)
+        output = "".join(values).encode('latin-1')
+        offsets = self._offsets
+        data_len = len(data)
+        data += output  # First, as it raises BufferError while a view of the data is held
+        if offsets.typecode == 'I' and len(data) > 0xffffffff:
+            offsets = self._offsets = array('Q', offsets)
+        for value in values:
+            data_len += len(value)
+            offsets.append(data_len)
+
+
+def _rebuild_string_array(data, offsets, typecode, byteorder, options):
+    """ Unpickle a SmazStringArray. The data is kept as it is, a read only memoryview if need be, to avoid a copy,
+        which SmazStringArray._write makes should more values be added. The offsets are copied into an array
+    """
+    string_array = SmazStringArray.__new__(SmazStringArray)
+    string_array.decompress_table, string_array.compress_options = options
+    string_array._data = data if isinstance(data, bytearray) else _byte_view(data)
+    string_array._offsets = array(typecode)
+    string_array._offsets.frombytes(_byte_view(offsets))
+    if byteorder != sys.byteorder:
+        string_array._offsets.byteswap()
+    offsets = string_array._offsets
+    if len(offsets) < 1 or offsets[-1] != len(string_array._data):
+        raise ValueError('Corrupt SMAZ string array, bad offsets')
+    return string_array
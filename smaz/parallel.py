@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Parallel batch compression for PySmaz.
+
+Shards a large list of strings into chunks and runs compress_many/decompress_many over them on a process pool (or a
+thread pool, which only pays off on a free-threaded build of CPython). Process workers hand each chunk back as one
+contiguous buffer plus an array of offsets, written to a multiprocessing.shared_memory block, rather than pickling
+millions of small strings back to the parent.
+
+compress_blocks does the same for one large text: it is cut into blocks of about BLOCK_SIZE characters, at whitespace
+so few codes are broken across a boundary, and each block is compressed on its own. SMAZ carries no state from one
+code to the next, so the blocks back to back are a normal SMAZ string that decompress reads as it is. The block index,
+where each block starts in the compressed string, is returned alongside for decompress_blocks to split it up again.
+
+Usage
+-----
+
+from smaz.parallel import compress_parallel, decompress_parallel, compress_blocks, decompress_blocks
+compressed = compress_parallel(lines)
+lines = decompress_parallel(compressed)
+
+compressed, index = compress_blocks(text)
+text = decompress_blocks(compressed, index)  # or decompress(compressed), on one core
+"""
+
+import os
+from array import array
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8, results come back pickled as a single bytes buffer instead
+    resource_tracker = shared_memory = None
+
+from smaz import compress_many, decompress_many
+
+__author__ = "Max Smith"
+
+MIN_CHUNK_SIZE = 1024     # Strings per chunk, below this the pool overhead outweighs the work
+MAX_CHUNK_SIZE = 65536    # Strings per chunk, above this the work isn't spread evenly across the workers
+CHUNKS_PER_WORKER = 4     # Gives a little load balancing when some chunks are slower than others
+BLOCK_SIZE = 262144       # Characters per block in compress_blocks, about a quarter of a second of compress
+BLOCK_SEARCH = 512        # How far back from the end of a block compress_blocks looks for whitespace to split at
+
+
+def compress_parallel(input_strs, workers=None, executor='process', chunk_size=None, **compress_options):
+    """ Compress a list of strings across a pool of workers, see compress_many for the compression options (level,
+        utf8, backtracking ...).
+
+    :param input_strs An iterable of strs to be compressed
+    :param workers Number of workers in the pool, defaults to os.cpu_count()
+    :param executor 'process', 'thread' or an existing concurrent.futures.Executor to run the chunks on
+    :param chunk_size Strings per chunk, by default picked from the number of strings and workers
+    :param compress_options Keyword options for compress_many, except lazy, the results are always a list
+
+    :type input_strs: collections.Iterable
+    :type workers: int
+    :type executor: str | concurrent.futures.Executor
+    :type chunk_size: int
+
+    :rtype: list
+    :return: The compressed strs, in input order
+    """
+    return _run(compress_many, compress_options, input_strs, workers, executor, chunk_size)
+
+
+def decompress_parallel(input_strs, workers=None, executor='process', chunk_size=None, **decompress_options):
+    """ Decompress a list of strings across a pool of workers, see decompress_many for the decompression options.
+
+    :param input_strs An iterable of SMAZ compressed strs
+    :param workers Number of workers in the pool, defaults to os.cpu_count()
+    :param executor 'process', 'thread' or an existing concurrent.futures.Executor to run the chunks on
+    :param chunk_size Strings per chunk, by default picked from the number of strings and workers
+    :param decompress_options Keyword options for decompress_many, except lazy, the results are always a list
+
+    :type input_strs: collections.Iterable
+    :type workers: int
+    :type executor: str | concurrent.futures.Executor
+    :type chunk_size: int
+
+    :rtype: list
+    :return: The decompressed strs, in input order
+    """
+    return _run(decompress_many, decompress_options, input_strs, workers, executor, chunk_size)
+
+
+def compress_blocks(input_str, workers=None, executor='process', block_size=BLOCK_SIZE, **compress_options):
+    """ Compress a large str as independent blocks across a pool of workers, see compress for the compression options.
+        The compressed string decompresses with decompress as usual, the index lets decompress_blocks do it in
+        parallel.
+
+    :param input_str The str to be compressed
+    :param workers Number of workers in the pool, defaults to os.cpu_count()
+    :param executor 'process', 'thread' or an existing concurrent.futures.Executor to run the blocks on
+    :param block_size Characters per block
+
+    :type input_str: str
+    :type workers: int
+    :type executor: str | concurrent.futures.Executor
+    :type block_size: int
+
+    :rtype: tuple
+    :return: The compressed str and an array('Q') index, block i is compressed[index[i]:index[i + 1]], or None and
+             None if a block couldn't be compressed and raise_on_error is False
+    """
+    if block_size < 1:
+        raise ValueError('block_size must be at least 1')
+    blocks = [input_str[start:end] for start, end in split_blocks(input_str, block_size)]
+    results = _run(compress_many, compress_options, blocks, workers, executor, 1)
+    if None in results:
+        return None, None
+    index = array('Q', [0])
+    for result in results:
+        index.append(index[-1] + len(result))
+    return "".join(results), index
+
+
+def decompress_blocks(input_str, index, workers=None, executor='process', **decompress_options):
+    """ Decompress the output of compress_blocks across a pool of workers, see decompress for the decompression
+        options.
+
+    :param input_str The compressed str from compress_blocks
+    :param index The block index from compress_blocks, any sequence of ints
+    :param workers Number of workers in the pool, defaults to os.cpu_count()
+    :param executor 'process', 'thread' or an existing concurrent.futures.Executor to run the blocks on
+
+    :rtype: str
+    :return: The decompressed str, or None if a block couldn't be decompressed and raise_on_error is False
+    """
+    if len(index) < 1 or index[0] != 0 or index[-1] != len(input_str) or \
+            any(start > end for start, end in zip(index, index[1:])):
+        raise ValueError('Block index does not match the compressed string')
+    blocks = [input_str[start:end] for start, end in zip(index, index[1:])]
+    results = _run(decompress_many, decompress_options, blocks, workers, executor, 1)
+    return None if None in results else "".join(results)
+
+
+def split_blocks(input_str, block_size=BLOCK_SIZE):
+    """ Yield (start, end) of blocks of input_str of at most block_size characters. Each block ends after a newline,
+        or failing that before a space, in the last BLOCK_SEARCH characters if there is one, as the codes mostly run
+        to the end of a line or start with a space (' the', ' of' ...).
+    """
+    start, length = 0, len(input_str)
+    while length - start > block_size:
+        end = start + block_size
+        floor = max(start + 1, end - BLOCK_SEARCH)
+        split = input_str.rfind('\n', floor, end) + 1 or input_str.rfind(' ', floor, end + 1)
+        if split > start:
+            end = split
+        yield start, end
+        start = end
+    if start < length:
+        yield start, length
+
+
+def pick_chunk_size(n_strs, workers):
+    """ Pick a chunk size giving each worker a few chunks, within MIN_CHUNK_SIZE and MAX_CHUNK_SIZE """
+    chunk_size = -(-n_strs // (workers * CHUNKS_PER_WORKER))
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, chunk_size))
+
+
+def _run(func, options, input_strs, workers, executor, chunk_size):
+    """ Shard input_strs into chunks, map func over them on the executor and stitch the results back together """
+    options = dict(options, lazy=False)  # The results are always a list, a worker can't hand back a generator
+    input_strs = input_strs if isinstance(input_strs, list) else list(input_strs)
+    workers = workers or os.cpu_count() or 1
+    chunk_size = chunk_size or pick_chunk_size(len(input_strs), workers)
+    if len(input_strs) <= chunk_size or (workers == 1 and not isinstance(executor, Executor)):
+        return func(input_strs, **options)  # Not worth starting a pool
+    chunks = [input_strs[i:i + chunk_size] for i in range(0, len(input_strs), chunk_size)]
+
+    owned = not isinstance(executor, Executor)
+    if executor == 'thread':
+        executor = ThreadPoolExecutor(max_workers=workers)
+    elif executor == 'process':
+        executor = ProcessPoolExecutor(max_workers=workers)
+    elif owned:
+        raise ValueError('Unknown executor: %r' % (executor,))
+
+    output = []
+    try:
+        if isinstance(executor, ThreadPoolExecutor):
+            for results in executor.map(partial(func, **options), chunks):
+                output.extend(results)
+        else:
+            futures = deque(executor.submit(_packed_chunk, func, options, chunk) for chunk in chunks)
+            try:
+                while futures:
+                    output.extend(_unpack(futures.popleft().result()))
+            finally:
+                for future in futures:  # Don't leak the blocks of any chunks we didn't get to
+                    if not future.cancel() and future.exception() is None:
+                        _release(future.result())
+    finally:
+        if owned:
+            executor.shutdown()
+    return output
+
+
+def _packed_chunk(func, options, chunk):
+    """ Worker side: run func over the chunk and pack the results """
+    return _pack(func(chunk, **options))
+
+
+def _pack(results):
+    """ Pack a list of str results into one contiguous buffer, latin-1 or, if a result has a character beyond it (from
+        decompress with utf8=True), UTF-8. Returns a tuple of the shared memory block name (or the buffer itself if
+        shared memory isn't available), the buffer size, the encoding, an array('Q') of the offsets of each result in
+        the decoded text and a list of the indices of any None results.
+    """
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        results = [result or '' for result in results]
+    offsets = array('Q', [0])
+    total = 0
+    for length in map(len, results):
+        total += length
+        offsets.append(total)
+    text = "".join(results)
+    encoding = 'latin-1'
+    try:
+        blob = text.encode(encoding)
+    except UnicodeEncodeError:
+        encoding = 'utf-8'
+        blob = text.encode(encoding, 'surrogatepass')
+    if shared_memory is None or not blob:
+        return blob, len(blob), encoding, offsets, missing
+    shm = _create_block(len(blob))
+    try:
+        shm.buf[:len(blob)] = blob
+    except Exception:
+        shm.close()
+        shm.unlink()
+        raise
+    name = shm.name
+    shm.close()
+    return name, len(blob), encoding, offsets, missing
+
+
+def _create_block(size):
+    """ Create a shared memory block the worker's resource tracker won't unlink when the worker exits, the parent owns
+        the block and unlinks it once it has been read.
+    """
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unpack(packed):
+    """ Parent side: turn a packed chunk back into a list of strs, releasing its shared memory block """
+    source, size, encoding, offsets, missing = packed
+    if isinstance(source, bytes):
+        text = source.decode(encoding, 'surrogatepass')
+    else:
+        shm = shared_memory.SharedMemory(name=source)
+        try:
+            with shm.buf[:size] as view:
+                text = str(view, encoding, 'surrogatepass')
+        finally:
+            shm.close()
+            shm.unlink()
+    results = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+    for i in missing:
+        results[i] = None
+    return results
+
+
+def _release(packed):
+    """ Release the shared memory block of a packed chunk that won't be unpacked """
+    source = packed[0]
+    if not isinstance(source, bytes):
+        shm = shared_memory.SharedMemory(name=source)
+        shm.close()
+        shm.unlink()
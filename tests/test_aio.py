@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Unit tests for the asyncio helpers
+"""
+
+from unittest import TestCase
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from smaz import compress, compress_many
+from smaz.aio import compress_async, decompress_async, compress_many_async, decompress_many_async, \
+    SmazStreamReader, SmazStreamWriter
+
+from tests.test_smaz import TEST_DATA_LIST, MOBYDICK_CHAPTER1
+
+__author__ = "Max Smith"
+
+
+def run(coroutine):
+    """ Run a coroutine on a new event loop """
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+class TestAio(TestCase):
+    def test_compress_async(self):
+        async def go():
+            for test in ('the end', MOBYDICK_CHAPTER1):
+                self.assertEqual(compress(test), await compress_async(test))
+                self.assertEqual(compress(test, backtracking=False), await compress_async(test, backtracking=False))
+                self.assertEqual(test, await decompress_async(await compress_async(test, inline_len=0)))
+            with ThreadPoolExecutor(2) as executor:
+                self.assertEqual(compress(MOBYDICK_CHAPTER1), await compress_async(MOBYDICK_CHAPTER1, executor))
+        run(go())
+
+    def test_compress_many_async(self):
+        strs = [test or '' for test in TEST_DATA_LIST] + MOBYDICK_CHAPTER1.split('\n')
+
+        async def go():
+            compressed = await compress_many_async(strs, chunk_size=7, concurrency=2)
+            self.assertEqual(compress_many(strs), compressed)
+            self.assertEqual(strs, await decompress_many_async(compressed, chunk_size=7, concurrency=2))
+            self.assertEqual(compress_many(['the end']), await compress_many_async(iter(['the end'])))
+            self.assertEqual([], await compress_many_async([]))
+            with self.assertRaises(ValueError):
+                await compress_many_async(strs, concurrency=0)
+
+            # The loop keeps running while a big batch is compressed
+            ticks = []
+
+            async def tick():
+                while True:
+                    ticks.append(None)
+                    await asyncio.sleep(0)
+            ticker = asyncio.ensure_future(tick())
+            await compress_many_async(strs * 5, chunk_size=50, concurrency=1)
+            ticker.cancel()
+            self.assertTrue(len(ticks) > 1)
+        run(go())
+
+    def test_streams(self):
+        async def go():
+            received = []
+
+            async def handle(reader, writer):
+                async for text in SmazStreamReader(reader, read_size=100):
+                    received.append(text)
+                writer.close()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            async with SmazStreamWriter(writer, inline_len=100) as smaz_writer:
+                for line in MOBYDICK_CHAPTER1.split('\n'):
+                    await smaz_writer.write(line + '\n')
+                await smaz_writer.write('')
+            await asyncio.sleep(0.1)
+            server.close()
+            await server.wait_closed()
+            self.assertEqual(MOBYDICK_CHAPTER1 + '\n', "".join(received))
+        run(go())
+
+    def test_stream_reader(self):
+        compressed = compress(MOBYDICK_CHAPTER1).encode('latin-1')
+
+        async def go():
+            stream = asyncio.StreamReader()
+            stream.feed_data(compressed)
+            stream.feed_eof()
+            reader = SmazStreamReader(stream, read_size=7)
+            self.assertEqual(MOBYDICK_CHAPTER1[:5], await reader.read(5))
+            self.assertEqual(MOBYDICK_CHAPTER1[5:], await reader.read())
+            self.assertTrue(reader.at_eof())
+            self.assertEqual('', await reader.read(5))
+
+            stream = asyncio.StreamReader()
+            stream.feed_data(compressed[:-1] + b'\xff\x05ab')  # Stops part way through a verbatim string
+            stream.feed_eof()
+            with self.assertRaises(ValueError):
+                await SmazStreamReader(stream).read()
+        run(go())
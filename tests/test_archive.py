@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Unit tests for the random access archive
+"""
+
+from unittest import TestCase, skipIf
+import os
+import shutil
+import sys
+import tempfile
+
+from smaz import compress
+from smaz.archive import SmazArchiveWriter, SmazArchiveReader
+
+from tests.test_smaz import TEST_DATA_LIST, MOBYDICK_CHAPTER1
+
+__author__ = "Max Smith"
+
+
+@skipIf(sys.version_info < (3,), 'smaz.archive needs Python 3')
+class TestArchive(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.smaza')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        lines = MOBYDICK_CHAPTER1.split('\n')
+        strs = [test or '' for test in TEST_DATA_LIST]
+        with SmazArchiveWriter(self.filename, backtracking=False) as writer:
+            writer.extend(lines)
+            for test in strs:
+                writer.append(test)
+            writer.append_compressed(compress('the end'))
+            self.assertEqual(len(lines) + len(strs) + 1, len(writer))
+        expected = lines + strs + ['the end']
+        with SmazArchiveReader(self.filename) as reader:
+            self.assertEqual(len(expected), len(reader))
+            self.assertEqual(expected, list(reader))
+            for i in (0, 1, 17, len(lines), len(expected) - 1, -1, -len(expected)):
+                self.assertEqual(expected[i], reader[i])
+            self.assertEqual(expected[5:40:3], reader[5:40:3])
+            self.assertEqual(expected[-3:], reader[-3:])
+            self.assertEqual(compress(lines[3], backtracking=False), reader.compressed(3))
+            self.assertRaises(IndexError, reader.__getitem__, len(expected))
+            self.assertRaises(IndexError, reader.__getitem__, -len(expected) - 1)
+
+    def test_failed_records(self):
+        """ Strings that can't be compressed are skipped and reported, not stored as empty records """
+        with SmazArchiveWriter(self.filename, raise_on_error=False) as writer:
+            self.assertEqual([1, 3], writer.extend(['the', chr(200), 'end', u'caf\xe9']))
+            self.assertEqual(False, writer.append(chr(200)))
+            self.assertEqual(True, writer.append(''))
+        with SmazArchiveReader(self.filename) as reader:
+            self.assertEqual(['the', 'end', ''], list(reader))
+        with SmazArchiveWriter(self.filename) as writer:
+            self.assertRaises(ValueError, writer.extend, ['the', chr(200)])
+            self.assertRaises(ValueError, writer.append, chr(200))
+            self.assertEqual(0, len(writer))
+
+    def test_empty(self):
+        SmazArchiveWriter(self.filename).close()
+        with SmazArchiveReader(self.filename) as reader:
+            self.assertEqual(0, len(reader))
+            self.assertEqual([], list(reader))
+            self.assertEqual([], reader[:])
+
+    def test_bad_files(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'not an archive, not at all')
+        self.assertRaises(ValueError, SmazArchiveReader, self.filename)
+        writer = SmazArchiveWriter(self.filename)
+        writer.append('the end')
+        writer._file.flush()  # Never closed, so there's no index
+        self.assertRaises(ValueError, SmazArchiveReader, self.filename)
+        writer.close()
+        with SmazArchiveReader(self.filename) as reader:
+            self.assertEqual(['the end'], list(reader))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Unit tests for the benchmark suite
+"""
+
+from unittest import TestCase, skipIf
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from smaz.bench import main, run, make_samples, percentile, ALL_CORPORA
+
+__author__ = "Max Smith"
+
+
+@skipIf(sys.version_info < (3,), 'smaz.bench needs Python 3')
+class TestBench(TestCase):
+    def test_run(self):
+        results = run(buckets=['1-8', '9-64'], engines=['smaz', 'smaz-bytewise', 'zlib'], corpora=['alice29.txt'],
+                      budget=0, samples=20)
+        self.assertEqual(2 * (2 + 1 + 2), len(results['results']))
+        for result in results['results']:
+            self.assertEqual('alice29.txt', result['corpus'])
+            self.assertTrue(result['calls'] >= 20)
+            self.assertTrue(result['latency_us']['p50'] <= result['latency_us']['p99'] <= result['latency_us']['p100'])
+        smaz_results = [result for result in results['results'] if result['engine'] == 'smaz']
+        self.assertTrue(all(result['ratio'] < 1 for result in smaz_results))
+        self.assertEqual(['compress', 'decompress'] * 2, [result['operation'] for result in smaz_results])
+        self.assertEqual(['decompress'] * 2, [result['operation'] for result in results['results']
+                                              if result['engine'] == 'smaz-bytewise'])
+
+        big = run(buckets=['5MB'], engines=['zlib'], corpora=['fields.c'], budget=0)['results']
+        self.assertEqual([ALL_CORPORA] * 2, [result['corpus'] for result in big])
+        self.assertEqual([1, 1], [result['calls'] for result in big])
+        self.assertEqual(5 << 20, big[0]['input_bytes'])
+        self.assertRaises(ValueError, run, corpora=['missing.txt'])
+
+    def test_samples(self):
+        text = 'the quick brown fox jumps over the lazy dog'
+        samples = make_samples(text, 1, 8, 50, random.Random(1))
+        self.assertEqual(samples, make_samples(text, 1, 8, 50, random.Random(1)))
+        self.assertTrue(all(1 <= len(sample) <= 8 and sample in text for sample in samples))
+        self.assertEqual(100, len(make_samples(text, 100, 100, 1, random.Random(1))[0]))
+        self.assertEqual(3, percentile([1, 2, 3, 4, 5], 50))
+        self.assertEqual(5, percentile([1, 2, 3, 4, 5], 100))
+
+    def test_main(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'bench.json')
+            self.assertEqual(0, main(['-b', '1-8', '-e', 'smaz', '-c', 'fields.c', '--budget', '0', '--samples', '5',
+                                      '--json', filename]))
+            with open(filename) as f:
+                results = json.load(f)
+            self.assertEqual(2, len(results['results']))
+            self.assertEqual(5, results['samples'])
+        finally:
+            shutil.rmtree(tmpdir)
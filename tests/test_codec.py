@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Unit tests for the smaz codec
+"""
+
+from unittest import TestCase, skipIf
+import codecs
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+from smaz import compress, decompress
+import smaz.codec  # noqa: F401, registers the smaz codec
+
+from tests.test_smaz import TEST_DATA_LIST, MOBYDICK_CHAPTER1
+
+__author__ = "Max Smith"
+
+
+@skipIf(sys.version_info < (3,), 'smaz.codec needs Python 3')
+class TestCodec(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'moby.smaz')
+        self.lines = MOBYDICK_CHAPTER1.splitlines(True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookup(self):
+        self.assertEqual('smaz', codecs.lookup('SMAZ').name)
+        for test in TEST_DATA_LIST:
+            if test:
+                self.assertEqual(compress(test).encode('latin-1'), test.encode('smaz'))
+                self.assertEqual(test, compress(test).encode('latin-1').decode('smaz'))
+        self.assertEqual(b'', ''.encode('smaz'))
+        self.assertEqual('', b''.decode('smaz'))
+        self.assertEqual('the end', codecs.decode(memoryview(compress('the end').encode('latin-1')), 'smaz'))
+
+    def test_errors(self):
+        self.assertRaises(UnicodeEncodeError, u'caf\xe9'.encode, 'smaz')
+        self.assertEqual('caf?', u'caf\xe9'.encode('smaz', 'replace').decode('smaz'))
+        self.assertEqual('caf', u'caf\xe9'.encode('smaz', 'ignore').decode('smaz'))
+        for bad in (b'\xfe', b'\xff\x05abc', b'\xffabc'):
+            self.assertRaises(UnicodeDecodeError, bad.decode, 'smaz')
+            self.assertRaises(UnicodeDecodeError, codecs.getincrementaldecoder('smaz')().decode, bad, True)
+
+    def test_incremental_encoder(self):
+        # sync=False carries the compressor state across chunks, the output is identical to a single compress
+        text = MOBYDICK_CHAPTER1[:1000]
+        for chunk_size in (1, 7, 100):
+            chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+            self.assertEqual(compress(text, pathological_case_detection=False).encode('latin-1'),
+                             b"".join(codecs.iterencode(chunks, 'smaz', sync=False)))
+
+        encoder = codecs.getincrementalencoder('smaz')(sync=False)
+        self.assertEqual(b'', encoder.encode('the'))
+        self.assertEqual(compress('the end').encode('latin-1'), encoder.encode(' end', final=True))
+        encoder.encode('junk')
+        encoder.reset()
+        self.assertEqual(compress('the end').encode('latin-1'), encoder.encode('the end', final=True))
+
+        # By default each chunk is complete
+        encoder = codecs.getincrementalencoder('smaz')()
+        self.assertEqual(compress('the').encode('latin-1'), encoder.encode('the'))
+        compressed = b"".join(codecs.iterencode(self.lines, 'smaz'))
+        self.assertEqual(MOBYDICK_CHAPTER1, decompress(compressed.decode('latin-1')))
+        self.assertTrue(len(compressed) < len(compress(MOBYDICK_CHAPTER1)) * 1.01)
+
+    def test_incremental_decoder(self):
+        compressed = compress(MOBYDICK_CHAPTER1 + '\xfe\xff 12345', check_ascii=False).encode('latin-1')
+        for chunk_size in (1, 2, 7, 100):
+            chunks = [compressed[i:i + chunk_size] for i in range(0, len(compressed), chunk_size)]
+            self.assertEqual(MOBYDICK_CHAPTER1 + '\xfe\xff 12345', "".join(codecs.iterdecode(chunks, 'smaz')))
+
+        # The state of a part decoded escape carries over to a new decoder
+        compressed = compress('1234567', check_ascii=False).encode('latin-1')  # A 255 verbatim string
+        for split in range(len(compressed)):
+            decoder = codecs.getincrementaldecoder('smaz')()
+            output = decoder.decode(compressed[:split])
+            state = decoder.getstate()
+            decoder = codecs.getincrementaldecoder('smaz')()
+            decoder.setstate(state)
+            self.assertEqual('1234567', output + decoder.decode(compressed[split:], final=True))
+            self.assertEqual((b'', 0), decoder.getstate())
+        decoder.setstate((b'\xfe', 0))
+        self.assertEqual('\xfe', decoder.decode(b'\xfe', final=True))
+
+    def test_open(self):
+        with open(self.filename, 'w', encoding='smaz') as f:
+            for line in self.lines:
+                f.write(line)
+        with open(self.filename, encoding='smaz') as f:
+            self.assertEqual(self.lines, list(f))
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(MOBYDICK_CHAPTER1, decompress(f.read().decode('latin-1')))
+
+        # Reading back a line at a time, with tell and seek
+        with open(self.filename, encoding='smaz') as f:
+            f.readline()
+            position = f.tell()
+            rest = f.read()
+            f.seek(position)
+            self.assertEqual(rest, f.read())
+
+    def test_streams(self):
+        stream = io.BytesIO()
+        writer = codecs.getwriter('smaz')(stream)
+        writer.writelines(self.lines)
+        stream.seek(0)
+        self.assertEqual(self.lines, codecs.getreader('smaz')(stream).readlines())
+
+        stream = io.BytesIO(compress(MOBYDICK_CHAPTER1).encode('latin-1'))
+        reader = codecs.getreader('smaz')(stream)
+        self.assertEqual(MOBYDICK_CHAPTER1[:10], reader.read(10))
+        self.assertEqual(MOBYDICK_CHAPTER1[10:], reader.read())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Unit tests for the columnar decoder
+"""
+
+from unittest import TestCase, skipIf
+from array import array
+import pickle
+import random
+import sys
+
+from smaz import compress, compress_bytes, make_trie
+from smaz.column import decompress_column, numpy, SmazStringArray
+
+from tests.test_smaz import TEST_DATA_LIST, MOBYDICK_CHAPTER1
+
+__author__ = "Max Smith"
+
+
+def make_column(values):
+    """ The compressed values back to back, and their offsets """
+    compressed = [compress_bytes(value, check_ascii=False) for value in values]
+    offsets = [0]
+    for sstr in compressed:
+        offsets.append(offsets[-1] + len(sstr))
+    return b''.join(compressed), offsets
+
+
+@skipIf(sys.version_info < (3,), 'smaz.column needs Python 3')
+class TestColumn(TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        self.values = [line.encode('ascii') for line in MOBYDICK_CHAPTER1.split('\n')]
+        self.values += [test.encode('ascii') for test in TEST_DATA_LIST if test]
+        self.values += [bytes(bytearray(rng.getrandbits(7) for _ in range(rng.randint(0, 600)))) for _ in range(200)]
+        self.values += [b'', b'', b'the end', b'']
+        self.use_numpy = [False] if numpy is None else [False, True]
+
+    def assertColumn(self, values, column):
+        data, offsets = column
+        self.assertEqual('q', offsets.typecode)
+        self.assertEqual(len(values) + 1, len(offsets))
+        self.assertEqual(0, offsets[0])
+        self.assertEqual(len(data), offsets[-1])
+        self.assertEqual(values, [data[offsets[i]:offsets[i + 1]] for i in range(len(values))])
+
+    def test_round_trip(self):
+        data, offsets = make_column(self.values)
+        for use_numpy in self.use_numpy:
+            self.assertColumn(self.values, decompress_column(data, offsets, use_numpy=use_numpy))
+            self.assertColumn(self.values, decompress_column(bytearray(data), array('Q', offsets),
+                                                             use_numpy=use_numpy))
+            self.assertColumn([], decompress_column(b'', [0], use_numpy=use_numpy))
+            self.assertColumn([b''], decompress_column(data, [5, 5], use_numpy=use_numpy))
+            # A slice of the column, as Arrow does, with junk either side
+            sliced = [offset + 1 for offset in offsets[3:11]]
+            self.assertColumn(self.values[3:10], decompress_column(b'\xff' + data + b'\xff', sliced,
+                                                                   use_numpy=use_numpy))
+
+    def test_verbatim_escape_bytes(self):
+        """ 254 and 255 bytes inside verbatim runs aren't escapes """
+        values = [b'\xfe', b'\xff\xff', b'\xfe\xff\xfe the \xff', b'the\xfe', b'\xff' * 300, b'1\xfe2\xff3']
+        data, offsets = make_column(values)
+        for use_numpy in self.use_numpy:
+            self.assertColumn(values, decompress_column(data, offsets, use_numpy=use_numpy))
+
+    def test_decompress_table(self):
+        table = ['0', '1', '2', '12', '\xfe']
+        tree = make_trie(table)
+        values = [b'1212', b'0\xfe\xfe0', b'abc']
+        compressed = [compress_bytes(value, check_ascii=False, compression_tree=tree) for value in values]
+        data = b''.join(compressed)
+        offsets = [0, len(compressed[0]), len(compressed[0]) + len(compressed[1]), len(data)]
+        for use_numpy in self.use_numpy:
+            self.assertColumn(values, decompress_column(data, offsets, table, use_numpy=use_numpy))
+            self.assertRaises(ValueError, decompress_column, b'\x00\x05', [0, 2], table, use_numpy=use_numpy)
+
+    def test_bad_input(self):
+        for use_numpy in self.use_numpy:
+            for data, offsets in ((b'\xff\x05abc', [0, 5]), (b'\xfe', [0, 1]), (b'\xff', [0, 1]),
+                                  (b'\xfeab\xfe', [0, 1, 4]), (b'\xff\x01ab', [0, 3, 4]),
+                                  (b'the', []), (b'the', [0, 4]), (b'the', [2, 1]), (b'the', [-1, 2])):
+                self.assertRaises(ValueError, decompress_column, data, offsets, use_numpy=use_numpy)
+
+    @skipIf(numpy is None, 'needs NumPy')
+    def test_numpy(self):
+        data, offsets = make_column(self.values)
+        self.assertEqual(decompress_column(data, offsets, use_numpy=False),
+                         decompress_column(data, numpy.array(offsets, dtype=numpy.int32), use_numpy=True))
+
+
+@skipIf(sys.version_info < (3,), 'smaz.column needs Python 3')
+class TestSmazStringArray(TestCase):
+    def setUp(self):
+        self.values = MOBYDICK_CHAPTER1.split('\n') + [test or '' for test in TEST_DATA_LIST]
+
+    def assertValues(self, values, string_array):
+        self.assertEqual(len(values), len(string_array))
+        self.assertEqual(values, list(string_array))
+        self.assertEqual(values, string_array[:])
+        for i in (0, 1, 17, len(values) - 1, -1, -len(values)) if values else ():
+            self.assertEqual(values[i], string_array[i])
+        self.assertEqual(values[5:40:3], string_array[5:40:3])
+
+    def test_round_trip(self):
+        string_array = SmazStringArray(self.values[:10], backtracking=False)
+        string_array.extend(self.values[10:-1])
+        string_array.append(self.values[-1])
+        string_array.append_compressed(compress('the end'))
+        self.assertValues(self.values + ['the end'], string_array)
+        self.assertEqual(compress(self.values[3], backtracking=False), string_array.compressed(3).tobytes().decode(
+            'latin-1'))
+        self.assertTrue(isinstance(string_array.compressed(3), memoryview))
+        self.assertRaises(IndexError, string_array.__getitem__, len(string_array))
+        self.assertRaises(IndexError, string_array.compressed, -len(string_array) - 1)
+        self.assertTrue(string_array.nbytes < sum(len(compress(value)) + 4 for value in self.values) + 20)
+        self.assertValues([], SmazStringArray())
+
+        utf8 = SmazStringArray([u'caf\xe9', u'na\xefve'], utf8=True)
+        self.assertEqual([u'caf\xe9', u'na\xefve'], list(utf8))
+        self.assertEqual([u'caf\xe9', u'na\xefve'], list(pickle.loads(pickle.dumps(utf8))))
+
+    def test_failed_values(self):
+        """ A value that can't be compressed raises rather than being stored as an empty string """
+        string_array = SmazStringArray(['the'], raise_on_error=False)
+        self.assertRaises(ValueError, string_array.append, chr(200))
+        self.assertRaises(ValueError, string_array.extend, ['end', chr(200), 'of'])
+        self.assertRaises(ValueError, SmazStringArray, ['the', u'caf\xe9'])
+        self.assertEqual(['the'], list(string_array))
+
+    def test_custom_table(self):
+        table = ['0', '1', '2', '12']
+        string_array = SmazStringArray(['1212', '0120'], decompress_table=table, compression_tree=make_trie(table))
+        self.assertEqual(b'\x03\x03', string_array.compressed(0).tobytes())
+        self.assertEqual(['1212', '0120'], list(string_array))
+
+    def test_serialization(self):
+        string_array = SmazStringArray(self.values)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertValues(self.values, pickle.loads(pickle.dumps(string_array, protocol)))
+
+        # Out-of-band, the data isn't copied into the pickle
+        if pickle.HIGHEST_PROTOCOL >= 5:
+            buffers = []
+            pickled = pickle.dumps(string_array, 5, buffer_callback=buffers.append)
+            self.assertEqual(2, len(buffers))
+            self.assertTrue(len(pickled) < 200)
+            loaded = pickle.loads(pickled, buffers=[buffer.raw() for buffer in buffers])
+            self.assertValues(self.values, loaded)
+            loaded.append('the end')  # Copies the data, which was read only
+            self.assertValues(self.values + ['the end'], loaded)
+            self.assertValues(self.values, string_array)
+
+        data = string_array.tobytes()
+        self.assertValues(self.values, SmazStringArray.frombytes(data))
+        self.assertValues(self.values, SmazStringArray.frombytes(bytearray(data)))
+        self.assertValues([], SmazStringArray.frombytes(SmazStringArray().tobytes()))
+        for bad in (b'', b'not a string array at all, no', data[:-1], data + b'\0', data[:4] + b'\x09' + data[5:],
+                    data[:6] + b'\x02' + data[7:]):
+            self.assertRaises(ValueError, SmazStringArray.frombytes, bad)
+
+        # utf8 is kept in the header, the values would read back as mojibake without it
+        utf8 = SmazStringArray([u'caf\xe9', u'prix 5\u20ac', 'the end'], utf8=True)
+        loaded = SmazStringArray.frombytes(utf8.tobytes())
+        self.assertEqual([u'caf\xe9', u'prix 5\u20ac', 'the end'], list(loaded))
+        loaded.append(u'na\xefve')
+        self.assertEqual(u'na\xefve', loaded[-1])
+
+    def test_exported_views(self):
+        string_array = SmazStringArray(['the end'])
+        view = string_array.compressed(0)
+        self.assertRaises(BufferError, string_array.append, 'more')
+        view.release()
+        string_array.append('more')
+        self.assertEqual(['the end', 'more'], list(string_array))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Unit tests for the python -m smaz command line interface
+"""
+
+from unittest import TestCase
+import io
+import os
+import shutil
+import tempfile
+
+from smaz import compress, decompress
+from smaz.__main__ import main, encode_varint, iter_records, iter_lines, write_records, RECORD_MAGIC, \
+                          RECORD_VERSION
+
+from tests.test_smaz import MOBYDICK_CHAPTER1
+
+__author__ = "Max Smith"
+
+
+class TestMain(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.text_file = self._here('moby.txt')
+        with open(self.text_file, 'wb') as f:
+            f.write(MOBYDICK_CHAPTER1.encode('latin-1'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _here(self, *x):
+        return os.path.join(self.tmpdir, *x)
+
+    def _read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_stream_mode(self):
+        self.assertEqual(0, main([self.text_file, '-o', self._here('moby.smaz')]))
+        self.assertEqual(compress(MOBYDICK_CHAPTER1).encode('latin-1'), self._read(self._here('moby.smaz')))
+        self.assertEqual(0, main(['-d', self._here('moby.smaz'), '-o', self._here('moby.out')]))
+        self.assertEqual(self._read(self.text_file), self._read(self._here('moby.out')))
+
+    def test_record_mode(self):
+        for jobs in ('1', '2'):
+            self.assertEqual(0, main(['-r', '-j', jobs, self.text_file, '-o', self._here('moby.smazr')]))
+            with open(self._here('moby.smazr'), 'rb') as f:
+                records = [record for block in iter_records(f) for record in block]
+            lines = MOBYDICK_CHAPTER1.split('\n')  # Ends with a newline, so an empty record
+            self.assertEqual([compress(line) for line in lines], [record.decode('latin-1') for record in records])
+            self.assertEqual(0, main(['-d', '-r', '-j', jobs, self._here('moby.smazr'), '-o', self._here('moby.out')]))
+            self.assertEqual(self._read(self.text_file), self._read(self._here('moby.out')))
+
+    def test_non_ascii(self):
+        """ Bytes that aren't ASCII are carried verbatim, in both modes """
+        text = 'caf\xc3\xa9 na\xefve\nthe \xe2\x82\xac end'.encode('latin-1')
+        with open(self._here('utf8.txt'), 'wb') as f:
+            f.write(text)
+        for mode in ([], ['-r']):
+            self.assertEqual(0, main(mode + [self._here('utf8.txt'), '-o', self._here('utf8.smaz')]))
+            self.assertEqual(0, main(mode + ['-d', self._here('utf8.smaz'), '-o', self._here('utf8.out')]))
+            self.assertEqual(text, self._read(self._here('utf8.out')))
+
+    def test_concatenated(self):
+        """ Inputs are compressed as one, records carry on across the files, and the last newline is kept as it was """
+        with open(self._here('a.txt'), 'wb') as f:
+            f.write(b'the\nend\nof')
+        with open(self._here('b.txt'), 'wb') as f:
+            f.write(b' the\nworld\n')
+        for mode in ([], ['-r']):
+            self.assertEqual(0, main(mode + [self._here('a.txt'), self._here('b.txt'), '-o', self._here('ab.smaz')]))
+            self.assertEqual(0, main(mode + ['-d', self._here('ab.smaz'), '-o', self._here('ab.out')]))
+            self.assertEqual(b'the\nend\nof the\nworld\n', self._read(self._here('ab.out')))
+            self.assertEqual(0, main(mode + [self._here('a.txt'), '-o', self._here('a.smaz')]))
+            self.assertEqual(0, main(mode + ['-d', self._here('a.smaz'), self._here('a.smaz'), '-o',
+                                             self._here('aa.out')]))
+            self.assertEqual(b'the\nend\nofthe\nend\nof', self._read(self._here('aa.out')))
+        self.assertEqual(0, main(['-r', self._here('a.txt'), '-o', self._here('a.smazr')]))
+        with open(self._here('a.smazr'), 'rb') as f:
+            self.assertEqual(3, sum(len(block) for block in iter_records(f)))
+
+    def test_errors(self):
+        """ A failure leaves no output behind, and an existing output as it was """
+        self.assertEqual(1, main(['-d', '-r', self.text_file, '-o', self._here('bad.out')]))
+        self.assertEqual(1, main([self._here('missing.txt'), '-o', self._here('bad.smaz')]))
+        self.assertEqual(['moby.txt'], os.listdir(self.tmpdir))
+        self.assertEqual(1, main(['-d', '-r', self._here('missing.txt'), '-o', self.text_file]))
+        self.assertEqual(MOBYDICK_CHAPTER1.encode('latin-1'), self._read(self.text_file))
+        self.assertEqual(0, main([self.text_file, '-o', self._here('moby.smaz')]))
+        self.assertEqual(0o666 & ~self._umask(), os.stat(self._here('moby.smaz')).st_mode & 0o777)
+
+    @staticmethod
+    def _umask():
+        umask = os.umask(0)
+        os.umask(umask)
+        return umask
+
+    def test_records(self):
+        self.assertEqual(b'\x00', encode_varint(0))
+        self.assertEqual(b'\x7f', encode_varint(127))
+        self.assertEqual(b'\x80\x01', encode_varint(128))
+        self.assertEqual(b'\xe5\x8e\x26', encode_varint(624485))
+        records = [b'', b'a' * 127, b'b' * 128, b'c' * 70000, compress('the end').encode('latin-1')]
+        stream = io.BytesIO()
+        stream.write(RECORD_MAGIC + bytes(bytearray([RECORD_VERSION])))
+        write_records(stream, records)
+        stream.seek(0)
+        self.assertEqual(records, [record for block in iter_records(stream) for record in block])
+        truncated = io.BytesIO(stream.getvalue()[:-1])
+        self.assertRaises(ValueError, list, iter_records(truncated))
+        self.assertEqual([b'a', b'', b'b'], [line for block in iter_lines(io.BytesIO(b'a\n\nb')) for line in block])
+        self.assertEqual('the end', decompress(records[-1].decode('latin-1')))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Unit tests for the parallel batch executor
+"""
+
+from unittest import TestCase
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from smaz import compress, compress_many, decompress, decompress_many
+from smaz.parallel import compress_parallel, decompress_parallel, pick_chunk_size, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, \
+    compress_blocks, decompress_blocks, split_blocks
+
+from tests.test_smaz import TEST_DATA_LIST, MOBYDICK_CHAPTER1
+
+__author__ = "Max Smith"
+
+TEST_STRS = [MOBYDICK_CHAPTER1[i:i + length] for length in (1, 7, 30, 120) for i in range(0, 2500, 3)] + \
+            list(TEST_DATA_LIST)
+
+
+class TestParallel(TestCase):
+    def test_process_pool(self):
+        """ Results should match compress_many, in order, whatever the chunking """
+        expected = compress_many(TEST_STRS)
+        self.assertEqual(expected, compress_parallel(TEST_STRS, workers=2, chunk_size=500))
+        self.assertEqual(TEST_STRS, decompress_parallel(expected, workers=2, chunk_size=333))
+
+    def test_thread_pool(self):
+        expected = compress_many(TEST_STRS, backtracking=False)
+        self.assertEqual(expected, compress_parallel(iter(TEST_STRS), workers=3, executor='thread', chunk_size=700,
+                                                     backtracking=False))
+        self.assertEqual(TEST_STRS, decompress_parallel(expected, workers=3, executor='thread', chunk_size=700))
+
+    def test_existing_executor(self):
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(compress_many(TEST_STRS), compress_parallel(TEST_STRS, executor=executor,
+                                                                         chunk_size=1000))
+
+    def test_errors(self):
+        bad = TEST_STRS + [chr(200)]
+        self.assertRaises(ValueError, compress_parallel, bad, workers=2, chunk_size=1000)
+        self.assertEqual(None, compress_parallel(bad, workers=2, chunk_size=1000, raise_on_error=False)[-1])
+        self.assertEqual(decompress_many([chr(255) + chr(255)] * 3000, raise_on_error=False),
+                         decompress_parallel([chr(255) + chr(255)] * 3000, workers=2, raise_on_error=False))
+        self.assertRaises(ValueError, compress_parallel, TEST_STRS, workers=2, executor='fibers', chunk_size=1000)
+
+    def test_options(self):
+        """ Any compress_many / decompress_many option passes through to the workers """
+        expected = compress_many(TEST_STRS, level=3)
+        self.assertEqual(expected, compress_parallel(TEST_STRS, workers=2, chunk_size=1000, level=3))
+        self.assertEqual(TEST_STRS, decompress_parallel(expected, workers=2, chunk_size=1000, run_decoding=False))
+        text = [u'caf\xe9 ' + (s or '') for s in TEST_STRS]
+        expected = compress_many(text, utf8=True)
+        self.assertEqual(expected, compress_parallel(text, workers=2, executor='thread', chunk_size=1000, utf8=True))
+        self.assertEqual(text, decompress_parallel(expected, workers=2, chunk_size=1000, utf8=True))
+
+    def test_beyond_latin1(self):
+        """ Decompressed text outside latin-1 comes back from the process workers as UTF-8 """
+        text = [u'prix 5€ ' + (s or '') for s in TEST_STRS] + [u'the \U0001f600 end']
+        compressed = compress_many(text, utf8=True)
+        for executor in ('process', 'thread'):
+            self.assertEqual(text, decompress_parallel(compressed, workers=2, executor=executor, chunk_size=1000,
+                                                       utf8=True))
+
+    def test_lazy(self):
+        """ lazy is ignored, a list comes back from the pool and from a single chunk alike """
+        expected = compress_many(TEST_STRS)
+        for executor in ('process', 'thread'):
+            self.assertEqual(expected, compress_parallel(TEST_STRS, workers=2, executor=executor, chunk_size=500,
+                                                         lazy=True))
+            self.assertEqual(TEST_STRS, decompress_parallel(expected, workers=2, executor=executor, chunk_size=500,
+                                                            lazy=True))
+        self.assertEqual(expected[:10], compress_parallel(TEST_STRS[:10], lazy=True))
+
+    def test_pick_chunk_size(self):
+        self.assertEqual(MIN_CHUNK_SIZE, pick_chunk_size(10, 8))
+        self.assertEqual(MAX_CHUNK_SIZE, pick_chunk_size(10 ** 9, 8))
+        self.assertEqual(31250, pick_chunk_size(10 ** 6, 8))
+
+    def test_blocks(self):
+        text = MOBYDICK_CHAPTER1 * 3
+        self.assertEqual(text, "".join(text[start:end] for start, end in split_blocks(text, 1000)))
+        self.assertTrue(all(end - start <= 1000 for start, end in split_blocks(text, 1000)))
+        self.assertEqual([(0, 3), (3, 6), (6, 7)], list(split_blocks('abcdefg', 3)))
+        self.assertEqual([(0, 3), (3, 8)], list(split_blocks('the cat ', 5)))  # ' cat' stays together
+        self.assertEqual([], list(split_blocks('', 5)))
+
+        compressed, index = compress_blocks(text, workers=2, block_size=1000)
+        self.assertEqual(text, decompress(compressed))
+        self.assertEqual(len(index) - 1, len(list(split_blocks(text, 1000))))
+        self.assertTrue(len(compressed) < len(compress(text)) * 1.01)
+        self.assertEqual(text, decompress_blocks(compressed, index, workers=2))
+        self.assertEqual(text, decompress_blocks(compressed, list(index), workers=3, executor='thread'))
+        self.assertEqual((compress(text), array('Q', [0, len(compress(text))])), compress_blocks(text, workers=2))
+        self.assertEqual(('', array('Q', [0])), compress_blocks(''))
+        self.assertEqual('', decompress_blocks('', [0]))
+
+        utf8_text = u'prix 5€, caf\xe9 \U0001f600\n' * 200
+        compressed, index = compress_blocks(utf8_text, workers=2, block_size=1000, utf8=True)
+        self.assertEqual(utf8_text, decompress(compressed, utf8=True))
+        self.assertEqual(utf8_text, decompress_blocks(compressed, index, workers=2, utf8=True))
+
+        self.assertRaises(ValueError, compress_blocks, text, block_size=0)
+        self.assertEqual((None, None), compress_blocks(text + chr(200), workers=2, block_size=1000,
+                                                       raise_on_error=False))
+        for bad in ([], [1, len(compressed)], [0, len(compressed) - 1], [0, 200, 100, len(compressed)]):
+            self.assertRaises(ValueError, decompress_blocks, compressed, bad)
@@ -12,12 +12,19 @@ import zlib
 import datetime
 import itertools
 import random
+import subprocess
 import sys
 import os
 
+import smaz
 from smaz import compress, decompress, _encapsulate, DECODE, _check_ascii, \
                  make_trie, SMAZ_TREE, _worst_size, _encapsulate_list, \
-                 compress_no_backtracking, compress_classic
+                 compress_no_backtracking, compress_classic, compress_bytes, decompress_bytes, \
+                 decompress_runs, compress_many, decompress_many, SmazCompressor, \
+                 BACKTRACK_LIMIT, SmazDecompressor, train, make_state_machine, _state_machine, \
+                 _STATE_MACHINES, make_regex, SmazCache, SmazStats, estimate_size, is_worth_compressing, \
+                 adaptive_compress, adaptive_decompress, ADAPTIVE_RAW, ADAPTIVE_SMAZ_CLASSIC, ADAPTIVE_SMAZ, \
+                 ADAPTIVE_ZLIB, _check_ascii_bytes, _runs_pay_off
 
 
 __author__ = "Max Smith"
@@ -664,10 +671,395 @@ class TestSmaz(TestSmazBase):
         self.assertRaises(ValueError, decompress, singlebyte_non_ascii, raise_on_error=True, check_ascii=True)
         self.assertEqual(decompress(singlebyte_non_ascii, raise_on_error=False, check_ascii=True), None)
 
+    def test_bytes_api(self):
+        """ The bytes entry points should match the str API byte for byte, for any buffer protocol input """
+        for test in TEST_DATA_LIST:
+            if not test:
+                continue
+            expected = fixstr(compress(test))
+            raw = test.encode('latin-1')
+            for buf in (raw, bytearray(raw), memoryview(raw)):
+                compressed = compress_bytes(buf)
+                self.assertTrue(isinstance(compressed, bytes))
+                self.assertEqual(expected, compressed)
+                self.assertEqual(raw, decompress_bytes(bytearray(compressed)))
+                self.assertEqual(raw, decompress_bytes(memoryview(compressed)))
+            self.assertEqual(fixstr(compress(test, backtracking=False)),
+                             compress_bytes(raw, backtracking=False))
+        self.assertEqual(b'', compress_bytes(b''))
+        self.assertEqual(b'', decompress_bytes(bytearray()))
+        self.assertRaises(ValueError, compress_bytes, b'\x81')
+        self.assertEqual(None, compress_bytes(b'\x81', raise_on_error=False))
+        self.assertRaises(ValueError, decompress_bytes, b'\xff\xff')
+        self.assertEqual(None, decompress_bytes(b'\xff\xff', raise_on_error=False))
+        self.assertEqual(None, decompress_bytes(b'\xfe\x81', raise_on_error=False, check_ascii=True))
+
+    def test_decompress_runs(self):
+        """ The run level decoder should agree with the byte at a time decoder, including on bad data """
+        for test in TEST_DATA_LIST + (MOBYDICK_CHAPTER1, "".join(DECODE)):
+            compressed = compress(test)
+            self.assertEqual(test, decompress_runs(compressed))
+            self.assertEqual(decompress(compressed, run_decoding=False), decompress_runs(compressed))
+        self.assertEqual(MOBYDICK_CHAPTER1, decompress_runs(compress(MOBYDICK_CHAPTER1), decompress_table=DECODE))
+        bad_data = (chr(255) + chr(255), 'abc' + chr(254), 'abc' + chr(255) + chr(5) + 'ab' + chr(254) + 'c',
+                    'abc' + chr(255) + chr(10) + 'abc')
+        for test in bad_data:
+            self.assertRaises(ValueError, decompress_runs, test)
+            self.assertEqual(None, decompress_runs(test, raise_on_error=False))
+        self.assertRaises(ValueError, decompress_runs, 'a' + chr(5), decompress_table=['a', 'b', 'c', 'd', 'e'])
+        non_ascii = chr(1) + chr(255) + chr(1) + chr(200) + chr(200)
+        self.assertEqual('the' + chr(200) + chr(200), decompress_runs(non_ascii))
+        self.assertEqual(None, decompress_runs(non_ascii, raise_on_error=False, check_ascii=True))
+
+        # Only long inputs with few escapes go to the run decoder
+        self.assertTrue(_runs_pay_off(compress(MOBYDICK_CHAPTER1)))
+        self.assertFalse(_runs_pay_off(compress('the end')))
+        self.assertFalse(_runs_pay_off(compress(' the 1' * 50)))  # A 254 escape every 4 bytes
+        self.assertFalse(_runs_pay_off(compress('the end;{}' * 30)))  # A 255 escape every 8 bytes
+
+    def test_many(self):
+        """ The batch functions should give the same results as a call per string """
+        tests = list(TEST_DATA_LIST) + [MOBYDICK_CHAPTER1]
+        expected = [compress(test) for test in tests]
+        self.assertEqual(expected, compress_many(tests))
+        self.assertEqual(expected, list(compress_many(iter(tests), lazy=True)))
+        self.assertEqual([compress(test, backtracking=False) for test in tests],
+                         compress_many(tests, backtracking=False))
+        self.assertEqual(tests, decompress_many(expected))
+        self.assertEqual(tests, decompress_many(expected, run_decoding=False))
+        self.assertEqual(tests, list(decompress_many(iter(expected), decompress_table=DECODE, lazy=True)))
+        self.assertEqual([], compress_many([]))
+        self.assertRaises(ValueError, compress_many, ['abc', chr(129)])
+        self.assertEqual([compress('abc'), None], compress_many(['abc', chr(129)], raise_on_error=False))
+        self.assertRaises(ValueError, decompress_many, [compress('abc'), chr(255) + chr(255)])
+        self.assertEqual(['abc', None, None],
+                         decompress_many([compress('abc'), chr(255) + chr(255), chr(254) + chr(129)],
+                                         raise_on_error=False, check_ascii=True))
+
+    def test_smaz_compressor(self):
+        """ Streaming the input through a SmazCompressor in any size of chunk gives the same output as compress """
+        tests = [test for test in TEST_DATA_LIST if test] + [MOBYDICK_CHAPTER1, 'the' * 1000, '@' * 1000,
+                                                              ('@' * 200 + ' ') * 10]
+        for test in tests:
+            for chunk_size in (1, 2, 7, 100, 5000):
+                for backtracking in (True, False):
+                    compressor = SmazCompressor(backtracking=backtracking, pathological_case_detection=False)
+                    output = [compressor.compress(test[i:i + chunk_size]) for i in xrange(0, len(test), chunk_size)]
+                    output.append(compressor.flush())
+                    self.assertEqual(compress(test, backtracking=backtracking, pathological_case_detection=False),
+                                     "".join(output))
+            compressor = SmazCompressor()
+            output = compressor.compress(test) + compressor.flush()
+            self.assertEqual(test, decompress(output))
+            if len(test) <= BACKTRACK_LIMIT:  # Nothing is returned before flush, so pathological detection applies
+                self.assertEqual(compress(test), output)
+
+    def test_smaz_compressor_bounded(self):
+        """ The compressor shouldn't hold on to more than about backtrack_limit characters of state """
+        for text in (MOBYDICK_CHAPTER1 * 3, 'the' * 10000, '@' * 30000):
+            compressor = SmazCompressor()
+            for i in xrange(0, len(text), 1000):
+                compressor.compress(text[i:i + 1000])
+                self.assertTrue(len(compressor._buffer) + len(compressor._unmatched) + len(compressor._enc_buf) +
+                                len(compressor._backtrack_buff) < 1000)
+        compressor = SmazCompressor()
+        self.assertEqual('', compressor.flush())
+        self.assertRaises(ValueError, compressor.compress, 'the')
+        self.assertRaises(ValueError, SmazCompressor().compress, chr(129))
+
+    def test_smaz_decompressor(self):
+        """ Chunks can be cut anywhere, including inside escapes, and max_length is honoured """
+        tests = [test for test in TEST_DATA_LIST if test] + [MOBYDICK_CHAPTER1]
+        for test in tests:
+            compressed = compress(test)
+            for chunk_size in (1, 2, 3, 100, 5000):
+                for max_length in (0, 1, 5, 64):
+                    decompressor = SmazDecompressor()
+                    output = []
+                    for i in xrange(0, len(compressed), chunk_size):
+                        output.append(decompressor.decompress(compressed[i:i + chunk_size], max_length))
+                        while decompressor.unconsumed_tail:
+                            output.append(decompressor.decompress(decompressor.unconsumed_tail, max_length))
+                        if max_length:
+                            self.assertTrue(all(len(piece) <= max_length for piece in output))
+                    self.assertFalse(decompressor.eof)
+                    output.append(decompressor.flush())
+                    self.assertTrue(decompressor.eof)
+                    self.assertEqual(test, "".join(output))
+
+    def test_smaz_decompressor_bad_data(self):
+        for truncated in (chr(254), chr(255), chr(255) + chr(10) + 'abc'):
+            decompressor = SmazDecompressor()
+            decompressor.decompress(truncated)
+            self.assertRaises(ValueError, decompressor.flush)
+        self.assertRaises(ValueError, SmazDecompressor(decompress_table=['a', 'b']).decompress, chr(3))
+        self.assertRaises(ValueError, SmazDecompressor(check_ascii=True).decompress, chr(254) + chr(129))
+        self.assertRaises(ValueError, SmazDecompressor().decompress, 'abc', -1)
+        decompressor = SmazDecompressor()
+        decompressor.flush()
+        self.assertRaises(ValueError, decompressor.decompress, 'abc')
+
+    def test_train(self):
+        lines = MOBYDICK_CHAPTER1.split('\n')
+        report = {}
+        table = train(lines, max_entries=200, max_len=5, report=report)
+        self.assertTrue(0 < len(table) <= 200)
+        self.assertEqual(len(table), len(set(table)))
+        self.assertTrue(max(len(entry) for entry in table) <= 5)
+        self.assertEqual(len(lines), report['samples'])
+        self.assertEqual(len(MOBYDICK_CHAPTER1) - len(lines) + 1, report['bytes'])
+        self.assertEqual(len(lines) // 10, report['validation_samples'])
+        self.assertTrue(0 < report['ratio'] < 1)
+        self.assertTrue(0 < report['default_ratio'] < 1)
+        tree = make_trie(table)
+        for line in lines:
+            self.assertEqual(line, decompress(compress(line, compression_tree=tree), decompress_table=table))
+
+        # Pruning keeps the counts bounded, and a single long sample is counted a block at a time
+        whole = train([MOBYDICK_CHAPTER1])
+        block_len, smaz.TRAIN_BLOCK_LEN = smaz.TRAIN_BLOCK_LEN, 1000
+        try:
+            self.assertEqual(whole, train([MOBYDICK_CHAPTER1]))
+        finally:
+            smaz.TRAIN_BLOCK_LEN = block_len
+        pruned = train(lines, max_candidates=2000)
+        self.assertTrue(0 < len(pruned) <= 253)
+        self.assertEqual([], train([]))
+        # The held back samples aren't counted
+        self.assertFalse(any('xyz' in entry for entry in train(['abcabc'] * 9 + ['xyz' * 5])))
+        self.assertTrue(any('xyz' in entry for entry in train(['abcabc'] * 9 + ['xyz' * 5], validation_bytes=0)))
+        report = {}
+        train(lines, validation_bytes=0, report=report)
+        self.assertEqual((0, None), (report['validation_samples'], report['ratio']))
+        self.assertRaises(ValueError, train, lines, max_entries=255)
+
+    def test_state_machine(self):
+        """ The state machine and the trie should give identical output """
+        transitions, terminals = make_state_machine(SMAZ_TREE)
+        self.assertEqual(0, len(transitions) % 128)
+        self.assertEqual(len(transitions), len(terminals))
+        self.assertEqual(DECODE.index('the'), terminals[transitions[transitions[ord('t')] + ord('h')] + ord('e')])
+        self.assertEqual(-1, terminals[ord('q')])
+        self.assertEqual(0, transitions[ord('q')])
+
+        custom_table = train(MOBYDICK_CHAPTER1.split('\n'))
+        custom_tree = make_trie(custom_table)
+        tests = [MOBYDICK_CHAPTER1[i:i + length] for length in (1, 5, 40, 300) for i in range(0, 3000, 7)]
+        with_machine = [(compress(test), compress_classic(test), compress(test, compression_tree=custom_tree))
+                        for test in tests]
+        self.assertTrue(_state_machine(SMAZ_TREE))
+        try:
+            _STATE_MACHINES[id(SMAZ_TREE)] = (SMAZ_TREE, None)  # Force the trie
+            _STATE_MACHINES[id(custom_tree)] = (custom_tree, None)
+            self.assertEqual(with_machine, [(compress(test), compress_classic(test),
+                                             compress(test, compression_tree=custom_tree)) for test in tests])
+        finally:
+            _STATE_MACHINES.clear()
+
+        # Non-ASCII trees and input use the trie
+        self.assertEqual(None, make_state_machine(make_trie(['a', 'b' + chr(200)])))
+        self.assertEqual('the' + chr(200), decompress(compress('the' + chr(200), check_ascii=False)))
+
+    def test_regex_engine(self):
+        """ The regex engine should be byte identical to the trie """
+        tests = [MOBYDICK_CHAPTER1[i:i + length] for length in (1, 5, 40, 300) for i in range(0, 3000, 7)] + \
+                [MOBYDICK_CHAPTER1, 'Y OF', 'http://www.example.com/?q=' + 'x' * 600, '\r\n\r\n', '\x00\xfe\xff']
+        for test in tests:
+            for pathological_case_detection in (True, False):
+                self.assertEqual(compress_classic(test, pathological_case_detection),
+                                 compress_classic(test, pathological_case_detection, engine='regex'))
+        self.assertEqual('', compress_classic('', engine='regex'))
+
+        custom_table = train(MOBYDICK_CHAPTER1.split('\n'))
+        custom_regex = make_regex(custom_table)
+        for test in tests:
+            self.assertEqual(test, decompress(compress_classic(test, compression_regex=custom_regex),
+                                              decompress_table=custom_table))
+        self.assertRaises(ValueError, compress_classic, 'the end', engine='fibers')
+
+    def test_levels(self):
+        tests = [MOBYDICK_CHAPTER1[i:i + length] for length in (1, 5, 40, 300) for i in range(0, 3000, 7)] + \
+                [MOBYDICK_CHAPTER1, 'Y OF', 'sits', 'http://www.example.com/?q=' + 'x' * 600, '\x00\x7f~' * 100]
+        for test in tests:
+            outputs = [compress(test, level=level) for level in range(4)]
+            for output in outputs:
+                self.assertEqual(test, decompress(output))
+            self.assertEqual(compress_classic(test), outputs[0])
+            self.assertEqual(compress(test), outputs[1])
+            self.assertTrue(len(outputs[3]) <= min(len(output) for output in outputs))
+            self.assertTrue(len(outputs[3]) <= _worst_size(len(test)))
+        self.assertEqual(2, len(compress('sits', level=2)))
+        self.assertEqual(3, len(compress('sits', level=1)))
+        self.assertEqual(6, len(compress('Y OF', level=3, pathological_case_detection=False)))  # No growth
+        self.assertEqual([compress(test, level=3) for test in tests], compress_many(tests, level=3))
+        custom_table = train(MOBYDICK_CHAPTER1.split('\n'))
+        custom_tree = make_trie(custom_table)
+        for test in tests:
+            self.assertEqual(test, decompress(compress(test, compression_tree=custom_tree, level=3),
+                                              decompress_table=custom_table))
+        self.assertRaises(ValueError, compress, 'the end', level=4)
+
+    def test_smaz_cache(self):
+        cache = SmazCache(maxsize=3, max_item_len=20)
+        for test in ['the end', 'of the', 'the end', 'Y OF', 'the end', 'moby', 'of the']:
+            self.assertEqual(compress(test), cache.compress(test))
+        self.assertEqual((2, 5, 2, 3, 3), cache.compress_info())  # of the was evicted by moby
+        long_str = MOBYDICK_CHAPTER1[:100]
+        self.assertEqual(compress(long_str), cache.compress(long_str))
+        self.assertEqual(3, cache.compress_info().currsize)  # Not admitted
+
+        # The options are part of the key
+        self.assertEqual(compress('Y OF', level=3), cache.compress('Y OF', level=3))
+        self.assertEqual(compress('Y OF', pathological_case_detection=False),
+                         cache.compress('Y OF', pathological_case_detection=False))
+        custom_table = train(MOBYDICK_CHAPTER1.split('\n'))
+        custom_tree = make_trie(custom_table)
+        compressed = cache.compress('the end', compression_tree=custom_tree)
+        self.assertEqual(compress('the end', compression_tree=custom_tree), compressed)
+        self.assertEqual('the end', cache.decompress(compressed, decompress_table=custom_table))
+        self.assertEqual('the end', cache.decompress(compress('the end')))
+        self.assertEqual((0, 2, 0, 3, 2), cache.decompress_info())
+
+        # Trees and tables are held while an entry keyed on them is, and released when the last one is evicted
+        self.assertEqual({id(custom_tree): [custom_tree, 1], id(custom_table): [custom_table, 1]}, cache._pinned)
+        cache.compress('of the', compression_tree=custom_tree)
+        self.assertEqual(2, cache._pinned[id(custom_tree)][1])
+        for test in ['the', 'end', 'moby']:
+            cache.compress(test)
+        self.assertEqual([id(custom_table)], list(cache._pinned))
+        for test in ['the', 'end', 'moby']:
+            cache.decompress(compress(test))
+        self.assertEqual({}, cache._pinned)
+
+        self.assertEqual(None, cache.compress('caf\xe9', raise_on_error=False))
+        self.assertRaises(ValueError, cache.compress, 'caf\xe9')
+        cache.clear()
+        self.assertEqual((0, 0, 0, 3, 0), cache.compress_info())
+        self.assertRaises(ValueError, SmazCache, maxsize=0)
+
+    def test_stats(self):
+        stats = SmazStats()
+        self.assertEqual(compress('the the the'), compress('the the the', stats=stats))
+        self.assertEqual([(' th', 1), ('e t', 1), ('he', 1), ('the', 1)], sorted(stats.top_entries()))
+        self.assertEqual((1, 11, 4, 4, 12, 3.0), (stats.calls, stats.input_bytes, stats.output_bytes, stats.searches,
+                                                  stats.search_depth, stats.mean_search_depth))
+
+        stats.reset()
+        self.assertEqual(None, stats.ratio)
+        self.assertEqual(compress_classic('Y OF'), compress_classic('Y OF', stats=stats))
+        self.assertEqual((1, 1, 4), (stats.pathological, stats.verbatim_runs, stats.verbatim_bytes))
+
+        # Output identical to the uninstrumented code, on every path
+        stats.reset()
+        tests = [MOBYDICK_CHAPTER1[i:i + length] for length in (1, 5, 40, 300) for i in range(0, 3000, 7)]
+        for test in tests:
+            for level in (None, 0, 1, 2, 3):
+                self.assertEqual(compress(test, level=level), compress(test, level=level, stats=stats))
+            self.assertEqual(compress(test, backtracking=False), compress(test, backtracking=False, stats=stats))
+            self.assertEqual(compress_classic(test), compress_classic(test, stats=stats))
+            self.assertEqual(compress_classic(test), compress_classic(test, engine='regex', stats=stats))
+        self.assertEqual(len(tests) * 8, stats.calls)
+        self.assertTrue(stats.merges and stats.unmerges and stats.defers)
+        self.assertTrue(sum(stats.code_hits) + stats.verbatim_bytes + stats.verbatim_runs <= stats.output_bytes <=
+                        sum(stats.code_hits) + stats.verbatim_bytes + 2 * stats.verbatim_runs)
+        self.assertEqual(set(['calls', 'input_bytes', 'output_bytes', 'code_hits', 'verbatim_bytes', 'verbatim_runs',
+                              'merges', 'unmerges', 'defers', 'pathological', 'searches', 'search_depth', 'ratio',
+                              'mean_search_depth']), set(stats.as_dict()))
+
+    def test_estimate_size(self):
+        self.assertEqual(0, estimate_size(''))
+        self.assertFalse(is_worth_compressing(''))
+        # Verbatim runs are costed exactly
+        for test in ('1', '12', '1234567890' * 30, 'ABC'):
+            self.assertEqual(len(compress(test)), estimate_size(test))
+        self.assertEqual(4, estimate_size(b'\x80\x81'))
+        self.assertEqual(estimate_size('the end'), estimate_size(b'the end'))
+        self.assertEqual(6, estimate_size(u'\xe9\xe9'))  # As UTF-8
+
+        # Close to the real size, and agrees on whether to compress
+        tests = [MOBYDICK_CHAPTER1[i:i + length] for length in (5, 40, 300) for i in range(0, 3000, 7)]
+        rng = random.Random(1)
+        tests += [str(rng.randint(0, 10 ** 12)) for _ in range(100)]
+        tests += ['%x' % rng.getrandbits(64) for _ in range(100)]
+        agree = error = 0
+        for test in tests:
+            compressed_len = len(compress(test))
+            agree += (compressed_len <= 0.9 * len(test)) == is_worth_compressing(test)
+            error += abs(estimate_size(test) - compressed_len) / float(len(test))
+        self.assertTrue(agree > 0.9 * len(tests))
+        self.assertTrue(error < 0.1 * len(tests))
+        self.assertTrue(is_worth_compressing('the quick brown fox jumps over the lazy dog'))
+        self.assertFalse(is_worth_compressing('4f3a9b2c77d1e0aa'))
+
+        # A custom table
+        table = ['0', '1', '2', '12']
+        self.assertEqual(3, estimate_size('a12', decompress_table=table))
+        self.assertTrue(is_worth_compressing('1212', 0.9, table))
+
+    def test_adaptive(self):
+        tests = {
+            '': ADAPTIVE_RAW,
+            '4f3a9b2c77d1e0aa': ADAPTIVE_RAW,
+            u'caf\xe9': ADAPTIVE_RAW,
+            'the end': ADAPTIVE_SMAZ_CLASSIC,
+            'the quick brown fox jumps over the lazy dog': ADAPTIVE_SMAZ_CLASSIC,
+            'see http://www.google.com/search?q=Smith&page=2': ADAPTIVE_SMAZ,
+            MOBYDICK_CHAPTER1: ADAPTIVE_ZLIB,
+            u'caf\xe9 ' * 100: ADAPTIVE_ZLIB,
+        }
+        for test, codec in tests.items():
+            compressed = adaptive_compress(test)
+            self.assertEqual(codec, bytearray(compressed)[0])
+            self.assertEqual(test, adaptive_decompress(compressed))
+            self.assertEqual(test, adaptive_decompress(bytearray(compressed)))
+        self.assertEqual(fixstr(compress('the end')), adaptive_compress('the end')[1:])
+        self.assertTrue(len(adaptive_compress(MOBYDICK_CHAPTER1)) < len(compress(MOBYDICK_CHAPTER1)))
+
+        # Never bigger than the raw text and a byte
+        for test in TEST_DATA_LIST:
+            if test:
+                self.assertTrue(len(adaptive_compress(test)) <= len(test) + 1)
+                self.assertEqual(test, adaptive_decompress(adaptive_compress(test)))
+
+        self.assertRaises(ValueError, adaptive_decompress, b'')
+        self.assertRaises(ValueError, adaptive_decompress, b'\x09abc')
+        self.assertRaises(ValueError, adaptive_decompress, b'\x03abc')
+
+    def test_utf8(self):
+        tests = [u'caf\xe9', u'\u65e5\u672c\u8a9e', u'the \U0001f600 end', u'na\xefve r\xe9sum\xe9 of the caf\xe9' * 20]
+        for test in tests:
+            self.assertRaises(ValueError, compress, test)
+            compressed = compress(test, utf8=True)
+            self.assertEqual(test, decompress(compressed, utf8=True))
+            self.assertEqual(test, decompress(compressed, utf8=True, run_decoding=False))
+            self.assertEqual(test.encode('utf-8'), fixstr(decompress(compressed)))
+            self.assertEqual(compressed, compress(test, check_ascii=False, utf8=True))
+            for level in (0, 2, 3):
+                self.assertEqual(test, decompress(compress(test, level=level, utf8=True), utf8=True))
+        self.assertEqual(compress('the end'), compress('the end', utf8=True))
+        self.assertEqual(tests, decompress_many(compress_many(tests, utf8=True), utf8=True))
+        self.assertEqual([None], compress_many([u'caf\xe9'], raise_on_error=False))
+        self.assertRaises(ValueError, decompress, chr(254) + chr(0xc3), utf8=True)  # Truncated UTF-8
+        self.assertEqual(None, decompress(chr(254) + chr(0xe9), raise_on_error=False, utf8=True))
+        self.assertRaises(ValueError, decompress_many, [chr(254) + chr(0xe9)], utf8=True)
+
+    def test_lazy_tree(self):
+        """ SMAZ_TREE is built on first use, not at import, where there's a module __getattr__ (Python 3.7+) """
+        code = "import smaz, sys; assert ('SMAZ_TREE' in vars(smaz)) == (sys.version_info < (3, 7)); " \
+               "smaz.decompress(smaz.compress('the end')); assert 'SMAZ_TREE' in vars(smaz)"
+        self.assertEqual(0, subprocess.call([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))))
+        self.assertTrue(SMAZ_TREE is smaz.SMAZ_TREE)
+        self.assertEqual(make_trie(DECODE), SMAZ_TREE)
+
     def test_ascii_check(self):
         """ Test the ascii check """
         self.assertTrue(_check_ascii('1230ABCZADSADW'))
         self.assertFalse(_check_ascii(chr(129) + chr(129)))
+        self.assertTrue(_check_ascii_bytes(memoryview(b'the end')))
+        self.assertTrue(_check_ascii_bytes(memoryview(b'\x80the end')[1:]))
+        self.assertFalse(_check_ascii_bytes(memoryview(b'the end\x80')))
+        self.assertFalse(_check_ascii_bytes(bytearray(b'\xff')))
         self.assertEquals(None, compress(chr(129), raise_on_error=False))
 
     def test_make_trie(self):
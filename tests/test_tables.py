@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Unit tests for the precompiled table artifacts
+"""
+
+from unittest import TestCase, skipIf
+import os
+import shutil
+import sys
+import tempfile
+
+from smaz import compress, decompress, make_trie, train, DECODE, SMAZ_TREE
+from smaz.tables import dumps_table, loads_table, save_table, load_table
+
+from tests.test_smaz import MOBYDICK_CHAPTER1
+
+__author__ = "Max Smith"
+
+
+@skipIf(sys.version_info < (3,), 'smaz.tables needs Python 3')
+class TestTables(TestCase):
+    def test_round_trip(self):
+        table, tree = loads_table(dumps_table(DECODE))
+        self.assertEqual(DECODE, table)
+        self.assertEqual(SMAZ_TREE, tree)
+        self.assertEqual(compress(MOBYDICK_CHAPTER1), compress(MOBYDICK_CHAPTER1, compression_tree=tree))
+
+        lines = MOBYDICK_CHAPTER1.split('\n')
+        trained = train(lines)
+        table, tree = loads_table(dumps_table(trained, make_trie(trained)))
+        self.assertEqual(trained, table)
+        for line in lines:
+            self.assertEqual(line, decompress(compress(line, compression_tree=tree), decompress_table=table))
+
+    def test_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'default.smazt')
+            save_table(filename, DECODE)
+            self.assertEqual((DECODE, SMAZ_TREE), load_table(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_bad_data(self):
+        data = dumps_table(DECODE)
+        self.assertRaises(ValueError, loads_table, b'SMZ')
+        self.assertRaises(ValueError, loads_table, b'ZIP!' + data[4:])
+        self.assertRaises(ValueError, loads_table, data[:4] + b'\x63' + data[5:])
+        self.assertRaises(ValueError, loads_table, data[:-2])
+        self.assertRaises(ValueError, loads_table, data[:100] + bytes(bytearray([data[100] ^ 1])) + data[101:])